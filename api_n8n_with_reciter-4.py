@@ -5,7 +5,8 @@ Compatible avec https://alquran.cloud/api
 Usage: python3 api_n8n.py
 """
 
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, send_file, jsonify, Response
+import click
 from werkzeug.utils import secure_filename
 import os
 import subprocess
@@ -17,11 +18,23 @@ import uuid
 from datetime import datetime
 import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from urllib.parse import urlparse
 import sys
 import time
-from collections import deque
+from collections import deque, OrderedDict
+from itertools import islice
 import builtins
+import sqlite3
+import hashlib
+import heapq
+import shutil
+import fcntl
+import socket
+import atexit
 
 # ============================================
 # RATE LIMITING POUR RAILWAY (CRITIQUE!)
@@ -89,7 +102,6 @@ def sanitize_filename(filename):
     return filename
 from unicodedata import normalize
 import random
-import glob
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500 MB
@@ -97,11 +109,15 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
 app.config['TEMP_FOLDER'] = 'temp'
 app.config['BACKGROUNDS_FOLDER'] = 'backgrounds'  # Fonds par défaut
+app.config['DATA_FOLDER'] = os.environ.get('DATA_FOLDER', 'data')  # État partagé entre workers
+# tmpfs (RAM) pour les petits fichiers intermédiaires des jobs (ASS, audio), ex: /dev/shm/quran-video
+app.config['WORKSPACE_TMPFS'] = os.environ.get('WORKSPACE_TMPFS', '')
 
 # Créer les dossiers
 for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'], 
-               app.config['TEMP_FOLDER'], app.config['BACKGROUNDS_FOLDER']]:
-    Path(folder).mkdir(exist_ok=True)
+               app.config['TEMP_FOLDER'], app.config['BACKGROUNDS_FOLDER'],
+               app.config['DATA_FOLDER']] + ([app.config['WORKSPACE_TMPFS']] if app.config['WORKSPACE_TMPFS'] else []):
+    Path(folder).mkdir(parents=True, exist_ok=True)
 
 # Configuration par défaut
 DEFAULT_CONFIG = {
@@ -141,8 +157,1028 @@ DEFAULT_CONFIG = {
     "resolution": "1080p",  # Options: 1080p, 720p, vertical, square, 4k
 }
 
-# Stockage des jobs
-jobs = {}
+# Résolutions de sortie supportées
+RESOLUTIONS = {
+    '1080p': {'width': 1920, 'height': 1080, 'name': '1080p (16:9 YouTube)'},
+    '720p': {'width': 1280, 'height': 720, 'name': '720p (16:9 Standard)'},
+    'vertical': {'width': 1080, 'height': 1920, 'name': 'Vertical Full HD (9:16 TikTok/Reels/Shorts)'},
+    'square': {'width': 1080, 'height': 1080, 'name': 'Carré Full HD (1:1 Instagram)'},
+    '4k': {'width': 3840, 'height': 2160, 'name': '4K (16:9 Ultra HD)'}
+}
+
+def config_resolutions(config):
+    """Résolutions demandées: config.resolution peut être une liste (plusieurs formats, un seul décodage)"""
+    resolution = config.get('resolution', '1080p')
+    if isinstance(resolution, (list, tuple)):
+        return list(dict.fromkeys(resolution)) or ['1080p']
+    return [resolution]
+
+def resolution_label(config):
+    """Libellé de la (des) résolution(s) pour les métriques et statistiques"""
+    return '+'.join(config_resolutions(config))
+
+def normalize_resolutions(config):
+    """
+    Valide une liste de résolutions (ValueError si inconnue), sans doublon
+    Une liste d'un seul élément redevient une résolution simple
+    """
+    if not isinstance(config.get('resolution'), (list, tuple)):
+        return config
+    resolutions = config_resolutions(config)
+    unknown = [r for r in resolutions if r not in RESOLUTIONS]
+    if unknown:
+        raise ValueError(f"Résolution(s) inconnue(s): {', '.join(map(str, unknown))} "
+                         f"(disponibles: {', '.join(RESOLUTIONS)})")
+    config['resolution'] = resolutions if len(resolutions) > 1 else resolutions[0]
+    return config
+
+# Presets de qualité (champ "quality" des requêtes)
+QUALITY_PRESETS = {
+    'draft': {'crf': 28, 'preset': 'ultrafast'},
+    'fast': {'crf': 23, 'preset': 'fast'},
+    'standard': {'crf': 21, 'preset': 'medium'},
+    'hq': {'crf': 18, 'preset': 'slow'}
+}
+
+# Pool de rendu (1 encode par paire de vCPU; leurs threads sont répartis par l'ordonnanceur CPU)
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['RENDER_QUEUE_SIZE'] = int(os.environ.get('RENDER_QUEUE_SIZE', 20))
+
+# Caches disque (rendus, médias...): taille max en octets, 0 = désactivé
+app.config['CACHE_FOLDER'] = os.environ.get('CACHE_FOLDER', 'cache')
+app.config['RENDER_CACHE_MAX_BYTES'] = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 5 * 2**30))
+app.config['MEDIA_CACHE_MAX_BYTES'] = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 2 * 2**30))
+app.config['MEDIA_CACHE_TTL'] = int(os.environ.get('MEDIA_CACHE_TTL', 24 * 3600))  # Avant revalidation
+app.config['AUDIO_CACHE_MAX_BYTES'] = int(os.environ.get('AUDIO_CACHE_MAX_BYTES', 512 * 2**20))  # Pistes AAC préparées
+app.config['LOOP_CACHE_MAX_BYTES'] = int(os.environ.get('LOOP_CACHE_MAX_BYTES', 2 * 2**30))  # Segments de boucle
+# Téléchargements: threads de fetch, connexions max par hôte, retries
+app.config['FETCH_WORKERS'] = int(os.environ.get('FETCH_WORKERS', 8))
+app.config['HTTP_POOL_PER_HOST'] = int(os.environ.get('HTTP_POOL_PER_HOST', 4))
+app.config['HTTP_RETRIES'] = int(os.environ.get('HTTP_RETRIES', 3))
+app.config['RANGE_MAX_AYAHS'] = int(os.environ.get('RANGE_MAX_AYAHS', 300))  # Plages d'ayahs par job
+# Webhooks de fin de job (callback_url): threads d'envoi, file max, retries, timeout (s), délai max entre essais (s)
+app.config['WEBHOOK_WORKERS'] = int(os.environ.get('WEBHOOK_WORKERS', 2))
+app.config['WEBHOOK_QUEUE_SIZE'] = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+app.config['WEBHOOK_RETRIES'] = int(os.environ.get('WEBHOOK_RETRIES', 5))
+app.config['WEBHOOK_TIMEOUT'] = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+app.config['WEBHOOK_MAX_BACKOFF'] = float(os.environ.get('WEBHOOK_MAX_BACKOFF', 300))
+# Stockage des vidéos: quota (octets) et âge max (secondes) de outputs/, 0 = illimité
+app.config['OUTPUT_MAX_BYTES'] = int(os.environ.get('OUTPUT_MAX_BYTES', 0))
+app.config['OUTPUT_MAX_AGE'] = int(os.environ.get('OUTPUT_MAX_AGE', 0))
+app.config['MIN_FREE_BYTES'] = int(os.environ.get('MIN_FREE_BYTES', 2**30))  # Réserve avant d'accepter un job
+app.config['STORAGE_SWEEP_INTERVAL'] = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 60))
+# Catalogue des vidéos (index de outputs/): fichier SQLite partagé, ou ":memory:" (mono-process)
+app.config['OUTPUT_CATALOG_PATH'] = os.environ.get(
+    'OUTPUT_CATALOG_PATH', str(Path(app.config['DATA_FOLDER']) / 'outputs.db'))
+# Corpus coranique local (SQLite), édition par défaut des endpoints AlQuran
+app.config['QURAN_CORPUS_PATH'] = os.environ.get(
+    'QURAN_CORPUS_PATH', str(Path(app.config['DATA_FOLDER']) / 'quran.db'))
+app.config['QURAN_DEFAULT_EDITION'] = os.environ.get('QURAN_DEFAULT_EDITION', 'quran-uthmani')
+app.config['MEZZANINE_ENABLED'] = os.environ.get('MEZZANINE_ENABLED', 'true').lower() == 'true'
+# Encodage par morceaux en parallèle pour les longues récitations (0 = désactivé)
+app.config['CHUNK_MIN_DURATION'] = float(os.environ.get('CHUNK_MIN_DURATION', 600))  # Secondes d'audio
+app.config['CHUNK_WORKERS'] = int(os.environ.get('CHUNK_WORKERS', os.cpu_count() or 2))
+# Cœurs de l'hôte répartis entre les encodages en cours de tous les workers (défaut: cœurs disponibles)
+app.config['ENCODE_CPU_BUDGET'] = int(os.environ.get('ENCODE_CPU_BUDGET', len(os.sched_getaffinity(0))))
+# Encodages simultanés attendus sur l'hôte sous charge (défaut: RENDER_WORKERS x workers gunicorn)
+app.config['ENCODE_CONCURRENCY'] = int(os.environ.get(
+    'ENCODE_CONCURRENCY', app.config['RENDER_WORKERS'] * int(os.environ.get('WEB_CONCURRENCY', 2))))
+
+# Stockage des jobs: "sqlite" (partagé entre workers/conteneurs) ou "memory" (mono-process)
+app.config['JOB_STORE'] = os.environ.get('JOB_STORE', 'sqlite')
+app.config['JOB_STORE_PATH'] = os.environ.get(
+    'JOB_STORE_PATH', str(Path(app.config['DATA_FOLDER']) / 'jobs.db'))
+# Rétention des jobs terminés: durée (s) et nombre max d'enregistrements complets
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 24 * 3600))
+app.config['JOB_MAX_RECORDS'] = int(os.environ.get('JOB_MAX_RECORDS', 10000))
+# Résumés des derniers jobs terminés conservés après expiration (/api/jobs/history)
+app.config['JOB_HISTORY_SIZE'] = int(os.environ.get('JOB_HISTORY_SIZE', 1000))
+# Jobs en cours d'un worker disparu: battement de cœur (s) et délai (s) avant de les passer en erreur
+app.config['JOB_HEARTBEAT_INTERVAL'] = int(os.environ.get('JOB_HEARTBEAT_INTERVAL', 15))
+app.config['JOB_STALE_AFTER'] = int(os.environ.get('JOB_STALE_AFTER', 120))
+# Long-poll / SSE de /api/status: attente max (s) et requêtes en attente max par worker
+app.config['STATUS_MAX_WAIT'] = int(os.environ.get('STATUS_MAX_WAIT', 60))
+app.config['STATUS_MAX_WAITERS'] = int(os.environ.get('STATUS_MAX_WAITERS', 24))
+
+# ============================================
+# STOCKAGE DES JOBS (PARTAGÉ ENTRE WORKERS)
+# ============================================
+FINISHED_STATUSES = ('completed', 'error')
+INTERRUPTED_JOB_ERROR = "Job interrompu: le worker qui le traitait s'est arrêté"
+
+_job_owners = {}
+
+def job_owner():
+    """
+    Process qui crée et exécute un job (pool de rendu local): "hôte:pid:jeton"
+    Le jeton distingue un nouveau process qui réutiliserait le pid d'un worker mort
+    """
+    pid = os.getpid()
+    owner = _job_owners.get(pid)
+    if owner is None:
+        owner = _job_owners[pid] = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}"
+    return owner
+
+def dedupe_blocking_statuses(dedupe_key):
+    """
+    Statuts pour lesquels un job existant capte les requêtes de même dedupe_key
+    - "idem:<clé client>": tout job conservé sauf en erreur (la même clé relance après un échec)
+    - "req:<empreinte>": seulement les jobs encore en cours (single-flight)
+    """
+    if dedupe_key.startswith('idem:'):
+        return lambda status: status != 'error'
+    return lambda status: status not in FINISHED_STATUSES
+
+class JobEvents:
+    """
+    Réveil des requêtes qui attendent un changement de job (long-poll, SSE)
+    - Les stores notifient chaque création/mise à jour du process: réveil immédiat
+    - Les mises à jour faites par un autre worker sont vues au prochain poll_interval
+    - max_waiters requêtes en attente au plus par process: chacune occupe un thread gthread,
+      au-delà on répond sans attendre pour ne jamais affamer le reste de l'API
+    """
+    def __init__(self, max_waiters, poll_interval=0.5):
+        self.max_waiters = max_waiters
+        self.poll_interval = poll_interval
+        self.waiters = 0
+        self._cond = threading.Condition()
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        with self._cond:
+            self._cond.wait(min(timeout, self.poll_interval))
+
+    def acquire(self):
+        with self._cond:
+            if self.waiters >= self.max_waiters:
+                return False
+            self.waiters += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.waiters -= 1
+
+job_events = JobEvents(app.config['STATUS_MAX_WAITERS'])
+
+# Champs internes du job: jamais renvoyés par /api/status ni dans les webhooks
+# (clé d'idempotence, callback_url des autres clients rattachés au même job)
+INTERNAL_JOB_FIELDS = ('dedupe_key', 'callback_url', 'extra_callback_urls')
+
+def public_job(job):
+    """Copie du job sans ses champs internes"""
+    return {k: v for k, v in job.items() if k not in INTERNAL_JOB_FIELDS}
+
+def job_summary(job):
+    """Vue courte d'un job pour les listes (/api/jobs, historique)"""
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'progress': job.get('progress'),
+        'started_at': job['started_at'],
+        'finished_at': job.get('finished_at'),
+        'download_url': job.get('download_url'),
+        'error': job.get('error')
+    }
+
+class JobRecord:
+    """
+    Enregistrement compact d'un job en mémoire (slots, dates en timestamp)
+    Les champs rares (encode, encoder_allocation, surah...) vont dans extra
+    """
+    __slots__ = ('id', 'status', 'progress', 'started', 'finished', 'verse_text', 'output_path', 'error', 'extra')
+    FIELDS = ('id', 'status', 'progress', 'verse_text', 'output_path', 'error')
+
+    def __init__(self, job):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.extra = None
+        self.started = self.finished = None
+        self.update(job)
+
+    @staticmethod
+    def _timestamp(value):
+        return datetime.fromisoformat(value).timestamp() if value else None
+
+    def update(self, fields):
+        for key, value in fields.items():
+            if key in self.FIELDS:
+                setattr(self, key, sys.intern(value) if key == 'status' else value)
+            elif key == 'started_at':
+                self.started = self._timestamp(value)
+            elif key == 'finished_at':
+                self.finished = self._timestamp(value)
+            elif key != 'download_url':  # Déduit de output_path
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def to_dict(self):
+        job = {field: getattr(self, field) for field in self.FIELDS}
+        job['started_at'] = datetime.fromtimestamp(self.started).isoformat()
+        job['finished_at'] = datetime.fromtimestamp(self.finished).isoformat() if self.finished else None
+        job['download_url'] = f"/api/download/{Path(self.output_path).name}" if self.output_path else None
+        if self.extra:
+            job.update(self.extra)
+        return job
+
+class MemoryJobStore:
+    """
+    Jobs en mémoire du process (un seul worker gunicorn)
+    - Jobs terminés supprimés après ttl secondes ou au-delà de max_records (plus anciens d'abord)
+    - Résumé de chaque job terminé gardé dans un buffer circulaire (history_size derniers)
+    """
+    def __init__(self, ttl=0, max_records=0, history_size=1000):
+        self.ttl = ttl
+        self.max_records = max_records
+        self._jobs = {}
+        self._finished = OrderedDict()  # job_id → timestamp de fin, ordre de fin
+        self._history = deque(maxlen=history_size)
+        self._dedupe = {}  # dedupe_key → job_id
+        self._lock = threading.Lock()
+
+    def _finish(self, record):
+        """Passage à un statut final: date de fin, résumé dans l'historique"""
+        if record.finished is None:
+            record.finished = time.time()
+        self._finished[record.id] = record.finished
+        self._history.append(job_summary(record.to_dict()))
+
+    def _evict(self):
+        cutoff = time.time() - self.ttl if self.ttl else None
+        while self._finished:
+            job_id, finished = next(iter(self._finished.items()))
+            expired = cutoff is not None and finished < cutoff
+            if not expired and not (self.max_records and len(self._finished) > self.max_records):
+                break
+            del self._finished[job_id]
+            self._drop(job_id)
+
+    def _drop(self, job_id):
+        record = self._jobs.pop(job_id, None)
+        key = record and record.extra and record.extra.get('dedupe_key')
+        if key and self._dedupe.get(key) == job_id:
+            del self._dedupe[key]
+
+    def create(self, job):
+        """
+        Enregistre le job, sauf si un job de même dedupe_key le capte:
+        retourne alors ce job existant (None si le job a été créé)
+        """
+        with self._lock:
+            key = job.get('dedupe_key')
+            if key:
+                existing = self._find_duplicate(key)
+                if existing:
+                    return existing.to_dict()
+                self._dedupe[key] = job['id']
+            record = self._jobs[job['id']] = JobRecord(job)
+            if record.status in FINISHED_STATUSES:
+                self._finish(record)
+            self._evict()
+        job_events.notify()
+
+    def get(self, job_id):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            return record.to_dict() if record else None
+
+    def _find_duplicate(self, dedupe_key):
+        record = self._jobs.get(self._dedupe.get(dedupe_key))
+        if record and dedupe_blocking_statuses(dedupe_key)(record.status):
+            return record
+        return None
+
+    def find_duplicate(self, dedupe_key):
+        """Job existant qui capte les requêtes de cette dedupe_key, ou None"""
+        with self._lock:
+            record = self._find_duplicate(dedupe_key)
+            return record.to_dict() if record else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return
+            was_finished = record.status in FINISHED_STATUSES
+            record.update(fields)
+            if not was_finished and record.status in FINISHED_STATUSES:
+                self._finish(record)
+        job_events.notify()
+
+    def delete(self, job_id):
+        with self._lock:
+            self._drop(job_id)
+            self._finished.pop(job_id, None)
+
+    def add_callback(self, job_id, url):
+        """
+        Ajoute un callback_url à un job en cours (requête rattachée par la déduplication)
+        Faux si le job est déjà terminé: son webhook est parti, à l'appelant d'envoyer
+        """
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None or record.status in FINISHED_STATUSES:
+                return False
+            job = record.to_dict()
+            if url not in job_callback_urls(job):
+                record.update({'extra_callback_urls': job.get('extra_callback_urls', []) + [url]})
+            return True
+
+    @staticmethod
+    def _matches(job, status, since, until):
+        return ((status is None or job.status == status)
+                and (since is None or job.started >= since)
+                and (until is None or job.started < until))
+
+    def count(self, status=None, since=None, until=None):
+        """Nombre de jobs avec les mêmes filtres que list"""
+        with self._lock:
+            if status is None and since is None and until is None:
+                return len(self._jobs)
+            return sum(1 for j in self._jobs.values() if self._matches(j, status, since, until))
+
+    def count_by_status(self):
+        with self._lock:
+            counts = {}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+            return counts
+
+    def queue_position(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job.status != 'queued':
+                return None
+            return 1 + sum(1 for j in self._jobs.values()
+                           if j.status == 'queued' and j.started < job.started)
+
+    def list(self, status=None, since=None, until=None, limit=100, offset=0):
+        """Jobs les plus récents d'abord, filtrés (since/until: timestamps sur started_at)"""
+        with self._lock:
+            matches = (j for j in reversed(self._jobs.values())
+                       if self._matches(j, status, since, until))
+            return [job_summary(j.to_dict()) for j in islice(matches, offset, offset + limit)]
+
+    def heartbeat(self):
+        pass
+
+    def recover_stale_jobs(self):
+        """Jobs en mémoire: ils disparaissent avec leur process, rien à récupérer"""
+        return []
+
+    def history(self, status=None, since=None, until=None, limit=100, offset=0):
+        """Résumés des derniers jobs terminés, plus récents d'abord"""
+        since = datetime.fromtimestamp(since).isoformat() if since is not None else None
+        until = datetime.fromtimestamp(until).isoformat() if until is not None else None
+        with self._lock:
+            matches = (s for s in reversed(self._history)
+                       if (status is None or s['status'] == status)
+                       and (since is None or s['started_at'] >= since)
+                       and (until is None or s['started_at'] < until))
+            return list(islice(matches, offset, offset + limit))
+
+class SQLiteJobStore:
+    """
+    Jobs dans un fichier SQLite en mode WAL sur disque partagé
+    Tous les workers gunicorn (et conteneurs montant le même volume) voient les mêmes jobs
+    Index sur id (clé primaire), status, started_at et finished_at (expiration)
+    Table job_history: résumés des derniers jobs terminés (buffer circulaire)
+    Table workers: battement de cœur de chaque process; un job en cours dont le propriétaire
+    est mort (pid disparu sur cet hôte, ou battement plus vieux que stale_after) est ignoré
+    par la déduplication puis passé en erreur par recover_stale_jobs
+    """
+    def __init__(self, path, ttl=0, max_records=0, history_size=1000, stale_after=120):
+        self.path = path
+        self.stale_after = stale_after
+        self.ttl = ttl
+        self.max_records = max_records
+        self.history_size = history_size
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " started_at TEXT NOT NULL,"
+            " finished_at TEXT,"
+            " data TEXT NOT NULL)"
+        )
+        # Bases créées avant l'expiration des jobs
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)").fetchall()]
+        if 'finished_at' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN finished_at TEXT")
+        if 'dedupe_key' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+        if 'owner' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, started_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_started ON jobs(started_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key) WHERE dedupe_key IS NOT NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs(owner) WHERE finished_at IS NULL")
+        conn.execute("CREATE TABLE IF NOT EXISTS workers (owner TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_history ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " started_at TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+
+    def _conn(self):
+        # Une connexion par thread (sqlite3 n'aime pas le partage entre threads)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _finish(self, conn, job):
+        """Passage à un statut final (dans la transaction): date de fin, résumé dans l'historique"""
+        if not job.get('finished_at'):
+            job['finished_at'] = datetime.now().isoformat()
+        conn.execute("INSERT INTO job_history (id, status, started_at, data) VALUES (?, ?, ?, ?)",
+                     (job['id'], job['status'], job['started_at'], json.dumps(job_summary(job))))
+        conn.execute("DELETE FROM job_history WHERE seq <= (SELECT MAX(seq) FROM job_history) - ?",
+                     (self.history_size,))
+
+    def _evict(self, conn):
+        if self.ttl:
+            cutoff = datetime.fromtimestamp(time.time() - self.ttl).isoformat()
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+        if self.max_records:
+            conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL"
+                " ORDER BY finished_at DESC LIMIT -1 OFFSET ?)", (self.max_records,)
+            )
+
+    def create(self, job):
+        """
+        Enregistre le job, sauf si un job de même dedupe_key le capte (vérifié dans la même
+        transaction: deux workers ne peuvent pas créer le même job): retourne alors ce job
+        existant (None si le job a été créé)
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            key = job.get('dedupe_key')
+            existing = self._find_duplicate(conn, key) if key else None
+            if existing:
+                conn.execute("COMMIT")
+                return existing
+            job = dict(job)
+            if job['status'] in FINISHED_STATUSES:
+                self._finish(conn, job)
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, started_at, finished_at, dedupe_key, owner, data)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job['id'], job['status'], job['started_at'], job.get('finished_at'), key, job_owner(),
+                 json.dumps(job))
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job_events.notify()
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _find_duplicate(self, conn, dedupe_key):
+        blocking = dedupe_blocking_statuses(dedupe_key)
+        rows = conn.execute("SELECT status, owner, data FROM jobs WHERE dedupe_key = ? ORDER BY started_at DESC",
+                            (dedupe_key,)).fetchall()
+        heartbeats = None
+        for status, owner, data in rows:
+            if not blocking(status):
+                continue
+            if status not in FINISHED_STATUSES:
+                # Job fantôme (worker tué avant la fin): ne capte plus rien
+                heartbeats = heartbeats if heartbeats is not None else self._heartbeats(conn)
+                if not self._owner_alive(owner, heartbeats):
+                    continue
+            return json.loads(data)
+        return None
+
+    def find_duplicate(self, dedupe_key):
+        """Job existant qui capte les requêtes de cette dedupe_key, ou None"""
+        return self._find_duplicate(self._conn(), dedupe_key)
+
+    def update(self, job_id, **fields):
+        conn = self._conn()
+        # BEGIN IMMEDIATE: lecture-modification-écriture atomique entre workers
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row:
+                job = json.loads(row[0])
+                was_finished = job['status'] in FINISHED_STATUSES
+                job.update(fields)
+                if not was_finished and job['status'] in FINISHED_STATUSES:
+                    self._finish(conn, job)
+                conn.execute("UPDATE jobs SET status = ?, finished_at = ?, data = ? WHERE id = ?",
+                             (job['status'], job.get('finished_at'), json.dumps(job), job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job_events.notify()
+
+    def delete(self, job_id):
+        self._conn().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def add_callback(self, job_id, url):
+        """
+        Ajoute un callback_url à un job en cours (requête rattachée par la déduplication)
+        Faux si le job est déjà terminé: son webhook est parti, à l'appelant d'envoyer
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            job = json.loads(row[0]) if row else None
+            added = job is not None and job['status'] not in FINISHED_STATUSES
+            if added and url not in job_callback_urls(job):
+                job['extra_callback_urls'] = job.get('extra_callback_urls', []) + [url]
+                conn.execute("UPDATE jobs SET data = ? WHERE id = ?", (json.dumps(job), job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def heartbeat(self):
+        """Signale ce process comme vivant: ses jobs en cours ne sont pas récupérés"""
+        self._conn().execute("INSERT OR REPLACE INTO workers (owner, heartbeat) VALUES (?, ?)",
+                             (job_owner(), time.time()))
+
+    @staticmethod
+    def _heartbeats(conn):
+        return dict(conn.execute("SELECT owner, heartbeat FROM workers").fetchall())
+
+    def _owner_alive(self, owner, heartbeats):
+        """Vrai si le process propriétaire d'un job tourne encore"""
+        if not owner:
+            return False  # Job antérieur au suivi des propriétaires
+        host, pid, _ = owner.rsplit(':', 2)
+        if host == socket.gethostname() and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                pass
+        if self.stale_after <= 0:
+            return True
+        seen = heartbeats.get(owner)
+        return seen is not None and time.time() - seen < self.stale_after
+
+    def recover_stale_jobs(self):
+        """
+        Passe en erreur les jobs en cours dont le process a disparu (worker tué ou redémarré,
+        conteneur arrêté): ils ne captent plus les requêtes identiques et ne comptent plus
+        dans la file. Retourne leurs ids
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            heartbeats = self._heartbeats(conn)
+            rows = conn.execute("SELECT id, owner, data FROM jobs WHERE finished_at IS NULL").fetchall()
+            recovered = []
+            for job_id, owner, data in rows:
+                job = json.loads(data)
+                if job['status'] in FINISHED_STATUSES or self._owner_alive(owner, heartbeats):
+                    continue
+                job.update(status='error', error=INTERRUPTED_JOB_ERROR)
+                self._finish(conn, job)
+                conn.execute("UPDATE jobs SET status = ?, finished_at = ?, data = ? WHERE id = ?",
+                             (job['status'], job['finished_at'], json.dumps(job), job_id))
+                recovered.append(job_id)
+            # Battements des process disparus depuis longtemps
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?",
+                         (time.time() - 10 * max(self.stale_after, 60),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if recovered:
+            job_events.notify()
+        return recovered
+
+    def count(self, status=None, since=None, until=None):
+        """Nombre de jobs avec les mêmes filtres que list"""
+        where, params = self._filters(status, since, until)
+        return self._conn().execute(f"SELECT COUNT(*) FROM jobs{where}", params).fetchone()[0]
+
+    def count_by_status(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def queue_position(self, job_id):
+        row = self._conn().execute("SELECT status, started_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row or row[0] != 'queued':
+            return None
+        return 1 + self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND started_at < ?", (row[1],)
+        ).fetchone()[0]
+
+    @staticmethod
+    def _filters(status, since, until):
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if since is not None:
+            clauses.append("started_at >= ?")
+            params.append(datetime.fromtimestamp(since).isoformat())
+        if until is not None:
+            clauses.append("started_at < ?")
+            params.append(datetime.fromtimestamp(until).isoformat())
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def list(self, status=None, since=None, until=None, limit=100, offset=0):
+        """Jobs les plus récents d'abord, filtrés (since/until: timestamps sur started_at)"""
+        where, params = self._filters(status, since, until)
+        rows = self._conn().execute(
+            f"SELECT data FROM jobs{where} ORDER BY started_at DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return [job_summary(json.loads(row[0])) for row in rows]
+
+    def history(self, status=None, since=None, until=None, limit=100, offset=0):
+        """Résumés des derniers jobs terminés, plus récents d'abord"""
+        where, params = self._filters(status, since, until)
+        rows = self._conn().execute(
+            f"SELECT data FROM job_history{where} ORDER BY seq DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+def create_job_store(kind, path):
+    """Instancie le backend de stockage des jobs configuré"""
+    retention = (app.config['JOB_TTL'], app.config['JOB_MAX_RECORDS'], app.config['JOB_HISTORY_SIZE'])
+    if kind == 'memory':
+        return MemoryJobStore(*retention)
+    if kind == 'sqlite':
+        return SQLiteJobStore(path, *retention, stale_after=app.config['JOB_STALE_AFTER'])
+    raise ValueError(f"JOB_STORE inconnu: {kind}")
+
+job_store = create_job_store(app.config['JOB_STORE'], app.config['JOB_STORE_PATH'])
+
+# ============================================
+# POOL DE RENDU BORNÉ (ADMISSION CONTROL)
+# ============================================
+class QueueFullError(Exception):
+    """La file d'attente de rendu est pleine"""
+    def __init__(self, retry_after):
+        super().__init__("File de rendu pleine")
+        self.retry_after = retry_after
+
+class RenderPool:
+    """
+    Pool de workers de rendu à concurrence fixe avec file d'attente bornée
+    - max_workers encodes ffmpeg simultanés au maximum
+    - max_queue jobs en attente au maximum, au-delà → QueueFullError (429)
+    Sous surcharge le débit reste plat au lieu de s'effondrer
+    """
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._queue = deque()  # (job_id, target, args)
+        self._running = set()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._avg_job_seconds = 60.0  # Moyenne glissante pour Retry-After
+
+    def _ensure_workers(self):
+        # Démarrage paresseux (après le fork des workers gunicorn)
+        if self._threads:
+            return
+        for i in range(self.max_workers):
+            t = threading.Thread(target=self._worker, name=f"render-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _is_full_unlocked(self):
+        # Les workers libres absorbent immédiatement leur job, ils ne comptent pas dans la file
+        idle = max(0, self.max_workers - len(self._running))
+        return len(self._queue) >= self.max_queue + idle
+
+    def is_full(self):
+        with self._cond:
+            return self._is_full_unlocked()
+
+    def retry_after(self):
+        """Estimation (secondes) avant qu'une place se libère dans la file"""
+        with self._cond:
+            return self._retry_after_unlocked()
+
+    def _retry_after_unlocked(self):
+        waves = (len(self._queue) // self.max_workers) + 1
+        return int(min(max(waves * self._avg_job_seconds, 1), 600))
+
+    def submit(self, job_id, target, *args):
+        """Ajoute un job à la file, retourne sa position (1 = prochain)"""
+        with self._cond:
+            if self._is_full_unlocked():
+                raise QueueFullError(self._retry_after_unlocked())
+            self._ensure_workers()
+            self._queue.append((job_id, target, args))
+            self._cond.notify()
+            return len(self._queue)
+
+    def position(self, job_id):
+        """Position dans la file (1-based), None si le job n'attend pas"""
+        with self._cond:
+            for i, (queued_id, _, _) in enumerate(self._queue):
+                if queued_id == job_id:
+                    return i + 1
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': len(self._running),
+                'queued': len(self._queue)
+            }
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job_id, target, args = self._queue.popleft()
+                self._running.add(job_id)
+
+            started = time.time()
+            try:
+                target(job_id, *args)
+            except Exception as e:
+                print(f"❌ Erreur worker rendu {job_id}: {e}")
+            finally:
+                elapsed = time.time() - started
+                with self._cond:
+                    self._running.discard(job_id)
+                    self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+
+render_pool = RenderPool(app.config['RENDER_WORKERS'], app.config['RENDER_QUEUE_SIZE'])
+
+def queue_full_response(retry_after):
+    """Réponse 429 avec Retry-After quand la file de rendu est pleine"""
+    response = jsonify({
+        'error': 'File de rendu pleine, réessayez plus tard',
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+# ============================================
+# MÉTRIQUES (FORMAT PROMETHEUS)
+# ============================================
+class Metrics:
+    """
+    Compteurs et histogrammes en mémoire, exposés au format texte Prometheus
+    - Mise à jour = un verrou + une addition: assez léger pour rester actif en production
+    - Chaque worker gunicorn écrit un instantané (au plus toutes les flush_interval s)
+      dans DATA_FOLDER/metrics; /metrics additionne tous les workers de l'hôte
+    """
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+    def __init__(self, folder, flush_interval=5.0):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.help = {}
+        self.collectors = []  # Compteurs locaux au process (caches...), lus à l'instantané
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._file = self.folder / f"{socket.gethostname()}_{os.getpid()}.json"
+        self._retired = self.folder / f"{socket.gethostname()}_retired.json"
+        self._lock_path = self.folder / '.lock'
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self.flush()
+
+    def observe(self, name, value, buckets=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                bounds = list(buckets or self.DEFAULT_BUCKETS)
+                hist = self._histograms[key] = {'buckets': bounds, 'counts': [0] * len(bounds), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+                    break
+            hist['sum'] += value
+            hist['count'] += 1
+        self.flush()
+
+    @contextmanager
+    def time(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        """Instantané du process: compteurs + histogrammes + collecteurs"""
+        with self._lock:
+            counters = [[name, dict(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, dict(labels), dict(hist, counts=list(hist['counts']))]
+                          for (name, labels), hist in self._histograms.items()]
+        for collector in self.collectors:
+            counters.extend(collector())
+        return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms}
+
+    def flush(self, force=False):
+        """Écrit l'instantané du process (throttlé) pour les autres workers"""
+        now = time.time()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        tmp = self._file.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            tmp.write_text(json.dumps(self.snapshot()), encoding='utf-8')
+            os.replace(tmp, self._file)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    def _snapshots(self):
+        """
+        Instantané live de ce process + derniers instantanés des autres workers vivants de cet hôte
+        + cumul des workers morts: les totaux ne baissent pas quand gunicorn redémarre un worker
+        Les fichiers d'autres hôtes (DATA_FOLDER partagé) sont ignorés: chaque hôte a son /metrics
+        """
+        snapshots = [self.snapshot()]
+        dead = []
+        with open(self._lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for path in self.folder.glob(f"{socket.gethostname()}_*.json"):
+                pid = path.stem.rpartition('_')[2]
+                if path == self._file or not pid.isdigit():
+                    continue
+                try:
+                    os.kill(int(pid), 0)
+                except ProcessLookupError:
+                    dead.append(path)  # Worker mort (redémarré par gunicorn)
+                    continue
+                except PermissionError:
+                    pass
+                try:
+                    snapshots.append(json.loads(path.read_text(encoding='utf-8')))
+                except (OSError, ValueError):
+                    continue
+            snapshots.append(self._retire(dead))
+        return snapshots
+
+    def _retire(self, dead):
+        """
+        Ajoute les instantanés des workers morts au cumul de l'hôte puis supprime leurs fichiers
+        Appelé sous le verrou du dossier: un worker mort n'est compté qu'une fois
+        """
+        try:
+            retired = json.loads(self._retired.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            retired = {'counters': [], 'histograms': []}
+        if not dead:
+            return retired
+        snapshots = [retired]
+        for path in dead:
+            try:
+                snapshots.append(json.loads(path.read_text(encoding='utf-8')))
+            except (OSError, ValueError):
+                continue
+        counters, histograms = self._merge(snapshots)
+        merged = {
+            'pid': None,
+            'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, dict(labels), hist] for (name, labels), hist in histograms.items()]
+        }
+        tmp = self._retired.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(merged), encoding='utf-8')
+            os.replace(tmp, self._retired)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return retired  # Fichiers des workers morts gardés: repliés au prochain scrape
+        for path in dead:
+            path.unlink(missing_ok=True)
+        return merged
+
+    @staticmethod
+    def _merge(snapshots):
+        """Additionne des instantanés (compteurs et histogrammes de mêmes labels)"""
+        counters = {}
+        histograms = {}
+        for snap in snapshots:
+            for name, labels, value in snap['counters']:
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, hist in snap['histograms']:
+                key = (name, tuple(sorted(labels.items())))
+                total = histograms.get(key)
+                if total is None or total['buckets'] != hist['buckets']:
+                    histograms[key] = dict(hist, counts=list(hist['counts']))
+                    continue
+                total['counts'] = [a + b for a, b in zip(total['counts'], hist['counts'])]
+                total['sum'] += hist['sum']
+                total['count'] += hist['count']
+        return counters, histograms
+
+    def collect(self):
+        """Additionne les instantanés de tous les workers de l'hôte, vivants et morts"""
+        return self._merge(self._snapshots())
+
+    @staticmethod
+    def _labels(labels, extra=None):
+        items = list(labels) + (list(extra.items()) if extra else [])
+        if not items:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+    def _header(self, lines, name, kind):
+        _, text = self.help.get(name, (kind, ''))
+        if text:
+            lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def render(self, gauges=()):
+        """Texte d'exposition Prometheus (gauges: [(nom, labels, valeur), ...] calculées au scrape)"""
+        counters, histograms = self.collect()
+        lines = []
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                self._header(lines, name, 'counter')
+                seen.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), hist in sorted(histograms.items()):
+            if name not in seen:
+                self._header(lines, name, 'histogram')
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(hist['buckets'], hist['counts']):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, {'le': '+Inf'})} {hist['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {round(hist['sum'], 6)}")
+            lines.append(f"{name}_count{self._labels(labels)} {hist['count']}")
+        for name, labels, value in gauges:
+            if value is None:
+                continue
+            if name not in seen:
+                self._header(lines, name, 'gauge')
+                seen.add(name)
+            lines.append(f"{name}{self._labels(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics(Path(app.config['DATA_FOLDER']) / 'metrics')
+atexit.register(metrics.flush, True)  # Dernier instantané d'un worker arrêté proprement (max_requests, reload)
+metrics.describe('quran_video_stage_seconds', 'histogram', "Durée de chaque étape du pipeline (fetch, probe, audio, subtitles, encode, finalize)")
+metrics.describe('quran_video_encode_realtime_factor', 'histogram', "Vitesse d'encodage (secondes d'audio par seconde)")
+metrics.describe('quran_video_jobs_finished_total', 'counter', "Jobs terminés par statut et résolution")
+metrics.describe('quran_video_jobs_deduplicated_total', 'counter', "Requêtes rattachées à un job existant (idempotency, inflight)")
+metrics.describe('quran_video_cache_hits_total', 'counter', "Accès aux caches trouvés")
+metrics.describe('quran_video_cache_misses_total', 'counter', "Accès aux caches manqués")
+metrics.describe('quran_video_cache_hit_ratio', 'gauge', "Ratio de hits par cache (tous workers)")
+metrics.describe('quran_video_bytes_downloaded_total', 'counter', "Octets téléchargés (audio, fonds)")
+metrics.describe('quran_video_bytes_served_total', 'counter', "Octets de vidéos servis par /api/download")
+metrics.describe('quran_video_queue_depth', 'gauge', "Jobs en attente dans la file de rendu")
+metrics.describe('quran_video_encodes_in_flight', 'gauge', "Encodages ffmpeg en cours")
+metrics.describe('quran_video_storage_reclaimed_bytes_total', 'counter', "Octets libérés sur le disque par le gestionnaire de stockage (vidéos sans autre lien)")
+metrics.describe('quran_video_storage_evicted_files_total', 'counter', "Vidéos supprimées par le gestionnaire de stockage")
+
+REALTIME_FACTOR_BUCKETS = (0.25, 0.5, 1, 1.5, 2, 3, 4, 6, 8, 12, 16, 32)
+
+def record_job_outcome(job_id, config):
+    """Compte un job terminé (statut final + résolution)"""
+    job = job_store.get(job_id)
+    if job:
+        metrics.inc('quran_video_jobs_finished_total', status=job['status'],
+                    resolution=resolution_label(config))
 
 def clean_quran_text(text):
     """
@@ -210,29 +1246,319 @@ def get_best_available_font(preferred_font, fallback_fonts):
     print(f"🔤 Police demandée: {preferred_font}")
     return preferred_font
 
+# ============================================
+# CLIENT HTTP PARTAGÉ (KEEP-ALIVE + RETRIES)
+# ============================================
+def create_http_session(pool_per_host, retries):
+    """
+    Session requests partagée par tous les téléchargements
+    - Connexions keep-alive réutilisées (pas de handshake TLS à chaque fichier)
+    - Au plus pool_per_host connexions simultanées par hôte (pool_block)
+    - Retries avec backoff exponentiel sur erreurs réseau et 429/5xx
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "HEAD"],
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_per_host,
+                          pool_block=True, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+http_session = create_http_session(app.config['HTTP_POOL_PER_HOST'], app.config['HTTP_RETRIES'])
+
 def download_file(url, destination):
-    """Télécharge un fichier depuis une URL"""
+    """Télécharge un fichier depuis une URL (via le cache média si activé)"""
+    if media_cache.enabled:
+        return media_cache.fetch(url, destination)
     try:
-        response = requests.get(url, stream=True, timeout=30)
+        response = http_session.get(url, stream=True, timeout=30)
         response.raise_for_status()
         
+        size = 0
         with open(destination, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
+            for chunk in response.iter_content(chunk_size=65536):
                 f.write(chunk)
+                size += len(chunk)
         
+        metrics.inc('quran_video_bytes_downloaded_total', size)
         return True
     except Exception as e:
         print(f"Erreur téléchargement {url}: {e}")
         return False
 
+# ============================================
+# WEBHOOKS DE FIN DE JOB (callback_url)
+# ============================================
+class WebhookDispatcher:
+    """
+    POST du job final vers son callback_url, depuis des threads dédiés
+    - File bornée (max_pending): au-delà, la notification est abandonnée (le client peut
+      toujours interroger /api/status), jamais de blocage du job
+    - Retries avec backoff exponentiel sur erreur réseau, 429 et 5xx (Retry-After respecté),
+      délai plafonné à max_backoff: un Retry-After démesuré ne repousse pas la livraison indéfiniment
+    - Les livraisons en attente de retry ne bloquent pas les autres (tas trié par échéance)
+    - Threads démarrés au premier envoi (après le fork gunicorn, aucun sous flask import-quran)
+    """
+    RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+    def __init__(self, workers, max_pending, retries, timeout, backoff=2.0, max_backoff=300.0):
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self.session = requests.Session()
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self._pending = []  # [(échéance, seq, url, payload, tentative)]
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _ensure_workers(self):
+        # Démarrage paresseux (après le fork des workers gunicorn)
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, daemon=True, name=f'webhook-{i}')
+            t.start()
+            self._threads.append(t)
+
+    def _push(self, due, url, payload, attempt):
+        self._seq += 1
+        heapq.heappush(self._pending, (due, self._seq, url, payload, attempt))
+        self._cond.notify()
+
+    def submit(self, url, payload):
+        """Programme une livraison, False si la file est pleine"""
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                metrics.inc('quran_video_webhook_deliveries_total', outcome='dropped')
+                print(f"⚠️ Webhook abandonné (file pleine): {url}")
+                return False
+            self._ensure_workers()
+            self._push(time.time(), url, payload, 0)
+            return True
+
+    def _next(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._pending and self._pending[0][0] <= now:
+                    return heapq.heappop(self._pending)
+                self._cond.wait(self._pending[0][0] - now if self._pending else None)
+
+    def _deliver(self, url, payload):
+        """Un essai: (livré, délai avant retry ou None si inutile de réessayer)"""
+        try:
+            response = self.session.post(url, json=payload, timeout=self.timeout,
+                                         headers={'X-Job-Id': payload.get('id', '')})
+        except requests.RequestException as e:
+            return False, None if isinstance(e, requests.exceptions.InvalidURL) else 0
+        if response.ok:
+            return True, None
+        if response.status_code not in self.RETRY_STATUSES:
+            return False, None
+        retry_after = response.headers.get('Retry-After', '')
+        return False, float(retry_after) if retry_after.isdigit() else 0
+
+    def _run(self):
+        while True:
+            _, _, url, payload, attempt = self._next()
+            delivered, retry_after = self._deliver(url, payload)
+            if delivered:
+                self.delivered += 1
+                metrics.inc('quran_video_webhook_deliveries_total', outcome='delivered')
+                continue
+            if retry_after is not None and attempt < self.retries:
+                delay = min(max(retry_after, self.backoff * 2 ** attempt), self.max_backoff)
+                with self._cond:
+                    self._push(time.time() + delay, url, payload, attempt + 1)
+                continue
+            self.failed += 1
+            metrics.inc('quran_video_webhook_deliveries_total', outcome='failed')
+            print(f"❌ Webhook {payload.get('id')} non livré après {attempt + 1} essai(s): {url}")
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {'pending': pending, 'delivered': self.delivered, 'failed': self.failed, 'dropped': self.dropped}
+
+webhooks = WebhookDispatcher(
+    app.config['WEBHOOK_WORKERS'],
+    app.config['WEBHOOK_QUEUE_SIZE'],
+    app.config['WEBHOOK_RETRIES'],
+    app.config['WEBHOOK_TIMEOUT'],
+    max_backoff=app.config['WEBHOOK_MAX_BACKOFF']
+)
+metrics.describe('quran_video_webhook_deliveries_total', 'counter', "Notifications callback_url par résultat")
+
+def validate_callback_url(url):
+    """callback_url optionnel: None si absent, ValueError si ce n'est pas une URL http(s)"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        raise ValueError('callback_url doit être une URL http(s)')
+    return url
+
+def job_callback_urls(job):
+    """callback_url du job + ceux des requêtes identiques rattachées à lui"""
+    urls = [job['callback_url']] if job.get('callback_url') else []
+    return urls + [url for url in job.get('extra_callback_urls') or [] if url not in urls]
+
+def notify_job_finished(job_id):
+    """Envoie le job final à chacun de ses callback_url"""
+    job = job_store.get(job_id)
+    if job and job['status'] in FINISHED_STATUSES:
+        for url in job_callback_urls(job):
+            webhooks.submit(url, public_job(job))
+
+# ============================================
+# SERVICE DE PROBE MÉDIA (FFPROBE MIS EN CACHE)
+# ============================================
+class ProbeCache:
+    """
+    Un seul ffprobe par fichier: durée, résolution, codecs, fps, format audio
+    Résultats mis en cache par (chemin, taille, mtime) en mémoire et sur disque
+    - Sur disque: max_disk_entries fichiers au plus, LRU par mtime (touché à chaque hit)
+    - Fichiers des espaces de travail des jobs (uploads/<job_id>, temp, tmpfs): mémoire seulement,
+      leur chemin ne sera jamais reprobé une fois le job terminé
+    """
+    EVICT_EVERY = 256  # Écritures disque entre deux passes d'éviction
+
+    def __init__(self, folder, max_entries=2048, max_disk_entries=20000):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _ephemeral(p):
+        folders = [app.config['UPLOAD_FOLDER'], app.config['TEMP_FOLDER'], app.config['WORKSPACE_TMPFS']]
+        return any(Path(folder).resolve() in p.parents for folder in folders if folder)
+
+    def _evict_disk(self):
+        """Supprime les résultats les moins récemment utilisés au-delà de max_disk_entries"""
+        entries = []
+        for f in self.folder.glob('*.json'):
+            try:
+                entries.append((f.stat().st_mtime, f))
+            except OSError:
+                continue
+        entries.sort()
+        for _, f in entries[:max(0, len(entries) - self.max_disk_entries)]:
+            f.unlink(missing_ok=True)
+
+    @staticmethod
+    def _parse_rate(rate):
+        try:
+            num, _, den = rate.partition('/')
+            return round(float(num) / float(den or 1), 3)
+        except (AttributeError, ValueError, ZeroDivisionError):
+            return None
+
+    def _run_ffprobe(self, path):
+        cmd = ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", path]
+        data = json.loads(subprocess.check_output(cmd).decode())
+        fmt = data.get('format', {})
+        video = next((st for st in data.get('streams', []) if st.get('codec_type') == 'video'), {})
+        audio = next((st for st in data.get('streams', []) if st.get('codec_type') == 'audio'), {})
+        return {
+            'duration': float(fmt.get('duration') or video.get('duration') or audio.get('duration') or 0.0),
+            'format': fmt.get('format_name'),
+            'bit_rate': int(fmt['bit_rate']) if fmt.get('bit_rate') else None,
+            'width': video.get('width'),
+            'height': video.get('height'),
+            'video_codec': video.get('codec_name'),
+            'fps': self._parse_rate(video.get('avg_frame_rate')) or self._parse_rate(video.get('r_frame_rate')),
+            'audio_codec': audio.get('codec_name'),
+            'sample_rate': int(audio['sample_rate']) if audio.get('sample_rate') else None,
+            'channels': audio.get('channels')
+        }
+
+    def probe(self, path):
+        """Métadonnées du fichier (dict) ou None si illisible"""
+        try:
+            p = Path(path).resolve()
+            st = p.stat()
+        except OSError:
+            return None
+        key = hashlib.sha1(f"{p}:{st.st_size}:{st.st_mtime_ns}".encode('utf-8')).hexdigest()
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return dict(self._memory[key])
+
+        persist = not self._ephemeral(p)
+        disk_path = self.folder / f"{key}.json"
+        info = None
+        if persist:
+            try:
+                with open(disk_path, encoding='utf-8') as f:
+                    info = json.load(f)
+                os.utime(disk_path)
+            except (OSError, ValueError):
+                pass
+
+        if info is None:
+            try:
+                info = self._run_ffprobe(str(p))
+            except Exception as e:
+                print(f"⚠️ ffprobe impossible sur {p.name}: {e}")
+                return None
+            if persist:
+                tmp = self.folder / f".{key}.{uuid.uuid4().hex[:8]}.tmp"
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(info, f)
+                os.replace(tmp, disk_path)
+            with self._lock:
+                self.misses += 1
+                self._writes += persist
+                evict = persist and self._writes % self.EVICT_EVERY == 0
+            if evict:
+                self._evict_disk()
+        else:
+            with self._lock:
+                self.hits += 1
+
+        with self._lock:
+            self._memory[key] = info
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        return dict(info)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._memory)}
+
+probe_cache = ProbeCache(Path(app.config['CACHE_FOLDER']) / 'probe')
+
+def probe_media(path):
+    """Métadonnées d'un fichier média (via le cache de probe)"""
+    with metrics.time('quran_video_stage_seconds', stage='probe'):
+        return probe_cache.probe(path)
+
 def get_audio_duration(path):
-    """Récupère la durée d'un fichier audio"""
-    cmd = ["ffprobe", "-v", "error", "-show_entries", 
-           "format=duration", "-of", "default=nw=1:nk=1", path]
-    try:
-        return float(subprocess.check_output(cmd).decode().strip())
-    except:
-        return 0.0
+    """Récupère la durée d'un fichier audio (ou vidéo)"""
+    info = probe_media(path)
+    return info['duration'] if info else 0.0
 
 def ass_time(t):
     """Convertit un temps en secondes au format ASS"""
@@ -270,9 +1596,8 @@ def create_segments(text, config):
     
     return segments
 
-def generate_ass(text, audio_path, output_ass, config):
-    """Génère le fichier ASS avec nettoyage du texte et détection de police"""
-    
+def prepare_verse_text(text, config):
+    """Nettoie le texte selon les options de la config"""
     # Nettoyer le texte selon les options
     if config.get('aggressive_clean', False):
         text = clean_quran_text_aggressive(text)
@@ -288,16 +1613,55 @@ def generate_ass(text, audio_path, output_ass, config):
         text = remove_diacritics(text)
         print(f"🔤 Diacritiques supprimés")
     
-    segments = create_segments(text, config)
+    return text
+
+def build_segment_events(segments, offset, usable):
+    """
+    Répartit les segments sur [offset, offset + usable] au prorata de leur longueur
+    Retourne une liste de (start, end, segment) en secondes absolues
+    """
+    weights = [max(len(s.replace(" ", "")), 1) for s in segments]
+    total = sum(weights)
     
-    if not segments:
-        return False
+    events = []
+    t = 0.0
+    for seg, w in zip(segments, weights):
+        segdur = usable * (w / total)
+        start = t
+        end = min(t + segdur, usable)
+        if end - start < 0.35:
+            end = min(start + 0.35, usable)
+        events.append((offset + start, offset + end, seg))
+        t = end
     
-    duration = get_audio_duration(audio_path)
-    usable = max(duration, 0.1)
+    if events:
+        start_last = events[-1][0]
+        events[-1] = (start_last, offset + usable, events[-1][2])
     
-    weights = [max(len(s.replace(" ", "")), 1) for s in segments]
-    total = sum(weights)
+    return events
+
+def generate_ass(text, audio_path, output_ass, config, audio_duration=None):
+    """
+    Génère le fichier ASS avec nettoyage du texte et détection de police
+    audio_duration (optionnel) évite de re-prober l'audio si le job l'a déjà fait
+    """
+    duration = audio_duration if audio_duration is not None else get_audio_duration(audio_path)
+    return generate_ass_timeline([(text, 0.0, duration)], output_ass, config)
+
+def generate_ass_timeline(timeline, output_ass, config):
+    """
+    Génère le fichier ASS pour une timeline de versets [(texte, début, durée), ...]
+    Chaque verset est ancré sur son offset réel dans l'audio (plages d'ayahs)
+    """
+    # Découper chaque verset en segments
+    entries = []
+    for text, offset, duration in timeline:
+        segments = create_segments(prepare_verse_text(text, config), config)
+        if segments:
+            entries.append((segments, offset, max(duration, 0.1)))
+    
+    if not entries:
+        return False
     
     # Utiliser directement la police demandée par l'utilisateur
     font = config.get('font_name', DEFAULT_CONFIG['font_name'])
@@ -401,19 +1765,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 """
     
     events = []
-    t = 0.0
-    for seg, w in zip(segments, weights):
-        segdur = usable * (w / total)
-        start = t
-        end = min(t + segdur, usable)
-        if end - start < 0.35:
-            end = min(start + 0.35, usable)
-        events.append((start, end, seg))
-        t = end
-    
-    if events:
-        start_last = events[-1][0]
-        events[-1] = (start_last, usable, events[-1][2])
+    for segments, offset, usable in entries:
+        events.extend(build_segment_events(segments, offset, usable))
     
     lines = []
     
@@ -446,175 +1799,2452 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
     with open(output_ass, 'w', encoding='utf-8') as f:
         f.write(header + "\n".join(lines) + "\n")
     
-    print(f"📝 {len(segments)} segments créés")
+    print(f"📝 {len(events)} segments créés")
     return True
-    
-    header = f"""[Script Info]
-ScriptType: v4.00+
-PlayResX: 1920
-PlayResY: 1080
-ScaledBorderAndShadow: yes
-WrapStyle: 2
 
-[V4+ Styles]
-Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-Style: Verse,{config['font_name']},{config['font_size']},&H00FFFFFF,&H000000FF,&H00101010,&H00000000,0,0,0,0,100,100,0,0,1,{config['outline']},{config['shadow']},{config['alignment']},80,80,40,1
+# ============================================
+# PROGRESSION FFMPEG ET ESTIMATION DU TEMPS
+# ============================================
+def _parse_float(value, suffix=''):
+    try:
+        return float(value.rstrip(suffix))
+    except (AttributeError, ValueError):
+        return None
+
+def run_ffmpeg(cmd, duration=None, progress_callback=None):
+    """
+    Lance ffmpeg en lisant sa sortie -progress en direct
+    progress_callback reçoit: percent, out_time, speed (x temps réel), fps, eta_seconds
+    Lève subprocess.CalledProcessError si ffmpeg échoue
+    """
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + cmd[1:]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+    block = {}
+    out_time = 0.0
+    for line in proc.stdout:
+        key, _, value = line.strip().partition('=')
+        block[key] = value
+        if key != 'progress':
+            continue
+
+        # Fin d'un bloc de progression
+        out_time_us = _parse_float(block.get('out_time_us'))
+        if out_time_us is None:
+            out_time_us = _parse_float(block.get('out_time_ms'))  # Aussi en µs (nom historique)
+        if out_time_us is not None:
+            out_time = max(out_time_us / 1e6, out_time)
+        speed = _parse_float(block.get('speed'), 'x')
+        fps = _parse_float(block.get('fps'))
+        block = {}
+
+        if progress_callback is None:
+            continue
+        percent = None
+        eta = None
+        if duration:
+            percent = min(out_time / duration * 100, 100.0)
+            if speed:
+                eta = max(duration - out_time, 0.0) / speed
+        progress_callback({
+            'percent': round(percent, 1) if percent is not None else None,
+            'out_time': round(out_time, 2),
+            'speed': speed,
+            'fps': fps,
+            'eta_seconds': int(math.ceil(eta)) if eta is not None else None,
+            'done': value == 'end'
+        })
+
+    returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+class ThroughputTracker:
+    """
+    Débit d'encodage mesuré (x temps réel) par (résolution, preset)
+    Moyenne glissante exponentielle, sert à estimer la durée des nouveaux jobs
+    """
+    DEFAULT_SPEED = 1.0         # Sans mesure: on suppose le temps réel
+    DEFAULT_JOB_SECONDS = 120   # Sans durée audio connue
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self._speeds = {}
+        self._job_seconds = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(config):
+        return (resolution_label(config), config.get('preset', 'fast'))
+
+    def _ewma(self, table, key, value):
+        old = table.get(key)
+        table[key] = value if old is None else (1 - self.alpha) * old + self.alpha * value
+
+    def record(self, config, media_duration, elapsed):
+        if media_duration <= 0 or elapsed <= 0:
+            return
+        key = self._key(config)
+        with self._lock:
+            self._ewma(self._speeds, key, media_duration / elapsed)
+            self._ewma(self._job_seconds, key, elapsed)
+
+    def estimate(self, config, media_duration=None):
+        """Durée d'encodage estimée (secondes)"""
+        key = self._key(config)
+        with self._lock:
+            if media_duration:
+                return int(math.ceil(media_duration / self._speeds.get(key, self.DEFAULT_SPEED)))
+            return int(math.ceil(self._job_seconds.get(key, self.DEFAULT_JOB_SECONDS)))
+
+    def stats(self):
+        with self._lock:
+            return {f"{res}/{preset}": round(speed, 2) for (res, preset), speed in self._speeds.items()}
+
+throughput = ThroughputTracker()
+
+# ============================================
+# ORDONNANCEUR CPU DES ENCODAGES
+# ============================================
+class EncodeScheduler:
+    """
+    Répartit le budget de cœurs de l'hôte entre les encodages en cours de TOUS les workers
+    - Part de chaque encodage proportionnelle à son nombre de pixels (4K pèse 4x le 1080p)
+    - Part calculée sur la concurrence attendue: encodages en cours + jobs en attente ou en
+      préparation (demand), plafonnée à concurrency; un encodage seul sur l'hôte a tout le budget,
+      le premier d'une rafale n'en prive pas les suivants
+    - Jamais plus que les cœurs restants (min 1 thread): pas de sur-souscription
+    - Allocation décidée au démarrage de chaque encodage (x264 ne change pas de threads en cours
+      de route): un encodage qui se termine libère ses cœurs pour les suivants
+    - Encodages en cours partagés entre workers gunicorn: un fichier par allocation dans folder
+      ("<hôte>_<pid>_<id>.json"), décision sous verrou fcntl; ceux d'un process mort sont ignorés
+    """
+    REFERENCE_PIXELS = 1920 * 1080
+    REFERENCE_MAXRATE_K = 4000  # Débit max au 1080p
+
+    def __init__(self, budget, folder, concurrency=1, demand=None):
+        self.budget = max(1, budget)
+        self.concurrency = max(1, concurrency)
+        self.demand = demand  # Callable: jobs non terminés (en attente, en préparation, en encodage)
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.folder / '.lock'
+
+    def _path(self, allocation_id):
+        return self.folder / f"{socket.gethostname()}_{os.getpid()}_{allocation_id}.json"
+
+    def _running(self):
+        """Allocations en cours sur cet hôte (tous les workers)"""
+        running = []
+        for path in self.folder.glob(f"{socket.gethostname()}_*.json"):
+            pid = path.stem.rsplit('_', 2)[-2]
+            if pid.isdigit():
+                try:
+                    os.kill(int(pid), 0)
+                except ProcessLookupError:
+                    path.unlink(missing_ok=True)  # Worker mort pendant un encodage
+                    continue
+                except PermissionError:
+                    pass
+            try:
+                running.append(json.loads(path.read_text(encoding='utf-8')))
+            except (OSError, ValueError):
+                continue
+        return running
+
+    @classmethod
+    def weight(cls, resolution):
+        res = RESOLUTIONS.get(resolution, RESOLUTIONS['1080p'])
+        return res['width'] * res['height'] / cls.REFERENCE_PIXELS
+
+    @classmethod
+    def rate_control(cls, resolution):
+        """Débit max / buffer VBV adaptés à la résolution"""
+        maxrate = max(1500, int(round(cls.REFERENCE_MAXRATE_K * cls.weight(resolution))))
+        return f"{maxrate}k", f"{2 * maxrate}k"
+
+    def acquire(self, resolution):
+        """
+        Réserve des threads pour un encodage, retourne l'allocation
+        resolution peut être une liste (rendu multi-format): poids = somme des sorties
+        """
+        resolutions = resolution if isinstance(resolution, (list, tuple)) else [resolution]
+        weight = sum(self.weight(r) for r in resolutions)
+        with open(self._lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            running = self._running()
+            used = sum(a['threads'] for a in running)
+            # Encodages à venir (pas encore démarrés): même poids que celui-ci
+            expected = max(len(running) + 1, min(self._demand(), self.concurrency, self.budget))
+            upcoming = expected - len(running) - 1
+            total_weight = sum(a['weight'] for a in running) + weight * (1 + upcoming)
+            fair = int(round(self.budget * weight / total_weight))
+            threads = max(1, min(fair, self.budget - used))
+            maxrate, bufsize = self.rate_control(resolutions[0])
+            allocation = {
+                'id': uuid.uuid4().hex[:8],
+                'resolution': '+'.join(resolutions),
+                'weight': round(weight, 2),
+                'threads': threads,
+                'maxrate': maxrate,
+                'bufsize': bufsize,
+                'running_encodes': len(running) + 1,
+                'cpu_budget': self.budget
+            }
+            self._path(allocation['id']).write_text(json.dumps(allocation), encoding='utf-8')
+        return allocation
+
+    def _demand(self):
+        if self.demand is None:
+            return 0
+        try:
+            return self.demand()
+        except Exception:
+            return 0
+
+    def release(self, allocation):
+        self._path(allocation['id']).unlink(missing_ok=True)
+
+    @contextmanager
+    def slot(self, resolution):
+        allocation = self.acquire(resolution)
+        try:
+            yield allocation
+        finally:
+            self.release(allocation)
+
+    def stats(self):
+        running = self._running()
+        return {
+            'cpu_budget': self.budget,
+            'running_encodes': len(running),
+            'threads_allocated': sum(a['threads'] for a in running)
+        }
+
+def unfinished_jobs():
+    """Jobs en attente ou en cours (tous les workers avec le store SQLite)"""
+    return sum(n for status, n in job_store.count_by_status().items() if status not in FINISHED_STATUSES)
+
+encode_scheduler = EncodeScheduler(app.config['ENCODE_CPU_BUDGET'], Path(app.config['DATA_FOLDER']) / 'encodes',
+                                   app.config['ENCODE_CONCURRENCY'], unfinished_jobs)
+
+def encoder_options(allocation):
+    """Options x264 issues de l'allocation de l'ordonnanceur"""
+    return [
+        "-bufsize", allocation['bufsize'],
+        "-maxrate", allocation['maxrate'],
+        "-threads", str(allocation['threads'])
+    ]
+
+def container_options(streaming, fps):
+    """
+    Options du conteneur MP4 (format explicite: la sortie est un .part, voir encode_path_for)
+    - Normal: +faststart (moov déplacé au début, le fichier est réécrit à la fin)
+    - Streaming: MP4 fragmenté, un fragment par keyframe (~2s), lisible pendant l'encodage
+    """
+    if not streaming:
+        return ["-movflags", "+faststart", "-f", "mp4"]
+    return [
+        "-g", str(max(int(round(fps * 2)), 1)),
+        "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4"
+    ]
+
+def public_allocation(allocation):
+    """Allocation telle que rapportée dans le statut du job"""
+    return {k: v for k, v in allocation.items() if k != 'id'}
+
+def generate_video(background_video, audio_file, ass_file, output_video, config, progress_callback=None,
+                   audio_info=None, background_info=None, allocation_callback=None):
+    """
+    Génère la vidéo finale avec ffmpeg avec support multi-résolution et loop automatique
+    progress_callback (optionnel) reçoit l'avancement réel de l'encodage
+    audio_info / background_info (optionnels): résultats de probe partagés par le job
+    allocation_callback (optionnel) reçoit les threads/débits attribués par l'ordonnanceur
+    """
+    
+    # Obtenir les durées (un seul probe par fichier, partagé avec l'étape ASS)
+    audio_info = audio_info or probe_media(audio_file) or {}
+    background_info = background_info or probe_media(background_video) or {}
+    audio_duration = audio_info.get('duration', 0.0)
+    video_duration = background_info.get('duration', 0.0)
+    
+    print(f"⏱️  Audio: {audio_duration:.1f}s | Background: {video_duration:.1f}s")
+    
+    # Définir les résolutions
+    resolution = config.get('resolution', '1080p')
+    
+    if resolution not in RESOLUTIONS:
+        resolution = '1080p'
+    
+    res = RESOLUTIONS[resolution]
+    width = res['width']
+    height = res['height']
+    
+    print(f"📐 Résolution: {res['name']} ({width}x{height})")
+    
+    # Fond déjà mis à l'échelle (mezzanine) → pas de scale/pad à chaque rendu
+    mezzanine = get_mezzanine(background_video, resolution)
+    if mezzanine:
+        background_video = mezzanine
+        scale_filter = ""
+    else:
+        scale_filter = f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+    
+    # Background plus court → boucle via un segment pré-encodé répété par le démuxeur concat
+    # (le clip n'est plus décodé/filtré/scalé N fois, et la jonction est sans couture)
+    input_args = ["-i", background_video]
+    loop_period = None
+    if 0 < video_duration < audio_duration:
+        segment = get_loop_segment(background_video, resolution, prescaled=bool(mezzanine))
+        segment_duration = (probe_media(segment) or {}).get('duration', 0.0) if segment else 0.0
+        if segment_duration > 0:
+            loops_needed = int(audio_duration / segment_duration) + 1
+            list_path = write_loop_list(segment, loops_needed, Path(ass_file).with_suffix('.loop.txt'))
+            input_args = ["-f", "concat", "-safe", "0", "-i", list_path]
+            scale_filter = ""
+            loop_period = segment_duration
+            print(f"🔄 Background loop activé: segment {segment_duration:.1f}s x {loops_needed}")
+        else:
+            # Repli: répétition du fichier par le démuxeur (sans filtre loop)
+            loops_needed = int(audio_duration / video_duration) + 1
+            input_args = ["-stream_loop", str(loops_needed)] + input_args
+            loop_period = video_duration
+            print(f"🔄 Background loop activé: {loops_needed} répétitions")
+    else:
+        print(f"✅ Background suffisamment long")
+    
+    # Longue récitation → morceaux encodés en parallèle puis concaténés sans ré-encodage
+    # (sauf en streaming: le fichier doit grandir dans l'ordre pendant l'encodage)
+    fps = background_info.get('fps') or 30.0
+    streaming = bool(config.get('streaming'))
+    if not streaming and should_chunk(audio_duration):
+        chunks = plan_chunks(ass_file, audio_duration, fps, app.config['CHUNK_WORKERS'])
+        if len(chunks) > 1:
+            return generate_video_chunked(input_args, loop_period, scale_filter, audio_file, ass_file,
+                                          output_video, config, audio_duration, fps, chunks,
+                                          progress_callback, allocation_callback)
+    
+    video_filter = f"[0:v]{scale_filter}ass={ass_file}:fontsdir=.[v]"
+    # Audio: piste AAC préparée une fois par source, copiée sans ré-encodage
+    audio_input, audio_filter, audio_map, audio_codec = audio_track_args(audio_file, config)
+    
+    cmd = [
+        "ffmpeg", *input_args, "-i", audio_input,
+        "-filter_complex", ";".join(f for f in (audio_filter, video_filter) if f),
+        "-map", "[v]", "-map", audio_map,
+        "-t", str(audio_duration),  # Durée = audio
+        "-c:v", "libx264", 
+        "-crf", str(config['crf']),
+        "-preset", config['preset'],
+        *audio_codec
+    ]
+    
+    try:
+        # Threads et débits attribués par l'ordonnanceur (cœurs, encodages en cours, résolution)
+        with encode_scheduler.slot(resolution) as allocation:
+            print(f"🧮 Allocation: {allocation['threads']} thread(s), maxrate {allocation['maxrate']} "
+                  f"({allocation['running_encodes']} encodage(s) en cours)")
+            if allocation_callback:
+                allocation_callback(public_allocation(allocation))
+            memory_opts = [
+                "-max_muxing_queue_size", "1024",  # Plus de buffer pour Full HD
+                *encoder_options(allocation),
+                *container_options(streaming, fps)
+            ]
+            
+            # Les options doivent précéder le fichier de sortie (sinon ffmpeg les ignore)
+            started = time.time()
+            run_ffmpeg(cmd + memory_opts + ["-y", output_video], audio_duration, progress_callback)
+            elapsed = time.time() - started
+        throughput.record(config, audio_duration, elapsed)
+        print(f"⚡ Encodage: {elapsed:.1f}s ({audio_duration / elapsed:.2f}x temps réel)" if elapsed > 0 else "⚡ Encodage terminé")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Erreur ffmpeg: {e}")
+        return False
+
+# ============================================
+# RENDU MULTI-FORMAT (UN DÉCODAGE, PLUSIEURS SORTIES)
+# ============================================
+def fanout_output_name(output_name, resolution):
+    return f"{output_name}_{resolution}"
+
+def tee_output(targets):
+    """Sorties du muxeur tee: chaque fichier reçoit sa vidéo (v:i) et l'unique piste audio"""
+    return "|".join(
+        f"[f=mp4:movflags=+faststart:select=\\'v:{i},a\\']{output_video}"
+        for i, (_, _, output_video) in enumerate(targets)
+    )
+
+def generate_video_fanout(background_video, audio_file, targets, config, progress_callback=None,
+                          audio_info=None, background_info=None, allocation_callback=None):
+    """
+    Génère plusieurs résolutions en un seul ffmpeg
+    targets: [(résolution, fichier ASS, vidéo de sortie), ...]
+    - Fond décodé une fois puis "split" vers une branche scale/pad/ass par résolution
+    - Audio (piste AAC préparée) partagé par toutes les sorties via le muxeur tee
+    - Threads de l'ordonnanceur répartis entre les encodeurs x264 au prorata des pixels
+    Pas de mezzanine ni de segment de boucle (propres à une résolution): la boucle éventuelle
+    se fait par le démuxeur (-stream_loop)
+    """
+    audio_info = audio_info or probe_media(audio_file) or {}
+    background_info = background_info or probe_media(background_video) or {}
+    audio_duration = audio_info.get('duration', 0.0)
+    video_duration = background_info.get('duration', 0.0)
+    resolutions = [resolution for resolution, _, _ in targets]
+    print(f"⏱️  Audio: {audio_duration:.1f}s | Background: {video_duration:.1f}s")
+    print(f"📐 Résolutions: {', '.join(RESOLUTIONS[r]['name'] for r in resolutions)}")
+
+    input_args = ["-i", background_video]
+    if 0 < video_duration < audio_duration:
+        loops_needed = int(audio_duration / video_duration) + 1
+        input_args = ["-stream_loop", str(loops_needed)] + input_args
+        print(f"🔄 Background loop activé: {loops_needed} répétitions")
+
+    branches = [f"[0:v]split={len(targets)}" + "".join(f"[s{i}]" for i in range(len(targets)))]
+    for i, (resolution, ass_file, _) in enumerate(targets):
+        width, height = RESOLUTIONS[resolution]['width'], RESOLUTIONS[resolution]['height']
+        branches.append(
+            f"[s{i}]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,ass={ass_file}:fontsdir=.[v{i}]"
+        )
+
+    audio_input, audio_filter, audio_map, audio_codec = audio_track_args(audio_file, config)
+    cmd = [
+        "ffmpeg", *input_args, "-i", audio_input,
+        "-filter_complex", ";".join(([audio_filter] if audio_filter else []) + branches),
+        *[arg for i in range(len(targets)) for arg in ("-map", f"[v{i}]")],
+        "-map", audio_map,
+        "-t", str(audio_duration),
+        "-c:v", "libx264",
+        "-crf", str(config['crf']),
+        "-preset", config['preset'],
+        *audio_codec,
+        # Le tee ne peut pas adapter les en-têtes au conteneur: extradata globale pour le MP4
+        "-flags:v", "+global_header", "-flags:a", "+global_header",
+        "-max_muxing_queue_size", "1024"
+    ]
+
+    try:
+        with encode_scheduler.slot(resolutions) as allocation:
+            total_weight = sum(EncodeScheduler.weight(r) for r in resolutions)
+            stream_opts = []
+            streams = []
+            for i, resolution in enumerate(resolutions):
+                share = EncodeScheduler.weight(resolution) / total_weight
+                threads = max(1, int(round(allocation['threads'] * share)))
+                maxrate, bufsize = EncodeScheduler.rate_control(resolution)
+                stream_opts += [f"-threads:v:{i}", str(threads),
+                                f"-maxrate:v:{i}", maxrate, f"-bufsize:v:{i}", bufsize]
+                streams.append({'resolution': resolution, 'threads': threads, 'maxrate': maxrate})
+            print(f"🧮 Allocation: {allocation['threads']} thread(s) pour {len(targets)} sorties "
+                  f"({allocation['running_encodes']} encodage(s) en cours)")
+            if allocation_callback:
+                allocation_callback(dict(public_allocation(allocation), outputs=streams))
+
+            started = time.time()
+            run_ffmpeg(cmd + stream_opts + ["-f", "tee", "-y", tee_output(targets)],
+                       audio_duration, progress_callback)
+            elapsed = time.time() - started
+        throughput.record(config, audio_duration, elapsed)
+        print(f"⚡ Encodage multi-format: {elapsed:.1f}s ({audio_duration / elapsed:.2f}x temps réel)" if elapsed > 0 else "⚡ Encodage terminé")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Erreur ffmpeg: {e}")
+        return False
+
+# ============================================
+# ENCODAGE PAR MORCEAUX EN PARALLÈLE
+# ============================================
+def should_chunk(audio_duration):
+    """Vrai si l'audio est assez long pour être encodé en morceaux parallèles"""
+    min_duration = app.config['CHUNK_MIN_DURATION']
+    return min_duration > 0 and app.config['CHUNK_WORKERS'] > 1 and audio_duration >= min_duration
+
+def parse_ass_time(value):
+    """Convertit un temps ASS (H:MM:SS.cc) en secondes"""
+    h, m, s = value.split(':')
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+def read_ass_events(ass_file):
+    """Sépare un fichier ASS en (en-tête, [(début, fin, champs), ...])"""
+    header = []
+    events = []
+    with open(ass_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('Dialogue:'):
+                fields = line[len('Dialogue:'):].strip().split(',', 9)
+                events.append((parse_ass_time(fields[1]), parse_ass_time(fields[2]), fields))
+            elif not events:
+                header.append(line)
+    return header, events
+
+def plan_chunks(ass_file, duration, fps, workers, min_chunk=10.0):
+    """
+    Découpe la timeline en morceaux [(première image, image de fin), ...]
+    - Coupes uniquement entre deux événements ASS (frontières d'ayah / de segment):
+      aucun sous-titre ni fondu n'est coupé en deux
+    - Coupes alignées sur la grille d'images, à l'image précédant (ou égale à) la coupe:
+      chaque morceau commence sur sa propre IDR, jamais après le début de son premier événement
+    """
+    _, events = read_ass_events(ass_file)
+    cuts = sorted({start for start, _, _ in events
+                   if min_chunk <= start <= duration - min_chunk
+                   and not any(s < start < e for s, e, _ in events)})
+    if not cuts:
+        return []
+
+    total_frames = int(math.ceil(duration * fps))
+    count = max(1, min(workers, int(duration // min_chunk)))
+    boundaries = [0]
+    for k in range(1, count):
+        goal = k * duration / count
+        cut = min(cuts, key=lambda c: abs(c - goal))
+        frame = int(math.floor(cut * fps + 1e-6))
+        if frame - boundaries[-1] >= min_chunk * fps and total_frames - frame >= min_chunk * fps:
+            boundaries.append(frame)
+    boundaries.append(total_frames)
+    return list(zip(boundaries, boundaries[1:]))
+
+def write_ass_slice(header, events, start, end, output_ass):
+    """
+    Sous-titres d'un morceau [start, end[, décalés pour commencer à 0
+    Tout événement qui chevauche le morceau y est écrit, rogné à sa fenêtre: un événement
+    à cheval sur une coupe est réparti entre les deux morceaux au lieu d'être perdu
+    """
+    with open(output_ass, 'w', encoding='utf-8') as f:
+        f.writelines(header)
+        for ev_start, ev_end, fields in events:
+            if ev_start < end and ev_end > start:
+                fields = list(fields)
+                fields[1] = ass_time(max(ev_start, start) - start)
+                fields[2] = ass_time(min(ev_end, end) - start)
+                f.write("Dialogue: " + ",".join(fields) + "\n")
+
+def generate_video_chunked(input_args, loop_period, scale_filter, audio_file, ass_file, output_video,
+                           config, audio_duration, fps, chunks, progress_callback=None,
+                           allocation_callback=None):
+    """
+    Encode la vidéo en morceaux parallèles (un ffmpeg par morceau, vidéo seule),
+    puis concatène les morceaux en copie de flux avec un seul encodage audio
+    input_args: arguments d'entrée du fond (avec boucle), loop_period: période de la boucle ou None
+    Les threads attribués au job par l'ordonnanceur sont répartis entre les morceaux
+    """
+    with encode_scheduler.slot(config.get('resolution', '1080p')) as allocation:
+        workers = min(app.config['CHUNK_WORKERS'], len(chunks), allocation['threads'])
+        chunk_allocation = dict(allocation, threads=max(1, allocation['threads'] // workers))
+        if allocation_callback:
+            allocation_callback(dict(public_allocation(allocation), chunk_workers=workers,
+                                     threads_per_chunk=chunk_allocation['threads']))
+        print(f"🧩 Encodage en {len(chunks)} morceaux ({workers} en parallèle, "
+              f"{chunk_allocation['threads']} thread(s) chacun)")
+        return _encode_chunks(input_args, loop_period, scale_filter, audio_file, ass_file, output_video,
+                              config, audio_duration, fps, chunks, workers, chunk_allocation,
+                              progress_callback)
+
+def _encode_chunks(input_args, loop_period, scale_filter, audio_file, ass_file, output_video,
+                   config, audio_duration, fps, chunks, workers, allocation, progress_callback):
+
+    header, events = read_ass_events(ass_file)
+    base = Path(ass_file).with_suffix('')
+    # Morceaux vidéo (gros) sur disque, même si les sous-titres sont sur tmpfs
+    chunk_dir = Path(app.config['TEMP_FOLDER'])
+    parts = []
+
+    # Avancement agrégé: somme des temps encodés de tous les morceaux
+    lock = threading.Lock()
+    out_times = {}
+    speeds = {}
+    def chunk_progress(index):
+        def callback(p):
+            if progress_callback is None:
+                return
+            with lock:
+                out_times[index] = p['out_time']
+                speeds[index] = p['speed'] if not p['done'] else None
+                done_time = sum(out_times.values())
+                speed = sum(v for v in speeds.values() if v) or None
+            progress_callback({
+                'percent': round(min(done_time / audio_duration * 100, 99.0), 1),
+                'out_time': round(done_time, 2),
+                'speed': speed,
+                'fps': None,
+                'eta_seconds': int(math.ceil(max(audio_duration - done_time, 0.0) / speed)) if speed else None,
+                'done': False
+            })
+        return callback
+
+    def encode_chunk(index, first_frame, end_frame):
+        start = first_frame / fps
+        chunk_ass = f"{base}.part{index:03d}.ass"
+        chunk_video = str(chunk_dir / f"{base.name}.part{index:03d}.mp4")
+        write_ass_slice(header, events, start, end_frame / fps, chunk_ass)
+
+        # Position dans le fond: modulo la période de boucle (le démuxeur enchaîne ensuite)
+        seek = start % loop_period if loop_period else start
+        i = input_args.index("-i")
+        args = input_args[:i] + ["-ss", f"{seek:.3f}"] + input_args[i:]
+        cmd = [
+            "ffmpeg", *args,
+            "-vf", f"{scale_filter}ass={chunk_ass}:fontsdir=.",
+            "-an",
+            "-frames:v", str(end_frame - first_frame),
+            "-c:v", "libx264",
+            "-crf", str(config['crf']),
+            "-preset", config['preset'],
+            *encoder_options(allocation),
+            "-y", chunk_video
+        ]
+        run_ffmpeg(cmd, (end_frame - first_frame) / fps, chunk_progress(index))
+        return chunk_video
+
+    started = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(encode_chunk, i, first, end)
+                       for i, (first, end) in enumerate(chunks)]
+            parts = [f.result() for f in futures]
+
+        # Jonction: concat en copie de flux + piste audio préparée (ou encodée une seule fois)
+        list_path = f"{base}.parts.txt"
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for part in parts:
+                escaped = str(Path(part).resolve()).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        audio_input, audio_filter, audio_map, audio_codec = audio_track_args(audio_file, config)
+        cmd = [
+            "ffmpeg", "-f", "concat", "-safe", "0", "-i", list_path, "-i", audio_input,
+            *(["-filter_complex", audio_filter] if audio_filter else []),
+            "-map", "0:v", "-map", audio_map,
+            "-t", str(audio_duration),
+            "-c:v", "copy",
+            *audio_codec,
+            "-movflags", "+faststart",
+            "-f", "mp4",
+            "-y", output_video
+        ]
+        run_ffmpeg(cmd)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Erreur ffmpeg (morceaux): {e}")
+        return False
+    finally:
+        for i in range(len(chunks)):
+            (chunk_dir / f"{base.name}.part{i:03d}.mp4").unlink(missing_ok=True)
+            Path(f"{base}.part{i:03d}.ass").unlink(missing_ok=True)
+
+    elapsed = time.time() - started
+    throughput.record(config, audio_duration, elapsed)
+    if progress_callback:
+        progress_callback({'percent': 100.0, 'out_time': round(audio_duration, 2), 'speed': None,
+                           'fps': None, 'eta_seconds': 0, 'done': True})
+    print(f"⚡ Encodage: {elapsed:.1f}s ({audio_duration / elapsed:.2f}x temps réel)" if elapsed > 0 else "⚡ Encodage terminé")
+    return True
+
+# ============================================
+# MEZZANINES DE FOND PAR RÉSOLUTION
+# ============================================
+def get_mezzanine(background_path, resolution):
+    """
+    Retourne une version du fond déjà mise à l'échelle et paddée pour la résolution
+    - Transcodée une seule fois par (fond, résolution), puis réutilisée par tous les rendus
+    - GOP court et fixe, sans B-frames: décodage rapide et seek précis
+    - Invalidée automatiquement quand le mtime (ou la taille) du fond change
+    Seuls les fonds de backgrounds/ sont concernés. Retourne None en cas d'échec.
+    """
+    if not app.config['MEZZANINE_ENABLED'] or resolution not in RESOLUTIONS:
+        return None
+
+    source = Path(background_path).resolve()
+    if Path(app.config['BACKGROUNDS_FOLDER']).resolve() not in source.parents:
+        return None
+
+    try:
+        st = source.stat()
+    except OSError:
+        return None
+
+    folder = Path(app.config['CACHE_FOLDER']) / 'mezzanine'
+    folder.mkdir(parents=True, exist_ok=True)
+    prefix = f"{hashlib.sha1(str(source).encode('utf-8')).hexdigest()[:16]}_{resolution}"
+    mezzanine = folder / f"{prefix}_{st.st_mtime_ns}_{st.st_size}.mp4"
+    if mezzanine.exists():
+        return str(mezzanine)
+
+    # Verrou inter-process: un seul worker transcode un même fond
+    with key_lock(folder, prefix):
+        if mezzanine.exists():
+            return str(mezzanine)
+
+        # Supprimer les versions obsolètes (fond modifié depuis)
+        for stale in folder.glob(f"{prefix}_*.mp4"):
+            stale.unlink()
+
+        width = RESOLUTIONS[resolution]['width']
+        height = RESOLUTIONS[resolution]['height']
+        print(f"🎞️  Création mezzanine {source.name} → {resolution}")
+
+        tmp = folder / f".{prefix}.{uuid.uuid4().hex[:8]}.mp4"
+        cmd = [
+            "ffmpeg", "-i", str(source),
+            "-an",
+            "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,format=yuv420p",
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+            "-crf", "16",            # Quasi sans perte: la qualité finale reste dictée par le rendu
+            "-g", "30", "-keyint_min", "30", "-sc_threshold", "0",
+            "-bf", "0",
+            "-tune", "fastdecode",
+            "-movflags", "+faststart",
+            "-y", str(tmp)
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            os.replace(tmp, mezzanine)
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"⚠️ Mezzanine impossible pour {source.name}, rendu depuis la source: {e}")
+            tmp.unlink(missing_ok=True)
+            return None
+
+    return str(mezzanine)
+
+def get_loop_segment(background_path, resolution, prescaled):
+    """
+    Segment de boucle sans couture pour un (fond, résolution), encodé une seule fois
+    - Fin du clip fondue (xfade) dans son début: la jonction entre deux répétitions est invisible
+    - GOP fermé de taille fixe et nombre entier de GOPs: chaque répétition démarre sur une IDR
+    Le rendu le répète ensuite via le démuxeur concat, sans filtre loop ni re-scaling
+    prescaled: le fond est déjà à la résolution cible (mezzanine). Retourne None en cas d'échec.
+    Segments gardés dans loop_cache (budget LRU): les fonds téléchargés en créent un par contenu
+    """
+    if not app.config['MEZZANINE_ENABLED'] or not loop_cache.enabled or resolution not in RESOLUTIONS:
+        return None
+    info = probe_media(background_path) or {}
+    duration = info.get('duration') or 0.0
+    fps = info.get('fps') or 30.0
+    if duration <= 0.5:
+        return None
+
+    folder = loop_cache.folder
+    key = hashlib.sha1(f"{file_identity(background_path)}:{resolution}".encode('utf-8')).hexdigest()[:24]
+    cached = loop_cache.lookup(key)
+    if cached:
+        return str(cached)
+    segment = loop_cache.path_for(key)
+
+    with key_lock(folder, key):
+        if segment.exists():
+            return str(segment)
+
+        width = RESOLUTIONS[resolution]['width']
+        height = RESOLUTIONS[resolution]['height']
+        scale = "" if prescaled else f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+
+        # Fondu de raccord: la fin du segment se fond dans le début du clip
+        # Longueur d'abord arrondie à un nombre entier de GOPs, puis fondu placé à sa toute fin:
+        # le segment s'arrête sur source t=xfade, la répétition suivante repart de t=xfade
+        xfade = min(0.5, duration / 4)
+        gop = max(int(round(fps)), 1)
+        max_frames = int((duration - xfade) * fps)
+        if max_frames >= gop:
+            frames = max_frames // gop * gop
+        else:
+            frames = gop = max(max_frames, 1)  # Clip plus court qu'un GOP: un seul GOP
+        length = frames / fps
+
+        filter_complex = (
+            f"[0:v]{scale}fps={fps},format=yuv420p,split[body][head];"
+            f"[body]trim=start={xfade}:end={xfade + length:.3f},setpts=PTS-STARTPTS[b];"
+            f"[head]trim=end={xfade},setpts=PTS-STARTPTS[h];"
+            f"[b][h]xfade=transition=fade:duration={xfade}:offset={length - xfade:.3f}[v]"
+        )
+        print(f"🔁 Création segment de boucle {Path(background_path).name} → {resolution} ({frames} images)")
+
+        tmp = folder / f".{key}.{uuid.uuid4().hex[:8]}.tmp"  # Hors du glob du cache (*.mp4)
+        cmd = [
+            "ffmpeg", "-i", str(background_path),
+            "-filter_complex", filter_complex,
+            "-map", "[v]", "-an",
+            "-frames:v", str(frames),
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+            "-crf", "16",
+            "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+            "-flags", "+cgop", "-bf", "0",
+            "-tune", "fastdecode",
+            "-f", "mp4",
+            "-y", str(tmp)
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            os.replace(tmp, segment)
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"⚠️ Segment de boucle impossible pour {Path(background_path).name}: {e}")
+            tmp.unlink(missing_ok=True)
+            return None
+    loop_cache.evict()
+
+    return str(segment)
+
+def write_loop_list(segment, loops, list_path):
+    """Liste du démuxeur concat répétant le segment de boucle"""
+    escaped = str(Path(segment).resolve()).replace("'", "'\\''")
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write(f"file '{escaped}'\n" * loops)
+    return str(list_path)
+
+# ============================================
+# CACHE DE RENDU (CONTENT-ADDRESSED)
+# ============================================
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hash SHA-256 du contenu d'un fichier"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+_file_digests = OrderedDict()  # (dev, inode, taille, mtime) → sha256
+_file_digests_lock = threading.Lock()
+
+def file_digest(path, max_entries=4096):
+    """
+    sha256 du contenu, calculé au plus une fois par fichier (inode, taille, mtime) dans le process
+    - Entrées du cache média: lu dans leurs métadonnées (hash calculé pendant le téléchargement)
+    - Les hard links d'une entrée dans les espaces de travail partagent son inode, donc son résultat
+    """
+    st = os.stat(path)
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _file_digests_lock:
+        digest = _file_digests.get(key)
+        if digest:
+            _file_digests.move_to_end(key)
+            return digest
+    digest = media_cache.digest(path) or file_sha256(path)
+    with _file_digests_lock:
+        _file_digests[key] = digest
+        while len(_file_digests) > max_entries:
+            _file_digests.popitem(last=False)
+    return digest
+
+def file_identity(path):
+    """
+    Identité stable d'un fichier pour les clés de cache
+    - Fichiers téléchargés (espaces de travail des jobs, cache média): hash du contenu
+    - Fichiers locaux (backgrounds/): chemin + taille + mtime (évite de hasher des Go)
+    """
+    p = Path(path).resolve()
+    downloaded = [Path(app.config['UPLOAD_FOLDER']).resolve(), Path(app.config['TEMP_FOLDER']).resolve(),
+                  (Path(app.config['CACHE_FOLDER']) / 'media').resolve()]
+    if app.config['WORKSPACE_TMPFS']:
+        downloaded.append(Path(app.config['WORKSPACE_TMPFS']).resolve())
+    if any(folder in p.parents for folder in downloaded):
+        return f"sha256:{file_digest(p)}"
+    st = p.stat()
+    return f"file:{p}:{st.st_size}:{st.st_mtime_ns}"
+
+def normalize_verse_text(text):
+    """Normalisation du texte pour les clés de cache (NFC, espaces, invisibles)"""
+    text = normalize('NFC', text)
+    text = re.sub(r'[\u200B-\u200D\uFEFF]', '', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+KEY_LOCK_STRIPES = 64
+
+@contextmanager
+def key_lock(folder, key):
+    """
+    Verrou inter-process (flock) pour produire une entrée de cache une seule fois
+    Fichiers de verrou en nombre fixe (.lock-00 … .lock-63) partagés par hachage de la clé:
+    le dossier ne grossit pas d'un fichier par clé; deux clés d'une même bande s'attendent
+    """
+    stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % KEY_LOCK_STRIPES
+    with open(Path(folder) / f".lock-{stripe:02d}", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def link_or_copy(src, dst):
+    """
+    Hard link si possible (même volume), sinon reflink (copy-on-write), sinon copie
+    Écrit sous un nom temporaire puis renomme: dst n'est remplacé que si src a pu être lié
+    (FileNotFoundError si src a disparu, dst intact)
+    """
+    dst = Path(dst)
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        try:
+            os.link(src, tmp)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            reflink = subprocess.run(["cp", "--reflink=always", str(src), str(tmp)],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if reflink.returncode != 0:
+                shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+class DiskLRUCache:
+    """
+    Cache de fichiers sur disque avec budget en octets et éviction LRU
+    Le mtime sert d'horodatage d'accès: partagé entre workers sans état en mémoire
+    min_age: entrées utilisées depuis moins de min_age secondes jamais évincées
+    (fichiers relus pendant tout un rendu, ex. segments de boucle répétés par concat)
+    """
+    def __init__(self, folder, max_bytes, suffix='', min_age=0):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.min_age = min_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = None  # Dernière taille totale connue
+        self._lock = threading.Lock()
+        if self.enabled:
+            self.folder.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, key):
+        return self.folder / f"{key}{self.suffix}"
+
+    def lookup(self, key):
+        """Retourne le chemin en cache (et le marque comme récent) ou None"""
+        if not self.enabled:
+            return None
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, src):
+        """Ajoute un fichier au cache (lien atomique) puis applique le budget"""
+        if not self.enabled:
+            return None
+        path = self.path_for(key)
+        tmp = self.folder / f".{key}.{uuid.uuid4().hex[:8]}.tmp"
+        link_or_copy(src, tmp)
+        os.replace(tmp, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Supprime les entrées les moins récemment utilisées au-delà du budget"""
+        entries = []
+        for f in self.folder.glob(f"*{self.suffix}"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        now = time.time()
+        for mtime, size, f in entries:
+            if total <= self.max_bytes or now - mtime < self.min_age:
+                break
+            try:
+                f.unlink()
+                self._on_evict(f)
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+            except OSError:
+                pass
+        self.bytes = total
+
+    def _on_evict(self, path):
+        """Hook pour supprimer les fichiers annexes d'une entrée évincée"""
+        pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes
+            }
+
+render_cache = DiskLRUCache(Path(app.config['CACHE_FOLDER']) / 'renders',
+                            app.config['RENDER_CACHE_MAX_BYTES'], suffix='.mp4')
+# Segments de boucle (voir get_loop_segment): relus par concat tant que le rendu dure
+loop_cache = DiskLRUCache(Path(app.config['CACHE_FOLDER']) / 'loops',
+                          app.config['LOOP_CACHE_MAX_BYTES'], suffix='.mp4', min_age=3600)
+
+def render_cache_key(verse_text, audio_path, background_path, config):
+    """
+    Clé de cache: texte normalisé + contenu audio + identité du fond + config effective
+    audio_path peut être une liste (plage d'ayahs, audios dans l'ordre)
+    """
+    if isinstance(audio_path, (list, tuple)):
+        audio = [f"sha256:{file_digest(p)}" for p in audio_path]
+    else:
+        audio = f"sha256:{file_digest(audio_path)}"
+    payload = json.dumps({
+        'text': normalize_verse_text(verse_text),
+        'audio': audio,
+        'background': file_identity(background_path),
+        'config': config
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def publish_cached_output(cached_path, output_name, job_id=None, config=None):
+    """Lie un rendu en cache dans outputs/ sous le nom demandé"""
+    output_path = Path(app.config['OUTPUT_FOLDER']) / f"{output_name}.mp4"
+    link_or_copy(cached_path, output_path)
+    output_catalog.add(output_path, job_id, config)
+    return output_path
+
+def complete_from_cache(job_id, cached_path, verse_text, output_name, config, callback_url=None, dedupe_key=None):
+    """
+    Crée un job terminé pointant sur un rendu identique en cache
+    - Job créé (ou requête rattachée à un job identique) AVANT de publier: outputs/ n'est
+      écrit que pour un nouveau job, jamais par-dessus le fichier d'un autre
+    - Entrée évincée entre le lookup et la liaison: retourne None, l'appelant lance un rendu normal
+    """
+    job = {
+        'id': job_id,
+        'status': 'queued',
+        'progress': 0,
+        'verse_text': verse_text[:50] + '...' if len(verse_text) > 50 else verse_text,
+        'started_at': datetime.now().isoformat(),
+        'finished_at': None,
+        'output_path': None,
+        'download_url': None,
+        'error': None
+    }
+    if callback_url:
+        job['callback_url'] = callback_url
+    if dedupe_key:
+        job['dedupe_key'] = dedupe_key
+    existing = job_store.create(job)
+    if existing:
+        return attached_job_response(existing, dedupe_key, callback_url)
+
+    try:
+        output_path = publish_cached_output(cached_path, output_name, job_id, config)
+    except FileNotFoundError:
+        job_store.delete(job_id)
+        print(f"⚠️ Rendu en cache évincé avant publication, rendu normal pour {job_id}")
+        return None
+    job_store.update(job_id, status='completed', progress=100, finished_at=datetime.now().isoformat(),
+                     output_path=str(output_path), download_url=f"/api/download/{output_path.name}", cached=True)
+    metrics.inc('quran_video_jobs_finished_total', status='completed', resolution=resolution_label(config))
+    notify_job_finished(job_id)
+    print(f"⚡ Job {job_id} servi depuis le cache de rendu")
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'completed',
+        'status_url': f"/api/status/{job_id}",
+        'download_url': f"/api/download/{output_path.name}",
+        'stream_url': f"/api/stream/{job_id}",
+        'cached': True,
+        'estimated_time': 0
+    }), 200
+
+# ============================================
+# CACHE MÉDIA (AUDIO RÉCITATEURS + FONDS DISTANTS)
+# ============================================
+class MediaCache(DiskLRUCache):
+    """
+    Cache disque des fichiers téléchargés, indexé par URL
+    - Entrée fraîche (< MEDIA_CACHE_TTL): aucun accès réseau
+    - Entrée expirée: revalidation conditionnelle (ETag / Last-Modified → 304)
+    - Le fichier est lié (hard link / reflink) dans le dossier du job, jamais copié si possible
+    Métadonnées dans un fichier .json à côté de chaque entrée
+    """
+    def __init__(self, folder, max_bytes, ttl):
+        super().__init__(folder, max_bytes, suffix='.bin')
+        self.ttl = ttl
+        self.revalidations = 0
+        self.bytes_downloaded = 0
+
+    @staticmethod
+    def key_for(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _meta_path(self, key):
+        return self.folder / f"{key}.json"
+
+    def _on_evict(self, path):
+        try:
+            path.with_suffix('.json').unlink()
+        except OSError:
+            pass
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        tmp = self.folder / f".{key}.{uuid.uuid4().hex[:8]}.json.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path(key))
+
+    def digest(self, path):
+        """
+        sha256 d'une entrée depuis ses métadonnées, sans relire le fichier (None si inconnu)
+        Valide seulement si l'inode et la taille notés correspondent au fichier actuel
+        """
+        path = Path(path)
+        if path.suffix != self.suffix or path.parent.resolve() != self.folder.resolve():
+            return None
+        meta = self._read_meta(path.stem)
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        if meta and meta.get('sha256') and meta.get('ino') == st.st_ino and meta.get('size') == st.st_size:
+            return meta['sha256']
+        return None
+
+    def peek(self, url):
+        """Chemin de l'entrée si elle est fraîche (aucun accès réseau nécessaire), sinon None"""
+        if not self.enabled:
+            return None
+        key = self.key_for(url)
+        path = self.path_for(key)
+        meta = self._read_meta(key) if path.exists() else None
+        if meta and time.time() - meta.get('validated_at', 0) < self.ttl:
+            return path
+        return None
+
+    def _deliver(self, path, destination):
+        """Lie l'entrée dans le dossier du job; son sha256 (métadonnées) est mémorisé pour l'inode partagé"""
+        link_or_copy(path, destination)
+        try:
+            file_digest(path)
+        except OSError:
+            pass
+
+    def fetch(self, url, destination):
+        """Place le contenu de l'URL dans destination, depuis le cache si possible"""
+        key = self.key_for(url)
+        path = self.path_for(key)
+        meta = self._read_meta(key) if path.exists() else None
+        now = time.time()
+
+        # 1. Entrée fraîche → aucun accès réseau
+        if meta and now - meta.get('validated_at', 0) < self.ttl:
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            self._deliver(path, destination)
+            return True
+
+        # 2. Requête (conditionnelle si on a déjà une copie)
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = http_session.get(url, headers=headers, stream=True, timeout=30)
+            if response.status_code == 304 and meta:
+                response.close()
+                meta['validated_at'] = now
+                self._write_meta(key, meta)
+                os.utime(path)
+                with self._lock:
+                    self.revalidations += 1
+                self._deliver(path, destination)
+                return True
+            response.raise_for_status()
+
+            tmp = self.folder / f".{key}.{uuid.uuid4().hex[:8]}.tmp"
+            h = hashlib.sha256()
+            size = 0
+            with open(tmp, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    h.update(chunk)
+                    size += len(chunk)
+            ino = os.stat(tmp).st_ino  # Lie le sha256 à ce contenu précis (voir digest)
+            os.replace(tmp, path)
+            self._write_meta(key, {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha256': h.hexdigest(),
+                'size': size,
+                'ino': ino,
+                'validated_at': now
+            })
+            with self._lock:
+                self.misses += 1
+                self.bytes_downloaded += size
+            metrics.inc('quran_video_bytes_downloaded_total', size)
+        except Exception as e:
+            if meta:
+                # Réseau indisponible: on sert la copie expirée plutôt que d'échouer
+                print(f"⚠️ Revalidation impossible, copie en cache utilisée pour {url}: {e}")
+                self._deliver(path, destination)
+                return True
+            print(f"Erreur téléchargement {url}: {e}")
+            return False
+
+        self._deliver(path, destination)
+        self.evict()
+        return True
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['revalidations'] = self.revalidations
+            stats['bytes_downloaded'] = self.bytes_downloaded
+        return stats
+
+media_cache = MediaCache(Path(app.config['CACHE_FOLDER']) / 'media',
+                         app.config['MEDIA_CACHE_MAX_BYTES'], app.config['MEDIA_CACHE_TTL'])
+
+# ============================================
+# PISTES AUDIO PRÉPARÉES (AAC MIS EN CACHE)
+# ============================================
+audio_cache = DiskLRUCache(Path(app.config['CACHE_FOLDER']) / 'audio',
+                           app.config['AUDIO_CACHE_MAX_BYTES'], suffix='.m4a')
+
+def prepare_audio_track(audio_file, bitrate):
+    """
+    Piste AAC prête à muxer en copie de flux: audio source + 1s de silence (apad), au débit demandé
+    - Encodée une seule fois par (contenu audio, débit), puis réutilisée par tous les rendus
+      de cet audio (autres fonds, autres résolutions, morceaux parallèles)
+    - Retourne le chemin de la piste, ou None (cache désactivé, échec): le rendu encode alors l'audio
+    """
+    if not audio_cache.enabled:
+        return None
+    try:
+        key = hashlib.sha256(f"{file_digest(audio_file)}:{bitrate}:apad=1".encode('utf-8')).hexdigest()[:32]
+    except OSError:
+        return None
+    cached = audio_cache.lookup(key)
+    if cached:
+        return str(cached)
+
+    # Verrou inter-process: un seul worker encode une même piste
+    with key_lock(audio_cache.folder, key):
+        track = audio_cache.path_for(key)
+        if track.exists():
+            return str(track)
+
+        tmp = audio_cache.folder / f".{key}.{uuid.uuid4().hex[:8]}.tmp"
+        cmd = [
+            "ffmpeg", "-i", audio_file,
+            "-vn",
+            "-af", "apad=pad_dur=1",
+            "-c:a", "aac",
+            "-b:a", bitrate,
+            "-f", "mp4",  # Extension .tmp: format explicite
+            "-y", str(tmp)
+        ]
+        try:
+            with metrics.time('quran_video_stage_seconds', stage='audio'):
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            os.replace(tmp, track)
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"⚠️ Piste audio impossible pour {Path(audio_file).name}, encodage dans le rendu: {e}")
+            tmp.unlink(missing_ok=True)
+            return None
+    audio_cache.evict()
+    print(f"🎧 Piste AAC préparée: {Path(audio_file).name} ({bitrate})")
+    return str(track)
+
+def audio_track_args(audio_file, config):
+    """
+    Audio d'un rendu (2e entrée ffmpeg): piste préparée copiée telle quelle,
+    ou à défaut apad + AAC dans le rendu
+    Retourne (fichier d'entrée, filtre audio du filter_complex ou None, map audio, options codec)
+    """
+    track = prepare_audio_track(audio_file, config['audio_bitrate'])
+    if track:
+        return track, None, "1:a", ["-c:a", "copy"]
+    return audio_file, "[1:a]apad=pad_dur=1[a]", "[a]", ["-c:a", "aac", "-b:a", config['audio_bitrate']]
+
+# ============================================
+# ESPACES DE TRAVAIL DES JOBS
+# ============================================
+class JobWorkspace:
+    """
+    Dossiers possédant tous les fichiers intermédiaires d'un job, supprimés à la sortie
+    (succès, erreur ou exception)
+    - root (uploads/<job_id>): gros fichiers (fond téléchargé, audio concaténé)
+    - scratch (WORKSPACE_TMPFS/<job_id> ou temp/<job_id>): petits fichiers (ASS, audio)
+    Un verrou fcntl (uploads/.<job_id>.lock) tenu pendant la vie du job signale l'espace comme
+    actif: au redémarrage, sweep_orphan_workspaces supprime ceux dont le process a disparu
+    Verrou pris AVANT de créer les dossiers, et tenu par le balayage pendant qu'il supprime:
+    un espace tout juste créé n'est jamais pris pour un orphelin
+    """
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.root = Path(app.config['UPLOAD_FOLDER']) / job_id
+        self.scratch = Path(app.config['WORKSPACE_TMPFS'] or app.config['TEMP_FOLDER']) / job_id
+        self._lock = None
+
+    @staticmethod
+    def lock_path(job_id):
+        return Path(app.config['UPLOAD_FOLDER']) / f".{job_id}.lock"
+
+    @classmethod
+    def _acquire(cls, job_id, blocking=True):
+        """Verrou du job, None s'il est déjà tenu (non bloquant)"""
+        path = cls.lock_path(job_id)
+        while True:
+            f = open(path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                f.close()
+                return None
+            try:
+                if os.fstat(f.fileno()).st_ino == path.stat().st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()  # Fichier supprimé par le balayage pendant l'attente: recommencer
+
+    @classmethod
+    def _release(cls, job_id, lock):
+        cls.lock_path(job_id).unlink(missing_ok=True)
+        lock.close()
+
+    def __enter__(self):
+        self._lock = self._acquire(self.job_id)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.scratch.mkdir(parents=True, exist_ok=True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._release(self.job_id, self._lock)
+        return False
+
+    def path(self, name):
+        """Fichier sur disque (volumineux)"""
+        return str(self.root / name)
+
+    def small_path(self, name):
+        """Petit fichier intermédiaire (tmpfs si configuré)"""
+        return str(self.scratch / name)
+
+    @classmethod
+    @contextmanager
+    def claim_orphan(cls, job_id):
+        """
+        Vrai si aucun process ne tient l'espace du job: le verrou est alors gardé pendant le bloc
+        (le job ne peut pas démarrer pendant la suppression), puis son fichier supprimé
+        """
+        lock = cls._acquire(job_id, blocking=False)
+        if lock is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            cls._release(job_id, lock)
+
+def workspace_job_id(name):
+    """Job d'une entrée des dossiers de travail: "<job_id>", "<job_id>.ass", ".<job_id>.lock"..."""
+    if name.startswith('.') and name.endswith('.lock'):
+        return name[1:-len('.lock')]
+    return name.split('.', 1)[0]
+
+def sweep_orphan_workspaces():
+    """
+    Supprime les espaces de travail et fichiers temporaires laissés par un process arrêté
+    (les jobs en cours dans d'autres workers tiennent leur verrou et sont épargnés)
+    """
+    folders = [app.config['UPLOAD_FOLDER'], app.config['TEMP_FOLDER']]
+    if app.config['WORKSPACE_TMPFS']:
+        folders.append(app.config['WORKSPACE_TMPFS'])
+    removed = 0
+    for folder in folders:
+        for entry in Path(folder).iterdir():
+            job_id = workspace_job_id(entry.name)
+            if not job_id:
+                continue
+            with JobWorkspace.claim_orphan(job_id) as orphan:
+                if not orphan or not os.path.lexists(entry):
+                    continue  # Job actif, ou verrou orphelin déjà supprimé avec son job
+                try:
+                    if entry.is_dir():
+                        shutil.rmtree(entry)
+                    else:
+                        entry.unlink()
+                    removed += 1
+                except OSError:
+                    continue
+    # Encodages interrompus dans outputs/ ("<nom>.mp4.<job_id>.part")
+    for entry in Path(app.config['OUTPUT_FOLDER']).glob('*.part'):
+        job_id = entry.name.rsplit('.', 2)[-2]
+        with JobWorkspace.claim_orphan(job_id) as orphan:
+            if orphan:
+                entry.unlink(missing_ok=True)
+                removed += 1
+    if removed:
+        print(f"🧹 {removed} espace(s) de travail orphelin(s) supprimé(s)")
+
+def recover_interrupted_jobs():
+    """Jobs en cours d'un process disparu → erreur, callback_url notifié"""
+    recovered = job_store.recover_stale_jobs()
+    for job_id in recovered:
+        notify_job_finished(job_id)
+    if recovered:
+        print(f"♻️ {len(recovered)} job(s) interrompu(s) passé(s) en erreur")
+    return recovered
+
+def run_job_heartbeat(interval):
+    """Battement de cœur de ce process + récupération périodique des jobs fantômes"""
+    while True:
+        time.sleep(interval)
+        try:
+            job_store.heartbeat()
+            recover_interrupted_jobs()
+        except Exception as e:
+            print(f"⚠️ Battement de cœur des jobs: {e}")
+
+sweep_orphan_workspaces()
+job_store.heartbeat()
+recover_interrupted_jobs()
+if app.config['JOB_HEARTBEAT_INTERVAL'] > 0:
+    threading.Thread(target=run_job_heartbeat, args=(app.config['JOB_HEARTBEAT_INTERVAL'],),
+                     daemon=True, name='job-heartbeat').start()
+
+# ============================================
+# ÉTAPE DE TÉLÉCHARGEMENT (DANS LE PIPELINE DU JOB)
+# ============================================
+class FetchError(Exception):
+    """Échec du téléchargement d'une entrée du job"""
+    pass
+
+fetch_executor = ThreadPoolExecutor(max_workers=app.config['FETCH_WORKERS'], thread_name_prefix='fetch')
+
+def resolve_background(background_input):
+    """
+    Résout le fond demandé sans rien télécharger
+    Retourne (source, None) où source est un chemin local ou une URL,
+    ou (None, (réponse_erreur, code)) si le fond est introuvable
+    """
+    if background_input == 'default':
+        # Utiliser le fond par défaut
+        default_bg = Path(app.config['BACKGROUNDS_FOLDER']) / "default.mp4"
+        if not default_bg.exists():
+            return None, (jsonify({'error': 'Fond par défaut introuvable. Placez un fichier default.mp4 dans backgrounds/'}), 500)
+        return str(default_bg), None
+
+    if background_input.startswith('http'):
+        # Téléchargé plus tard, dans l'étape "downloading" du job
+        return background_input, None
+
+    # Fichier local dans backgrounds/
+    local_bg = Path(app.config['BACKGROUNDS_FOLDER']) / background_input
+
+    # 🎲 Si c'est un dossier, choisir une vidéo aléatoire dedans
+    if local_bg.is_dir():
+        # Chercher tous les fichiers vidéo dans le dossier
+        video_files = list(local_bg.glob('*.mp4')) + list(local_bg.glob('*.mov')) + \
+                     list(local_bg.glob('*.avi')) + list(local_bg.glob('*.mkv'))
+
+        if not video_files:
+            return None, (jsonify({'error': f'Aucune vidéo trouvée dans le dossier {background_input}'}), 404)
+
+        # Choisir aléatoirement
+        background_path = str(random.choice(video_files))
+        print(f"🎲 Vidéo choisie aléatoirement: {Path(background_path).name}")
+        return background_path, None
+
+    # Si c'est un fichier direct
+    if local_bg.exists():
+        return str(local_bg), None
+
+    # Ni fichier ni dossier trouvé
+    return None, (jsonify({'error': f'Fond {background_input} introuvable dans backgrounds/ (ni fichier ni dossier)'}), 404)
+
+def fetch_job_inputs(workspace, audio_url, background_source):
+    """
+    Télécharge l'audio et le fond (si URL) en parallèle dans l'espace du job
+    Retourne (audio_path, background_path), lève FetchError en cas d'échec
+    """
+    audio_path = workspace.small_path("audio.mp3")
+    downloads = {'audio': fetch_executor.submit(download_file, audio_url, audio_path)}
+
+    background_path = background_source
+    if background_source.startswith('http'):
+        background_path = workspace.path("background.mp4")
+        downloads['background'] = fetch_executor.submit(download_file, background_source, background_path)
+
+    for name, future in downloads.items():
+        if not future.result():
+            raise FetchError(f'Erreur téléchargement {name}')
+    return audio_path, background_path
+
+def peek_cached_inputs(audio_url, background_source):
+    """
+    Chemins des entrées si elles sont déjà disponibles localement sans réseau
+    (cache média frais ou fond local), sinon None
+    """
+    audio_path = media_cache.peek(audio_url)
+    if audio_path is None:
+        return None
+    if background_source.startswith('http'):
+        background_path = media_cache.peek(background_source)
+        if background_path is None:
+            return None
+        return str(audio_path), str(background_path)
+    return str(audio_path), background_source
+
+def complete_job_from_cache(job_id, cache_key, output_name, config):
+    """
+    Termine le job depuis le cache de rendu si la clé y est, retourne True si c'est le cas
+    (False aussi si l'entrée est évincée entre le lookup et la liaison: le job fait le rendu)
+    """
+    cached_path = render_cache.lookup(cache_key)
+    if not cached_path:
+        return False
+    try:
+        output_path = publish_cached_output(cached_path, output_name, job_id, config)
+    except FileNotFoundError:
+        return False
+    job_store.update(
+        job_id,
+        status='completed',
+        progress=100,
+        output_path=str(output_path),
+        download_url=f"/api/download/{output_name}.mp4",
+        finished_at=datetime.now().isoformat(),
+        cached=True
+    )
+    print(f"⚡ Job {job_id} servi depuis le cache de rendu")
+    return True
+
+def job_progress_callback(job_id):
+    """Avancement réel de l'encodage écrit dans le store (au plus 1x/seconde)"""
+    last_update = [0.0]
+    def on_progress(p):
+        now = time.time()
+        if now - last_update[0] < 1.0 and not p['done']:
+            return
+        last_update[0] = now
+        fields = {'encode': p}
+        if p['percent'] is not None:
+            fields['progress'] = max(5, min(int(p['percent']), 99))
+        job_store.update(job_id, **fields)
+    return on_progress
+
+def encode_path_for(output_path, job_id):
+    """
+    Fichier d'encodage d'une sortie: "<nom>.mp4.<job_id>.part", renommé sur outputs/<nom>.mp4 à la fin
+    Jamais d'écriture en place dans outputs/: la vidéo précédente de même nom peut partager
+    son inode avec une entrée du cache de rendu (hard link), elle est remplacée, pas réécrite
+    """
+    return output_path.with_name(f"{output_path.name}.{job_id}.part")
+
+def render_job_video(job_id, workspace, timeline, audio_path, background_path, config, output_name, cache_key=None):
+    """
+    Étapes communes à tous les jobs: probe → sous-titres → encodage → publication
+    timeline: [(texte, début, durée), ...], durée None = jusqu'à la fin de l'audio
+    workspace: JobWorkspace du job (sous-titres et fichiers intermédiaires)
+    Plusieurs résolutions demandées: cache_key est {résolution: clé} (voir render_job_fanout)
+    """
+    # Un seul probe par fichier pour tout le job
+    audio_info = probe_media(audio_path)
+    background_info = probe_media(background_path)
+    if not audio_info:
+        job_store.update(job_id, status='error', error='Audio illisible (ffprobe)')
+        return
+    timeline = [(text, start, duration if duration is not None else audio_info['duration'] - start)
+                for text, start, duration in timeline]
+
+    if len(config_resolutions(config)) > 1:
+        return render_job_fanout(job_id, workspace, timeline, audio_path, background_path, config,
+                                 output_name, cache_key or {}, audio_info, background_info)
+
+    # Mise à jour: génération ASS
+    job_store.update(job_id, status='generating_subtitles', progress=5)
+
+    ass_path = Path(workspace.small_path(f"{job_id}.ass"))
+    with metrics.time('quran_video_stage_seconds', stage='subtitles'):
+        subtitles_ok = generate_ass_timeline(timeline, str(ass_path), config)
+    if not subtitles_ok:
+        job_store.update(job_id, status='error', error='Erreur génération des sous-titres')
+        return
+
+    # Mise à jour: génération vidéo
+    job_store.update(job_id, status='generating_video', progress=5)
+
+    on_progress = job_progress_callback(job_id)
+    output_path = Path(app.config['OUTPUT_FOLDER']) / f"{output_name}.mp4"
+    # Encodage dans un .part renommé à la fin (lisible pendant l'encodage en streaming: /api/stream)
+    encode_path = encode_path_for(output_path, job_id)
+    if config.get('streaming'):
+        job_store.update(job_id, stream_path=str(encode_path))
+    encode_started = time.perf_counter()
+    if not generate_video(background_path, audio_path, str(ass_path), str(encode_path), config,
+                          progress_callback=on_progress,
+                          audio_info=audio_info, background_info=background_info,
+                          allocation_callback=lambda a: job_store.update(job_id, encoder_allocation=a)):
+        encode_path.unlink(missing_ok=True)
+        job_store.update(job_id, status='error', error='Erreur génération de la vidéo')
+        return
+    os.replace(encode_path, output_path)
+    output_catalog.add(output_path, job_id, config)
+    encode_seconds = time.perf_counter() - encode_started
+    metrics.observe('quran_video_stage_seconds', encode_seconds, stage='encode')
+    if encode_seconds > 0:
+        metrics.observe('quran_video_encode_realtime_factor', audio_info['duration'] / encode_seconds,
+                        buckets=REALTIME_FACTOR_BUCKETS, resolution=resolution_label(config))
+
+    with metrics.time('quran_video_stage_seconds', stage='finalize'):
+        if cache_key:
+            render_cache.store(cache_key, output_path)
+
+        # Terminé
+        job_store.update(
+            job_id,
+            status='completed',
+            progress=100,
+            output_path=str(output_path),
+            download_url=f"/api/download/{output_name}.mp4",
+            finished_at=datetime.now().isoformat()
+        )
+
+    print(f"✅ Vidéo {job_id} générée: {output_path}")
+
+def render_job_fanout(job_id, workspace, timeline, audio_path, background_path, config, output_name,
+                      cache_keys, audio_info, background_info):
+    """
+    Job multi-format: un fichier par résolution ({output_name}_{résolution}.mp4)
+    Résolutions déjà en cache publiées directement, les autres encodées en un seul ffmpeg
+    cache_keys: {résolution: clé du cache de rendu}
+    """
+    outputs = []
+    targets = []
+    for resolution in config_resolutions(config):
+        name = fanout_output_name(output_name, resolution)
+        output = {'resolution': resolution,
+                  'output_path': str(Path(app.config['OUTPUT_FOLDER']) / f"{name}.mp4"),
+                  'download_url': f"/api/download/{name}.mp4"}
+        outputs.append(output)
+        cached_path = render_cache.lookup(cache_keys[resolution]) if resolution in cache_keys else None
+        if cached_path:
+            try:
+                publish_cached_output(cached_path, name, job_id, dict(config, resolution=resolution))
+                output['cached'] = True
+            except FileNotFoundError:
+                cached_path = None  # Évincé entre-temps: encodé avec les autres sorties
+        if not cached_path:
+            targets.append((resolution, workspace.small_path(f"{job_id}_{resolution}.ass"),
+                            str(encode_path_for(Path(output['output_path']), job_id))))
+
+    if targets:
+        job_store.update(job_id, status='generating_subtitles', progress=5)
+        with metrics.time('quran_video_stage_seconds', stage='subtitles'):
+            for resolution, ass_file, _ in targets:
+                if not generate_ass_timeline(timeline, ass_file, dict(config, resolution=resolution)):
+                    job_store.update(job_id, status='error', error='Erreur génération des sous-titres')
+                    return
+
+        job_store.update(job_id, status='generating_video', progress=5)
+        encode_started = time.perf_counter()
+        if not generate_video_fanout(background_path, audio_path, targets, config,
+                                     progress_callback=job_progress_callback(job_id),
+                                     audio_info=audio_info, background_info=background_info,
+                                     allocation_callback=lambda a: job_store.update(job_id, encoder_allocation=a)):
+            for _, _, encode_path in targets:
+                Path(encode_path).unlink(missing_ok=True)
+            job_store.update(job_id, status='error', error='Erreur génération de la vidéo')
+            return
+        encode_seconds = time.perf_counter() - encode_started
+        metrics.observe('quran_video_stage_seconds', encode_seconds, stage='encode')
+        if encode_seconds > 0:
+            metrics.observe('quran_video_encode_realtime_factor', audio_info['duration'] / encode_seconds,
+                            buckets=REALTIME_FACTOR_BUCKETS, resolution=resolution_label(config))
+
+    with metrics.time('quran_video_stage_seconds', stage='finalize'):
+        output_paths = {output['resolution']: output['output_path'] for output in outputs}
+        for resolution, _, encode_path in targets:
+            output_video = output_paths[resolution]
+            os.replace(encode_path, output_video)
+            res_config = dict(config, resolution=resolution)
+            output_catalog.add(output_video, job_id, res_config)
+            if resolution in cache_keys:
+                render_cache.store(cache_keys[resolution], Path(output_video))
+
+        job_store.update(
+            job_id,
+            status='completed',
+            progress=100,
+            output_path=outputs[0]['output_path'],
+            download_url=outputs[0]['download_url'],
+            outputs=outputs,
+            finished_at=datetime.now().isoformat()
+        )
+
+    print(f"✅ Vidéos {job_id} générées: {', '.join(o['output_path'] for o in outputs)}")
+
+def render_cache_keys(verse_text, audio_path, background_path, config):
+    """Clés du cache de rendu d'un job multi-format: {résolution: clé}, partagées avec les jobs simples"""
+    return {resolution: render_cache_key(verse_text, audio_path, background_path, dict(config, resolution=resolution))
+            for resolution in config_resolutions(config)}
+
+def process_video_job(job_id, verse_text, audio_url, background_source, config, output_name, cache_key=None):
+    """Traite une vidéo en arrière-plan: téléchargement → sous-titres → encodage"""
+    try:
+        with JobWorkspace(job_id) as workspace:
+            # Étape 1: téléchargements (audio + fond en parallèle)
+            job_store.update(job_id, status='downloading', progress=0)
+            try:
+                with metrics.time('quran_video_stage_seconds', stage='fetch'):
+                    audio_path, background_path = fetch_job_inputs(workspace, audio_url, background_source)
+            except FetchError as e:
+                job_store.update(job_id, status='error', error=str(e))
+                return
+
+            # Cache de rendu (si la clé n'a pas pu être calculée à la soumission)
+            if len(config_resolutions(config)) > 1:
+                cache_key = render_cache_keys(verse_text, audio_path, background_path, config) \
+                    if render_cache.enabled else None
+            elif cache_key is None and render_cache.enabled:
+                cache_key = render_cache_key(verse_text, audio_path, background_path, config)
+                if complete_job_from_cache(job_id, cache_key, output_name, config):
+                    return
+
+            render_job_video(job_id, workspace, [(verse_text, 0.0, None)], audio_path, background_path,
+                             config, output_name, cache_key)
+
+    except Exception as e:
+        job_store.update(job_id, status='error', error=str(e))
+        print(f"❌ Erreur job {job_id}: {e}")
+    finally:
+        record_job_outcome(job_id, config)
+        notify_job_finished(job_id)
+
+# ============================================
+# CORPUS CORANIQUE LOCAL (SQLITE, MULTI-ÉDITIONS)
+# ============================================
+class QuranCorpus:
+    """
+    Textes du Coran indexés par (édition, sourate, ayah) dans SQLite (clé primaire, WITHOUT ROWID)
+    - Lecture d'une ayah ou d'une plage: une requête sur l'index, aucun accès réseau
+    - Éditions importées en entier (CLI "flask import-quran") ou complétées à la demande:
+      une sourate manquante est récupérée UNE fois sur AlQuran Cloud puis gardée en base
+    """
+    TOTAL_AYAHS = 6236
+    API_URL = "https://api.alquran.cloud/v1"
+
+    def __init__(self, path):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ayahs ("
+            " edition TEXT NOT NULL,"
+            " surah INTEGER NOT NULL,"
+            " ayah INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " PRIMARY KEY (edition, surah, ayah)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS surahs ("
+            " edition TEXT NOT NULL,"
+            " surah INTEGER NOT NULL,"
+            " ayah_count INTEGER NOT NULL,"
+            " PRIMARY KEY (edition, surah)) WITHOUT ROWID"
+        )
+        self.remote_fetches = 0
+
+    def _conn(self):
+        # Une connexion par thread (comme le stockage des jobs)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _store_surahs(self, edition, surahs):
+        """surahs: {numéro: [(ayah, texte), ...]} → une seule transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for surah, ayahs in surahs.items():
+                conn.executemany(
+                    "INSERT OR REPLACE INTO ayahs (edition, surah, ayah, text) VALUES (?, ?, ?, ?)",
+                    [(edition, surah, number, text) for number, text in ayahs]
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO surahs (edition, surah, ayah_count) VALUES (?, ?, ?)",
+                    (edition, surah, len(ayahs))
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def ayah_count(self, edition, surah):
+        """Nombre d'ayahs de la sourate si elle est en base, sinon None"""
+        row = self._conn().execute(
+            "SELECT ayah_count FROM surahs WHERE edition = ? AND surah = ?", (edition, surah)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _fetch_surah(self, edition, surah):
+        """Récupère une sourate manquante sur AlQuran Cloud et la garde en base"""
+        url = f"{self.API_URL}/surah/{surah}/{edition}"
+        print(f"📖 Corpus: récupération {url}")
+        response = http_session.get(url, timeout=10)
+        if response.status_code == 404:
+            raise ValueError(f"Sourate {surah} ou édition {edition} introuvable")
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get('code') != 200:
+            raise ValueError('Erreur API AlQuran Cloud (texte)')
+        ayahs = [(a['numberInSurah'], a['text']) for a in payload['data']['ayahs']]
+        self._store_surahs(edition, {surah: ayahs})
+        self.remote_fetches += 1
+
+    def range(self, surah, from_ayah, to_ayah, edition=None):
+        """Textes des ayahs from_ayah..to_ayah d'une sourate"""
+        edition = edition or app.config['QURAN_DEFAULT_EDITION']
+        if not 1 <= surah <= 114:
+            raise ValueError(f"Sourate invalide: {surah}")
+        if self.ayah_count(edition, surah) is None:
+            self._fetch_surah(edition, surah)
+        count = self.ayah_count(edition, surah)
+        if from_ayah < 1 or to_ayah > count:
+            raise ValueError(f"Plage invalide: sourate {surah} ne contient pas les ayahs {from_ayah}-{to_ayah}")
+        rows = self._conn().execute(
+            "SELECT text FROM ayahs WHERE edition = ? AND surah = ? AND ayah BETWEEN ? AND ? ORDER BY ayah",
+            (edition, surah, from_ayah, to_ayah)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, surah, ayah, edition=None):
+        """Texte d'une ayah"""
+        return self.range(surah, ayah, ayah, edition)[0]
+
+    def import_edition(self, edition, source=None):
+        """
+        Importe une édition complète
+        source: None (AlQuran Cloud /quran/{edition}), fichier .json (même format)
+        ou fichier texte Tanzil "sourate|ayah|texte"
+        """
+        surahs = {}
+        if source is None or source.endswith('.json'):
+            if source is None:
+                response = http_session.get(f"{self.API_URL}/quran/{edition}", timeout=120)
+                response.raise_for_status()
+                payload = response.json()
+            else:
+                with open(source, 'r', encoding='utf-8') as f:
+                    payload = json.load(f)
+            for s in payload['data']['surahs']:
+                surahs[s['number']] = [(a['numberInSurah'], a['text']) for a in s['ayahs']]
+        else:
+            with open(source, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if not line or line.startswith('#'):
+                        continue
+                    surah, ayah, text = line.split('|', 2)
+                    surahs.setdefault(int(surah), []).append((int(ayah), text))
+        self._store_surahs(edition, surahs)
+        return sum(len(ayahs) for ayahs in surahs.values())
+
+    def stats(self):
+        rows = self._conn().execute(
+            "SELECT edition, COUNT(*), SUM(ayah_count) FROM surahs GROUP BY edition"
+        ).fetchall()
+        return {
+            'editions': {edition: {'surahs': surahs, 'ayahs': ayahs, 'complete': ayahs == self.TOTAL_AYAHS}
+                         for edition, surahs, ayahs in rows},
+            'remote_fetches': self.remote_fetches
+        }
+
+quran_corpus = QuranCorpus(app.config['QURAN_CORPUS_PATH'])
+
+@app.cli.command('import-quran')
+@click.argument('edition')
+@click.option('--file', 'source', default=None,
+              help="Fichier local (.json AlQuran Cloud ou texte Tanzil sourate|ayah|texte)")
+def import_quran_command(edition, source):
+    """Importe une édition complète dans le corpus local"""
+    count = quran_corpus.import_edition(edition, source)
+    print(f"📚 {edition}: {count} ayahs importées dans {quran_corpus.path}")
+
+# ============================================
+# PLAGES D'AYAHS (UN SEUL ENCODAGE)
+# ============================================
+def ayah_audio_url(reciter, surah, ayah):
+    """URL de l'audio d'une ayah sur le CDN islamic.network"""
+    return f"https://cdn.islamic.network/quran/audio/128/{reciter}/{surah}_{ayah}.mp3"
+
+def fetch_ayah_range_texts(surah, from_ayah, to_ayah, edition=None):
+    """Textes des ayahs from_ayah..to_ayah d'une sourate (corpus local)"""
+    return quran_corpus.range(surah, from_ayah, to_ayah, edition)
+
+def concat_audio_gapless(audio_paths, output_path):
+    """
+    Concatène les audios d'ayahs sans blanc entre eux
+    Le démuxeur concat décode chaque MP3 (délai/padding encodeur retirés) → FLAC sans perte
+    """
+    list_path = Path(output_path).with_suffix('.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in audio_paths:
+            escaped = str(Path(path).resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [
+        "ffmpeg", "-f", "concat", "-safe", "0", "-i", str(list_path),
+        "-vn", "-c:a", "flac",
+        "-y", str(output_path)
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def process_range_job(job_id, ayahs, background_source, config, output_name):
+    """
+    Traite une plage d'ayahs: audios téléchargés en parallèle, concaténés sans blanc,
+    une seule timeline ASS ancrée sur les offsets réels, un seul encodage
+    ayahs: [{'ayah': n, 'text': ..., 'audio_url': ...}, ...]
+    """
+    try:
+        with JobWorkspace(job_id) as workspace:
+            # Étape 1: téléchargements (toutes les ayahs + fond en parallèle)
+            job_store.update(job_id, status='downloading', progress=0)
+            audio_paths = [workspace.small_path(f"ayah_{a['ayah']:03d}.mp3") for a in ayahs]
+            downloads = [fetch_executor.submit(download_file, a['audio_url'], path)
+                         for a, path in zip(ayahs, audio_paths)]
+            background_path = background_source
+            if background_source.startswith('http'):
+                background_path = workspace.path("background.mp4")
+                downloads.append(fetch_executor.submit(download_file, background_source, background_path))
+
+            with metrics.time('quran_video_stage_seconds', stage='fetch'):
+                fetched = all(d.result() for d in downloads)
+            if not fetched:
+                job_store.update(job_id, status='error', error='Erreur téléchargement audio/background')
+                return
+
+            # Cache de rendu: clé sur la liste des audios d'ayahs (avant concaténation)
+            verse_text = "\n".join(a['text'] for a in ayahs)
+            cache_key = None
+            if render_cache.enabled and len(config_resolutions(config)) > 1:
+                cache_key = render_cache_keys(verse_text, audio_paths, background_path, config)
+            elif render_cache.enabled:
+                cache_key = render_cache_key(verse_text, audio_paths, background_path, config)
+                if complete_job_from_cache(job_id, cache_key, output_name, config):
+                    return
+
+            # Offsets réels de chaque ayah dans l'audio concaténé
+            timeline = []
+            offset = 0.0
+            for a, path in zip(ayahs, audio_paths):
+                duration = get_audio_duration(path)
+                if duration <= 0:
+                    job_store.update(job_id, status='error', error=f"Audio illisible (ayah {a['ayah']})")
+                    return
+                timeline.append((a['text'], offset, duration))
+                offset += duration
+
+            audio_path = Path(workspace.path("range.flac"))
+            concat_audio_gapless(audio_paths, audio_path)
+            print(f"🔗 {len(ayahs)} ayahs concaténées ({offset:.1f}s)")
+
+            render_job_video(job_id, workspace, timeline, str(audio_path), background_path,
+                             config, output_name, cache_key)
+
+    except Exception as e:
+        job_store.update(job_id, status='error', error=str(e))
+        print(f"❌ Erreur job {job_id}: {e}")
+    finally:
+        record_job_outcome(job_id, config)
+        notify_job_finished(job_id)
+
+# ============================================
+# CATALOGUE DES VIDÉOS (INDEX DE outputs/)
+# ============================================
+class OutputCatalog:
+    """
+    Index des vidéos de outputs/: taille, mtime, dernier accès, job et config d'origine
+    - Tenu à jour à chaque rendu, téléchargement et suppression: /api/storage, /api/cleanup
+      et le gestionnaire de stockage interrogent l'index au lieu de scanner le dossier
+    - SQLite sur disque partagé (tous les workers voient le même index), ou ":memory:"
+    - Un seul scan du dossier au démarrage (reconcile) pour rattraper les changements hors API
+    """
+    SORT_COLUMNS = {'name': 'name', 'size': 'size', 'age': 'mtime', 'last_access': 'last_access'}
+
+    def __init__(self, folder, path):
+        self.folder = Path(folder)
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shared = None
+        if path == ':memory:':
+            self._shared = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        else:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            conn = self._conn()
+            if self._shared is None:
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outputs ("
+                " name TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime REAL NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " job_id TEXT,"
+                " config TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outputs_last_access ON outputs(last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outputs_mtime ON outputs(mtime)")
+
+    def _conn(self):
+        if self._shared is not None:
+            return self._shared
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def add(self, path, job_id=None, config=None):
+        """Enregistre (ou met à jour) une vidéo publiée dans outputs/"""
+        path = Path(path)
+        try:
+            st = path.stat()
+        except OSError:
+            return
+        with self._lock:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO outputs (name, size, mtime, last_access, job_id, config)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (path.name, st.st_size, st.st_mtime, max(st.st_atime, st.st_mtime), job_id,
+                 json.dumps(config, ensure_ascii=False) if config is not None else None)
+            )
+
+    def touch(self, name, when=None):
+        with self._lock:
+            self._conn().execute("UPDATE outputs SET last_access = ? WHERE name = ?",
+                                 (when or time.time(), name))
+
+    def remove(self, name):
+        with self._lock:
+            self._conn().execute("DELETE FROM outputs WHERE name = ?", (name,))
+
+    def get(self, name):
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT name, size, mtime, last_access, job_id, config FROM outputs WHERE name = ?", (name,)
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    @staticmethod
+    def _entry(row):
+        name, size, mtime, last_access, job_id, config = row
+        return {'name': name, 'size': size, 'mtime': mtime, 'last_access': last_access,
+                'job_id': job_id, 'config': json.loads(config) if config else None}
+
+    def totals(self):
+        with self._lock:
+            count, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outputs").fetchone()
+        return count, size
+
+    def page(self, sort='age', order='desc', limit=100, offset=0):
+        """Page de l'index triée (age = date de création)"""
+        column = self.SORT_COLUMNS.get(sort, 'mtime')
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        with self._lock:
+            rows = self._conn().execute(
+                f"SELECT name, size, mtime, last_access, job_id, config FROM outputs"
+                f" ORDER BY {column} {direction} LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def least_recently_used(self):
+        """Toutes les vidéos, les moins récemment utilisées d'abord: [(nom, taille, dernier accès)]"""
+        with self._lock:
+            return self._conn().execute(
+                "SELECT name, size, last_access FROM outputs ORDER BY last_access ASC"
+            ).fetchall()
+
+    def older_than(self, cutoff):
+        """Noms des vidéos créées avant cutoff (timestamp)"""
+        with self._lock:
+            return [row[0] for row in self._conn().execute(
+                "SELECT name FROM outputs WHERE mtime < ?", (cutoff,)).fetchall()]
+
+    def names(self):
+        with self._lock:
+            return [row[0] for row in self._conn().execute("SELECT name FROM outputs").fetchall()]
+
+    def reconcile(self):
+        """Aligne l'index sur le dossier (un seul scan, au démarrage)"""
+        on_disk = {}
+        for path in self.folder.glob('*.mp4'):
+            try:
+                on_disk[path.name] = path.stat()
+            except OSError:
+                continue
+        with self._lock:
+            conn = self._conn()
+            known = {name: (size, mtime) for name, size, mtime in
+                     conn.execute("SELECT name, size, mtime FROM outputs").fetchall()}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name in known.keys() - on_disk.keys():
+                    conn.execute("DELETE FROM outputs WHERE name = ?", (name,))
+                for name, st in on_disk.items():
+                    if known.get(name) != (st.st_size, st.st_mtime):
+                        conn.execute(
+                            "INSERT OR REPLACE INTO outputs (name, size, mtime, last_access, job_id, config)"
+                            " VALUES (?, ?, ?, ?, NULL, NULL)",
+                            (name, st.st_size, st.st_mtime, max(st.st_atime, st.st_mtime))
+                        )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+def delete_output(name):
+    """
+    Supprime une vidéo de outputs/ et de l'index
+    Retourne les octets réellement libérés sur le disque: 0 si le fichier reste lié ailleurs
+    (hard link du cache de rendu), None si la vidéo était absente
+    """
+    path = Path(app.config['OUTPUT_FOLDER']) / name
+    try:
+        st = path.stat()
+        path.unlink()
+    except FileNotFoundError:
+        output_catalog.remove(name)
+        return None
+    output_catalog.remove(name)
+    return st.st_size if st.st_nlink == 1 else 0
+
+output_catalog = OutputCatalog(app.config['OUTPUT_FOLDER'], app.config['OUTPUT_CATALOG_PATH'])
+output_catalog.reconcile()
+
+# ============================================
+# GESTION DU STOCKAGE DES VIDÉOS (QUOTA, ÂGE, ESPACE LIBRE)
+# ============================================
+class StorageManager:
+    """
+    Garde outputs/ sous un quota et un âge max, en tâche de fond
+    - Éviction des vidéos les moins récemment téléchargées d'abord (catalogue des vidéos)
+    - Admission: un job n'est accepté que si l'espace libre couvre sa taille estimée
+      (sinon une éviction est tentée avant de refuser): plus d'encodage coupé par un disque plein
+    - Un seul balayage à la fois par hôte (verrou fcntl partagé entre workers)
+    """
+    def __init__(self, folder, max_bytes, max_age, min_free_bytes, interval):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self.reclaimed_bytes = 0
+        self.evicted_files = 0
+        self._lock_path = Path(app.config['DATA_FOLDER']) / 'storage.lock'
+        self._thread = None
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.folder).free
+
+    def _frees_space(self, name):
+        """Vrai si supprimer la vidéo libère le disque (pas d'autre lien, ex. cache de rendu)"""
+        try:
+            return (self.folder / name).stat().st_nlink == 1
+        except OSError:
+            return False
+
+    def _remove(self, name, size, reason):
+        """Supprime une vidéo, retourne les octets libérés sur le disque (None si rien supprimé)"""
+        try:
+            freed = delete_output(name)
+        except OSError:
+            return None
+        if freed is None:
+            return None
+        self.reclaimed_bytes += freed
+        self.evicted_files += 1
+        metrics.inc('quran_video_storage_reclaimed_bytes_total', freed, reason=reason)
+        metrics.inc('quran_video_storage_evicted_files_total', reason=reason)
+        print(f"🧹 Stockage ({reason}): {name} supprimé ({size / 2**20:.1f} Mo, {freed / 2**20:.1f} Mo libérés)")
+        return freed
+
+    def sweep(self, need_bytes=0):
+        """
+        Applique âge max et quota, puis libère need_bytes d'espace disque si demandé
+        Retourne les octets récupérés
+        """
+        self._lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._lock_path, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # Un autre worker balaie déjà
+
+            reclaimed = 0
+            now = time.time()
+            # Moins récemment téléchargées d'abord (depuis l'index, sans scanner le dossier)
+            kept = []
+            for name, size, last_access in output_catalog.least_recently_used():
+                if self.max_age and now - last_access > self.max_age:
+                    reclaimed += self._remove(name, size, 'age') or 0
+                else:
+                    kept.append((name, size))
+
+            # Quota: taille de outputs/ (liens compris); espace: seules les vidéos sans autre lien
+            # libèrent le disque, n'évincer que si elles suffisent à accueillir le job
+            total = sum(size for _, size in kept)
+            free = self.free_bytes()
+            frees_space = {name: self._frees_space(name) for name, _ in kept} if need_bytes else {}
+            space_reachable = free + sum(size for name, size in kept if frees_space.get(name)) >= need_bytes
+            for name, size in kept:
+                over_quota = self.max_bytes and total > self.max_bytes
+                short_of_space = need_bytes and space_reachable and free < need_bytes
+                if not (over_quota or short_of_space):
+                    break
+                if not over_quota and not frees_space.get(name):
+                    continue  # Supprimer cette vidéo ne libérerait rien
+                freed = self._remove(name, size, 'quota' if over_quota else 'space')
+                if freed is None:
+                    continue
+                total -= size
+                free += freed
+                reclaimed += freed
+            return reclaimed
+
+    def has_room(self, estimated_bytes=0):
+        """Vrai si l'espace libre couvre le job (+ la réserve), éviction tentée sinon"""
+        need = self.min_free_bytes + (estimated_bytes or 0)
+        if self.free_bytes() >= need:
+            return True
+        self.sweep(need_bytes=need)
+        return self.free_bytes() >= need
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Balayage du stockage: {e}")
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='storage-manager')
+            self._thread.start()
+
+    def stats(self):
+        return {
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'min_free_bytes': self.min_free_bytes,
+            'free_bytes': self.free_bytes(),
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'evicted_files': self.evicted_files
+        }
+
+storage_manager = StorageManager(
+    app.config['OUTPUT_FOLDER'],
+    app.config['OUTPUT_MAX_BYTES'],
+    app.config['OUTPUT_MAX_AGE'],
+    app.config['MIN_FREE_BYTES'],
+    app.config['STORAGE_SWEEP_INTERVAL']
+)
+storage_manager.start()
+
+BITRATE_UNITS = {'': 1, 'k': 1e3, 'm': 1e6, 'g': 1e9}
+
+def bitrate_kbps(value, default=DEFAULT_CONFIG['audio_bitrate']):
+    """
+    Débit au format ffmpeg en kbit/s: "192k", "192K", "1M", "1.5M", 128000 (bit/s sans suffixe)
+    Valeur illisible: débit par défaut
+    """
+    for candidate in (value, default):
+        match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)\s*', str(candidate))
+        if match:
+            return float(match.group(1)) * BITRATE_UNITS[match.group(2).lower()] / 1000
+    return 0.0
+
+def estimate_output_bytes(config, audio_duration):
+    """Taille max des vidéos d'un job: débit max (VBV) de chaque résolution + audio, +10% de marge"""
+    if not audio_duration:
+        return 0
+    audio_k = bitrate_kbps(config.get('audio_bitrate', DEFAULT_CONFIG['audio_bitrate']))
+    total_k = 0
+    for resolution in config_resolutions(config):
+        maxrate, _ = EncodeScheduler.rate_control(resolution)
+        total_k += bitrate_kbps(maxrate) + audio_k
+    return int(total_k * 1000 / 8 * audio_duration * 1.1)
+
+def insufficient_storage_response():
+    """Réponse 507 quand le disque ne peut pas accueillir le rendu"""
+    response = jsonify({
+        'error': 'Espace disque insuffisant pour ce rendu, réessayez plus tard',
+        'retry_after': storage_manager.interval or 60
+    })
+    response.headers['Retry-After'] = str(storage_manager.interval or 60)
+    return response, 507
+
+# ============================================
+# SOUMISSION DES JOBS
+# ============================================
+def request_dedupe_key(idempotency_key, **inputs):
+    """
+    Clé de déduplication d'une demande de rendu
+    - Clé d'idempotence fournie par le client (en-tête Idempotency-Key ou champ idempotency_key)
+    - Sinon empreinte des entrées normalisées: une requête identique à un job en cours s'y rattache
+    """
+    if idempotency_key:
+        return f"idem:{str(idempotency_key)[:200]}"
+    if 'verse_text' in inputs:
+        inputs['verse_text'] = normalize_verse_text(inputs['verse_text'])
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return f"req:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+def attached_job_response(job, dedupe_key, callback_url=None):
+    """
+    Réponse d'une requête rattachée à un job existant (aucun nouveau rendu)
+    Son callback_url est ajouté à ceux du job, ou notifié tout de suite si le job est terminé
+    """
+    reason = 'idempotency' if dedupe_key.startswith('idem:') else 'inflight'
+    metrics.inc('quran_video_jobs_deduplicated_total', reason=reason)
+    print(f"🔁 Requête rattachée au job {job['id']} ({reason})")
+    if callback_url and callback_url not in job_callback_urls(job):
+        if not job_store.add_callback(job['id'], callback_url):
+            job = job_store.get(job['id']) or job
+            if job['status'] in FINISHED_STATUSES:
+                webhooks.submit(callback_url, public_job(job))
+    response = {
+        'success': job['status'] != 'error',
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/api/status/{job['id']}",
+        'stream_url': f"/api/stream/{job['id']}",
+        'download_url': job.get('download_url'),
+        'deduplicated': True
+    }
+    if job['status'] == 'error':
+        response['error'] = job.get('error')
+    return jsonify(response), 200 if job['status'] in FINISHED_STATUSES else 202
+
+def submit_render_job(verse_text, audio_url, background_input, config, output_name=None, callback_url=None,
+                      idempotency_key=None):
+    """
+    Crée un job et le place dans la file de rendu, sans aucun téléchargement
+    Le téléchargement se fait dans le pipeline du job (status "downloading")
+    callback_url: reçoit le job final en POST (terminé ou en erreur)
+    Une requête identique à un job en cours (ou de même clé d'idempotence) reçoit ce job
+    Retourne la réponse HTTP (202, 200 si cache, 429 si file pleine, 404/500 si fond invalide)
+    """
+    try:
+        normalize_resolutions(config)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Single-flight: avant l'admission control, un retry ne doit pas recevoir de 429
+    dedupe_key = request_dedupe_key(idempotency_key, verse_text=verse_text, audio_url=audio_url,
+                                    background=background_input, config=config, output_name=output_name)
+    existing = job_store.find_duplicate(dedupe_key)
+    if existing:
+        return attached_job_response(existing, dedupe_key, callback_url)
+
+    # Admission control
+    if render_pool.is_full():
+        return queue_full_response(render_pool.retry_after())
+
+    background_source, error = resolve_background(background_input)
+    if error:
+        return error
+
+    job_id = str(uuid.uuid4())[:8]
+    output_name = sanitize_filename(output_name or job_id)
+
+    # Cache de rendu dès la soumission si les entrées sont déjà en local
+    cache_key = None
+    audio_duration = None
+    local_inputs = peek_cached_inputs(audio_url, background_source)
+    if local_inputs:
+        audio_duration = get_audio_duration(local_inputs[0])
+        # Multi-format: cache consulté par résolution dans le job
+        if render_cache.enabled and len(config_resolutions(config)) == 1:
+            cache_key = render_cache_key(verse_text, local_inputs[0], local_inputs[1], config)
+            cached_path = render_cache.lookup(cache_key)
+            if cached_path:
+                response = complete_from_cache(job_id, cached_path, verse_text, output_name, config,
+                                               callback_url, dedupe_key)
+                if response:
+                    return response
 
-[Events]
-Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
-"""
-    
-    events = []
-    t = 0.0
-    for seg, w in zip(segments, weights):
-        segdur = usable * (w / total)
-        start = t
-        end = min(t + segdur, usable)
-        if end - start < 0.35:
-            end = min(start + 0.35, usable)
-        events.append((start, end, seg))
-        t = end
-    
-    if events:
-        start_last = events[-1][0]
-        events[-1] = (start_last, usable, events[-1][2])
-    
-    lines = []
-    for start, end, seg in events:
-        lines.append(f"Dialogue: 0,{ass_time(start)},{ass_time(end)},Verse,,0,0,0,,{seg}")
-    
-    with open(output_ass, 'w', encoding='utf-8') as f:
-        f.write(header + "\n".join(lines) + "\n")
-    
-    return True
+    # Espace disque: ne pas démarrer un encodage qui ne pourra pas finir
+    if not storage_manager.has_room(estimate_output_bytes(config, audio_duration)):
+        return insufficient_storage_response()
 
-def generate_video(background_video, audio_file, ass_file, output_video, config):
-    """Génère la vidéo finale avec ffmpeg avec support multi-résolution et loop automatique"""
-    
-    # Obtenir les durées
-    audio_duration = get_audio_duration(audio_file)
-    video_duration = get_audio_duration(background_video)  # Fonctionne aussi pour vidéo
-    
-    print(f"⏱️  Audio: {audio_duration:.1f}s | Background: {video_duration:.1f}s")
-    
-    # Définir les résolutions
-    resolution = config.get('resolution', '1080p')
-    
-    resolutions = {
-        '1080p': {'width': 1920, 'height': 1080, 'name': '1080p (16:9 YouTube)'},
-        '720p': {'width': 1280, 'height': 720, 'name': '720p (16:9 Standard)'},
-        'vertical': {'width': 1080, 'height': 1920, 'name': 'Vertical Full HD (9:16 TikTok/Reels/Shorts)'},
-        'square': {'width': 1080, 'height': 1080, 'name': 'Carré Full HD (1:1 Instagram)'},
-        '4k': {'width': 3840, 'height': 2160, 'name': '4K (16:9 Ultra HD)'}
+    return enqueue_job(job_id, verse_text, process_video_job,
+                       (verse_text, audio_url, background_source, config, output_name, cache_key),
+                       throughput.estimate(config, audio_duration),
+                       extra=dict({'dedupe_key': dedupe_key}, **({'callback_url': callback_url} if callback_url else {})))
+
+def enqueue_job(job_id, verse_text, target, args, estimated_time, extra=None):
+    """Crée l'enregistrement du job et le place dans la file du pool de rendu"""
+    job = {
+        'id': job_id,
+        'status': 'queued',
+        'progress': 0,
+        'verse_text': verse_text[:50] + '...' if len(verse_text) > 50 else verse_text,
+        'started_at': datetime.now().isoformat(),
+        'finished_at': None,
+        'output_path': None,
+        'download_url': None,
+        'error': None
     }
-    
-    if resolution not in resolutions:
-        resolution = '1080p'
-    
-    res = resolutions[resolution]
-    width = res['width']
-    height = res['height']
-    
-    print(f"📐 Résolution: {res['name']} ({width}x{height})")
-    
-    # Construire le filtre vidéo avec scaling ET loop si nécessaire
-    if video_duration < audio_duration:
-        # Background plus court → LOOP
-        loops_needed = int(audio_duration / video_duration) + 1
-        print(f"🔄 Background loop activé: {loops_needed} répétitions")
-        
-        video_filter = f"[0:v]loop={loops_needed}:size=1:start=0,scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,ass={ass_file}:fontsdir=[v]"
-        
-        cmd = [
-            "ffmpeg", "-stream_loop", str(loops_needed), "-i", background_video, "-i", audio_file,
-            "-filter_complex", f"[1:a]apad=pad_dur=1[a];{video_filter}",
-            "-map", "[v]", "-map", "[a]",
-            "-t", str(audio_duration),  # Durée = audio
-            "-c:v", "libx264", 
-            "-crf", str(config['crf']),
-            "-preset", config['preset'],
-            "-c:a", "aac", 
-            "-b:a", config['audio_bitrate'],
-            "-y", output_video
-        ]
-    else:
-        # Background plus long ou égal → Normal
-        print(f"✅ Background suffisamment long")
-        
-        video_filter = f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,ass={ass_file}:fontsdir=."
-        
-        cmd = [
-            "ffmpeg", "-i", background_video, "-i", audio_file,
-            "-filter_complex", "[1:a]apad=pad_dur=1[a]",
-            "-vf", video_filter,
-            "-map", "0:v", "-map", "[a]",
-            "-t", str(audio_duration),  # Durée = audio
-            "-c:v", "libx264", 
-            "-crf", str(config['crf']),
-            "-preset", config['preset'],
-            "-c:a", "aac", 
-            "-b:a", config['audio_bitrate'],
-            "-y", output_video
-        ]
-    
-    try:
-        # Optimisations FFmpeg pour Full HD sur Railway
-        # Pour 1080x1920: Besoin de plus de buffer mais moins de threads
-        memory_opts = [
-            "-max_muxing_queue_size", "1024",  # Plus de buffer pour Full HD
-            "-bufsize", "3M",                   # Buffer plus grand pour HD
-            "-maxrate", "4M",                   # Bitrate adapté au Full HD
-            "-threads", "2",                    # 2 threads pour meilleure performance
-            "-movflags", "+faststart"           # Streaming optimisé
-        ]
-        
-        subprocess.run(cmd + memory_opts, 
-                      check=True, 
-                      stderr=subprocess.DEVNULL, 
-                      stdout=subprocess.DEVNULL)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Erreur ffmpeg: {e}")
-        return False
+    job.update(extra or {})
+    existing = job_store.create(job)
+    if existing:
+        # Requête identique arrivée entre-temps par un autre thread / worker
+        return attached_job_response(existing, job['dedupe_key'], job.get('callback_url'))
 
-def process_video_job(job_id, verse_text, audio_path, background_path, config, output_name):
-    """Traite une vidéo en arrière-plan"""
-    job = jobs[job_id]
-    
     try:
-        # Mise à jour: génération ASS
-        job['status'] = 'generating_subtitles'
-        job['progress'] = 30
-        
-        ass_path = Path(app.config['TEMP_FOLDER']) / f"{job_id}.ass"
-        if not generate_ass(verse_text, audio_path, str(ass_path), config):
-            job['status'] = 'error'
-            job['error'] = 'Erreur génération des sous-titres'
-            return
-        
-        # Mise à jour: génération vidéo
-        job['status'] = 'generating_video'
-        job['progress'] = 60
-        
-        output_path = Path(app.config['OUTPUT_FOLDER']) / f"{output_name}.mp4"
-        if not generate_video(background_path, audio_path, str(ass_path), str(output_path), config):
-            job['status'] = 'error'
-            job['error'] = 'Erreur génération de la vidéo'
-            return
-        
-        # Terminé
-        job['status'] = 'completed'
-        job['progress'] = 100
-        job['output_path'] = str(output_path)
-        job['download_url'] = f"/api/download/{output_name}.mp4"
-        job['finished_at'] = datetime.now().isoformat()
-        
-        print(f"✅ Vidéo {job_id} générée: {output_path}")
-        
-    except Exception as e:
-        job['status'] = 'error'
-        job['error'] = str(e)
-        print(f"❌ Erreur job {job_id}: {e}")
+        position = render_pool.submit(job_id, target, *args)
+    except QueueFullError as e:
+        job_store.delete(job_id)
+        return queue_full_response(e.retry_after)
+
+    print(f"🚀 Job {job_id} en file (position {position})")
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'processing',
+        'status_url': f"/api/status/{job_id}",
+        'stream_url': f"/api/stream/{job_id}",
+        'queue_position': position,
+        'estimated_time': estimated_time
+    }), 202
 
 @app.route('/api/generate', methods=['POST'])
 def api_generate():
@@ -627,6 +4257,8 @@ def api_generate():
         "audio_url": "https://cdn.islamic.network/quran/audio/128/ar.alafasy/1.mp3",
         "background": "default",  // ou URL
         "output_name": "al_fatiha_1",  // optionnel
+        "callback_url": "https://n8n.example.com/webhook/quran",  // optionnel, reçoit le job final en POST
+        "idempotency_key": "workflow-42-item-7",  // optionnel (ou en-tête Idempotency-Key)
         "config": {  // optionnel
             "quality": "fast",
             "font_size": 72,
@@ -640,7 +4272,7 @@ def api_generate():
         "job_id": "abc123",
         "status": "processing",
         "status_url": "/api/status/abc123",
-        "estimated_time": 120  // secondes
+        "estimated_time": 45  // secondes, d'après le débit mesuré (résolution + preset)
     }
     """
     try:
@@ -657,11 +4289,10 @@ def api_generate():
             return jsonify({'error': 'verse_text requis'}), 400
         if not audio_url:
             return jsonify({'error': 'audio_url requis'}), 400
-        
-        # Générer un job ID
-        job_id = str(uuid.uuid4())[:8]
-        job_folder = Path(app.config['UPLOAD_FOLDER']) / job_id
-        job_folder.mkdir(exist_ok=True)
+        try:
+            callback_url = validate_callback_url(data.get('callback_url'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Configuration
         config = DEFAULT_CONFIG.copy()
@@ -678,20 +4309,8 @@ def api_generate():
         config.update(custom_config)
         
         # Gérer les presets de qualité
-        if 'quality' in custom_config:
-            quality = custom_config['quality']
-            if quality == 'draft':
-                config['crf'] = 28
-                config['preset'] = 'ultrafast'
-            elif quality == 'fast':
-                config['crf'] = 23
-                config['preset'] = 'fast'
-            elif quality == 'standard':
-                config['crf'] = 21
-                config['preset'] = 'medium'
-            elif quality == 'hq':
-                config['crf'] = 18
-                config['preset'] = 'slow'
+        if custom_config.get('quality') in QUALITY_PRESETS:
+            config.update(QUALITY_PRESETS[custom_config['quality']])
         
         # S'assurer que font_size et words_per_segment sont des entiers
         if 'font_size' in config:
@@ -704,86 +4323,10 @@ def api_generate():
         print(f"   - reciter_name: {config.get('reciter_name')}")
         print(f"   - show_reciter: {config.get('show_reciter')}")
         
-        # Télécharger l'audio
-        print(f"📥 Téléchargement audio: {audio_url}")
-        audio_path = job_folder / "audio.mp3"
-        if not download_file(audio_url, str(audio_path)):
-            return jsonify({'error': 'Erreur téléchargement audio'}), 500
-        
-        # Gérer le background
-        background_input = data.get('background', 'default')
-        
-        if background_input == 'default':
-            # Utiliser le fond par défaut
-            default_bg = Path(app.config['BACKGROUNDS_FOLDER']) / "default.mp4"
-            if not default_bg.exists():
-                return jsonify({'error': 'Fond par défaut introuvable. Placez un fichier default.mp4 dans backgrounds/'}), 500
-            background_path = str(default_bg)
-        elif background_input.startswith('http'):
-            # Télécharger depuis URL
-            print(f"📥 Téléchargement background: {background_input}")
-            background_path = job_folder / "background.mp4"
-            if not download_file(background_input, str(background_path)):
-                return jsonify({'error': 'Erreur téléchargement background'}), 500
-            background_path = str(background_path)
-        else:
-            # Fichier local dans backgrounds/
-            local_bg = Path(app.config['BACKGROUNDS_FOLDER']) / background_input
-            
-            # 🎲 Si c'est un dossier, choisir une vidéo aléatoire dedans
-            if local_bg.is_dir():
-                # Chercher tous les fichiers vidéo dans le dossier
-                video_files = list(local_bg.glob('*.mp4')) + list(local_bg.glob('*.mov')) + \
-                             list(local_bg.glob('*.avi')) + list(local_bg.glob('*.mkv'))
-                
-                if not video_files:
-                    return jsonify({'error': f'Aucune vidéo trouvée dans le dossier {background_input}'}), 404
-                
-                # Choisir aléatoirement
-                background_path = str(random.choice(video_files))
-                print(f"🎲 Vidéo choisie aléatoirement: {Path(background_path).name}")
-            
-            # Si c'est un fichier direct
-            elif local_bg.exists():
-                background_path = str(local_bg)
-            
-            # Ni fichier ni dossier trouvé
-            else:
-                return jsonify({'error': f'Fond {background_input} introuvable dans backgrounds/ (ni fichier ni dossier)'}), 404
-        
-        # Nom de sortie
-        output_name = sanitize_filename(data.get('output_name', job_id))
-        
-        # Créer le job
-        jobs[job_id] = {
-            'id': job_id,
-            'status': 'downloading',
-            'progress': 0,
-            'verse_text': verse_text[:50] + '...' if len(verse_text) > 50 else verse_text,
-            'started_at': datetime.now().isoformat(),
-            'finished_at': None,
-            'output_path': None,
-            'download_url': None,
-            'error': None
-        }
-        
-        # Lancer le traitement en arrière-plan
-        thread = threading.Thread(
-            target=process_video_job,
-            args=(job_id, verse_text, str(audio_path), background_path, config, output_name)
-        )
-        thread.daemon = True
-        thread.start()
-        
-        print(f"🚀 Job {job_id} démarré")
-        
-        return jsonify({
-            'success': True,
-            'job_id': job_id,
-            'status': 'processing',
-            'status_url': f"/api/status/{job_id}",
-            'estimated_time': 120  # 2 minutes en mode fast
-        }), 202
+        # Téléchargements et rendu en arrière-plan: la réponse est immédiate
+        return submit_render_job(verse_text, audio_url, data.get('background', 'default'),
+                                 config, data.get('output_name'), callback_url,
+                                 request.headers.get('Idempotency-Key') or data.get('idempotency_key'))
     
     except Exception as e:
         print(f"❌ Erreur API: {e}")
@@ -791,25 +4334,164 @@ def api_generate():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def job_status_payload(job):
+    """Job tel que renvoyé par /api/status (position dans la file, jeton d'état, sans champs internes)"""
+    job = public_job(job)
+    if job['status'] == 'queued':
+        # Position exacte si le job attend dans ce worker, sinon estimation globale
+        job['queue_position'] = render_pool.position(job['id']) or job_store.queue_position(job['id'])
+    else:
+        job['queue_position'] = None
+    job['state'] = job_state(job)
+    return job
+
+def job_state(job):
+    """Jeton qui change à chaque étape / avancement visible du job"""
+    return f"{job['status']}:{job.get('progress')}"
+
+def wait_for_job_change(job_id, state, timeout):
+    """Attend que le job quitte l'état donné (ou se termine), au plus timeout secondes"""
+    deadline = time.time() + timeout
+    while True:
+        job = job_store.get(job_id)
+        if job is None or job['status'] in FINISHED_STATUSES or job_state(job) != state:
+            return job
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return job
+        job_events.wait(remaining)
+
+def job_event_stream(job_id, keepalive=15.0):
+    """Flux SSE: un événement "status" par changement, "done" à la fin"""
+    yield "retry: 2000\n\n"
+    state = None
+    last_sent = time.time()
+    while True:
+        job = wait_for_job_change(job_id, state, keepalive) if state else job_store.get(job_id)
+        if job is None:
+            yield "event: error\ndata: {\"error\": \"Job introuvable\"}\n\n"
+            return
+        if job_state(job) != state:
+            state = job_state(job)
+            payload = json.dumps(job_status_payload(job), ensure_ascii=False)
+            last_sent = time.time()
+            if job['status'] in FINISHED_STATUSES:
+                yield f"event: done\ndata: {payload}\n\n"
+                return
+            yield f"event: status\ndata: {payload}\n\n"
+        elif time.time() - last_sent >= keepalive:
+            last_sent = time.time()
+            yield ": keepalive\n\n"
+
+def too_many_waiters_response(message):
+    """503 + Retry-After: plus de slot d'attente (long-poll, SSE, /api/stream) dans ce worker"""
+    response = jsonify({'error': message})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
 @app.route('/api/status/<job_id>', methods=['GET'])
 def api_status(job_id):
     """
     Vérifie le statut d'un job
     
+    Query (optionnel):
+    - wait=30: long-poll, répond dès que le statut ou la progression change (ou après 30s)
+      state=<jeton d'une réponse précédente>: attend un changement depuis cet état
+    - stream=1 (ou Accept: text/event-stream): flux SSE d'événements "status" puis "done"
+    
     Response:
     {
         "job_id": "abc123",
-        "status": "completed",  // downloading, generating_subtitles, generating_video, completed, error
+        "status": "completed",  // queued, downloading, generating_subtitles, generating_video, completed, error
         "progress": 100,
+        "queue_position": null,  // position dans la file si status == queued
+        "encode": {"percent": 42.0, "speed": 1.8, "fps": 54, "eta_seconds": 12},  // pendant generating_video
+        "encoder_allocation": {"threads": 4, "maxrate": "4000k", "bufsize": "8000k", ...},  // ordonnanceur CPU
         "download_url": "/api/download/abc123.mp4",
         "started_at": "2024-01-09T10:30:00",
-        "finished_at": "2024-01-09T10:32:15"
+        "finished_at": "2024-01-09T10:32:15",
+        "state": "completed:100"  // à repasser en ?state= pour le long-poll suivant
     }
     """
-    if job_id not in jobs:
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({'error': 'Job introuvable'}), 404
     
-    return jsonify(jobs[job_id])
+    # Flux SSE
+    if request.args.get('stream') == '1' or request.accept_mimetypes.best == 'text/event-stream':
+        if not job_events.acquire():
+            return too_many_waiters_response("Trop de clients en attente, utiliser ?wait= ou réessayer")
+        response = Response(job_event_stream(job_id), mimetype='text/event-stream')
+        # Slot rendu à la fermeture de la réponse, même si le flux n'a jamais démarré (HEAD, client parti)
+        response.call_on_close(job_events.release)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    
+    # Long-poll: sans slot libre, réponse immédiate (le client repassera)
+    try:
+        wait = min(float(request.args.get('wait', 0)), app.config['STATUS_MAX_WAIT'])
+    except ValueError:
+        return jsonify({'error': 'wait doit être un nombre de secondes'}), 400
+    if wait > 0 and job['status'] not in FINISHED_STATUSES:
+        state = request.args.get('state') or job_state(job)
+        if job_events.acquire():
+            try:
+                job = wait_for_job_change(job_id, state, wait)
+            finally:
+                job_events.release()
+            if job is None:
+                return jsonify({'error': 'Job introuvable'}), 404
+    
+    return jsonify(job_status_payload(job))
+
+def job_list_query():
+    """Filtres communs de /api/jobs: status, since/until (ISO 8601), limit, offset"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        raise ValueError('limit et offset doivent être des nombres')
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.args.get(name)
+        try:
+            bounds[name] = datetime.fromisoformat(value).timestamp() if value else None
+        except ValueError:
+            raise ValueError(f"{name} doit être une date ISO 8601 (ex: 2024-01-09T10:30:00)")
+    return {'status': request.args.get('status') or None, 'limit': limit, 'offset': offset, **bounds}
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    """
+    Liste des jobs encore conservés, plus récents d'abord (sans copier toute la table)
+    Query: ?status=completed&since=2024-01-09T00:00:00&until=2024-01-10T00:00:00&limit=100&offset=0
+    since/until filtrent sur started_at
+    """
+    try:
+        query = job_list_query()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'jobs': job_store.list(**query),
+        'total_jobs': job_store.count(query['status'], query['since'], query['until']),
+        'pagination': {'limit': query['limit'], 'offset': query['offset']}
+    })
+
+@app.route('/api/jobs/history', methods=['GET'])
+def api_jobs_history():
+    """
+    Résumés des derniers jobs terminés (JOB_HISTORY_SIZE), y compris ceux déjà expirés
+    Mêmes filtres que /api/jobs
+    """
+    try:
+        query = job_list_query()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'jobs': job_store.history(**query),
+        'pagination': {'limit': query['limit'], 'offset': query['offset']}
+    })
 
 @app.route('/api/download/<filename>', methods=['GET'])
 def api_download(filename):
@@ -828,20 +4510,81 @@ def api_download(filename):
         download_name=filename,
         mimetype='video/mp4'
     )
+    metrics.inc('quran_video_bytes_served_total', response.content_length or 0)
+    output_catalog.touch(filename)  # LRU: dernière utilisation
     
     # Supprimer après envoi si demandé
     if auto_delete:
+        # Sans direct_passthrough: Werkzeug renvoie le fichier tel quel et n'appelle jamais
+        # les callbacks de fermeture (la vidéo n'était jamais supprimée)
+        response.direct_passthrough = False
         @response.call_on_close
         def delete_file():
             try:
-                if file_path.exists():
-                    file_path.unlink()
+                if delete_output(filename) is not None:
                     print(f"🗑️  Fichier supprimé: {filename}")
             except Exception as e:
                 print(f"❌ Erreur suppression {filename}: {e}")
     
     return response
 
+def follow_job_output(job_id, chunk_size=256 * 1024, poll_interval=0.25):
+    """
+    Lit la vidéo d'un job au fur et à mesure qu'elle est écrite (MP4 fragmenté)
+    Le fichier .part reste lisible après son renommage (même inode)
+    Sans streaming (ou rendu déjà terminé): envoie le fichier final une fois prêt
+    """
+    f = None
+    try:
+        while True:
+            job = job_store.get(job_id)
+            if job is None:
+                return
+            finished = job['status'] in ('completed', 'error')
+            if f is None:
+                path = job.get('stream_path') if not finished else job.get('output_path')
+                if path and os.path.exists(path):
+                    f = open(path, 'rb')
+                elif finished:
+                    return
+                else:
+                    time.sleep(poll_interval)
+                    continue
+            data = f.read(chunk_size)
+            if data:
+                metrics.inc('quran_video_bytes_served_total', len(data))
+                yield data
+            elif finished:
+                return
+            else:
+                time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
+
+@app.route('/api/stream/<job_id>', methods=['GET'])
+def api_stream(job_id):
+    """
+    Télécharge la vidéo PENDANT l'encodage (transfert chunked)
+    Jobs créés avec config.streaming = true: MP4 fragmenté, lisible dès les premiers fragments
+    Autres jobs: la réponse démarre quand la vidéo est terminée
+    La réponse occupe un thread gthread jusqu'à la fin de l'encodage: elle prend un slot
+    d'attente (STATUS_MAX_WAITERS, partagés avec long-poll et SSE), 503 s'il n'y en a plus
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job introuvable'}), 404
+    if job['status'] == 'error':
+        return jsonify({'error': job.get('error') or 'Job en erreur'}), 409
+    if not job_events.acquire():
+        return too_many_waiters_response("Trop de flux en cours, télécharger via /api/download une fois terminé")
+
+    response = Response(follow_job_output(job_id), mimetype='video/mp4')
+    response.call_on_close(job_events.release)
+    response.headers['Content-Disposition'] = f'attachment; filename="{job_id}.mp4"'
+    response.headers['X-Accel-Buffering'] = 'no'  # Pas de buffering par un proxy nginx
+    return response
+
 @app.route('/api/delete/<filename>', methods=['DELETE'])
 def api_delete_file(filename):
     """Supprime un fichier spécifique"""
@@ -851,7 +4594,7 @@ def api_delete_file(filename):
         return jsonify({'error': 'Fichier introuvable'}), 404
     
     try:
-        file_path.unlink()
+        delete_output(filename)
         print(f"🗑️  Fichier supprimé: {filename}")
         
         return jsonify({
@@ -864,34 +4607,26 @@ def api_delete_file(filename):
 
 @app.route('/api/cleanup', methods=['POST'])
 def api_cleanup():
-    """Supprime les vidéos anciennes ou toutes les vidéos"""
-    import time
-    
+    """Supprime les vidéos anciennes ou toutes les vidéos (sélection depuis le catalogue)"""
     data = request.json or {}
     max_age_minutes = data.get('max_age_minutes', None)
     delete_all = data.get('delete_all', False)
     
-    output_folder = Path(app.config['OUTPUT_FOLDER'])
-    deleted_files = []
-    current_time = time.time()
+    if delete_all:
+        candidates = output_catalog.names()
+    elif max_age_minutes:
+        candidates = output_catalog.older_than(time.time() - max_age_minutes * 60)
+    else:
+        candidates = []
     
-    for file_path in output_folder.glob('*.mp4'):
-        should_delete = False
-        
-        if delete_all:
-            should_delete = True
-        elif max_age_minutes:
-            file_age = current_time - file_path.stat().st_mtime
-            if file_age > (max_age_minutes * 60):
-                should_delete = True
-        
-        if should_delete:
-            try:
-                file_path.unlink()
-                deleted_files.append(file_path.name)
-                print(f"🗑️  Supprimé: {file_path.name}")
-            except Exception as e:
-                print(f"❌ Erreur suppression {file_path.name}: {e}")
+    deleted_files = []
+    for name in candidates:
+        try:
+            if delete_output(name) is not None:
+                deleted_files.append(name)
+                print(f"🗑️  Supprimé: {name}")
+        except Exception as e:
+            print(f"❌ Erreur suppression {name}: {e}")
     
     return jsonify({
         'success': True,
@@ -901,28 +4636,31 @@ def api_cleanup():
 
 @app.route('/api/storage', methods=['GET'])
 def api_storage():
-    """Info sur l'espace disque et les fichiers"""
-    import shutil
-    
-    total, used, free = shutil.disk_usage("/app")
-    
-    output_folder = Path(app.config['OUTPUT_FOLDER'])
-    files = list(output_folder.glob('*.mp4'))
-    
-    file_info = []
-    total_size = 0
+    """
+    Info sur l'espace disque et les fichiers (depuis le catalogue, sans scanner outputs/)
+    Query: ?limit=100&offset=0&sort=age|size|name|last_access&order=desc|asc
+    """
+    total, used, free = shutil.disk_usage(app.config['OUTPUT_FOLDER'])
     
-    for f in files:
-        size = f.stat().st_size
-        total_size += size
-        file_info.append({
-            'name': f.name,
-            'size_mb': round(size / (2**20), 2),
-            'age_minutes': round((time.time() - f.stat().st_mtime) / 60, 1)
-        })
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'error': 'limit et offset doivent être des nombres'}), 400
+    sort = request.args.get('sort', 'age')
+    # Par défaut: plus vieux en premier (comme avant)
+    order = request.args.get('order', 'asc' if sort == 'age' else 'desc')
     
-    # Trier par âge (plus vieux en premier)
-    file_info.sort(key=lambda x: x['age_minutes'], reverse=True)
+    now = time.time()
+    file_info = [{
+        'name': entry['name'],
+        'size_mb': round(entry['size'] / (2**20), 2),
+        'age_minutes': round((now - entry['mtime']) / 60, 1),
+        'last_access_minutes': round((now - entry['last_access']) / 60, 1),
+        'job_id': entry['job_id'],
+        'resolution': (entry['config'] or {}).get('resolution')
+    } for entry in output_catalog.page(sort, order, limit, offset)]
+    total_files, total_size = output_catalog.totals()
     
     return jsonify({
         'disk': {
@@ -932,8 +4670,9 @@ def api_storage():
             'free_percent': round((free / total) * 100, 1)
         },
         'files': file_info,
-        'total_files': len(files),
-        'total_size_mb': round(total_size / (2**20), 2)
+        'total_files': total_files,
+        'total_size_mb': round(total_size / (2**20), 2),
+        'pagination': {'limit': limit, 'offset': offset, 'sort': sort, 'order': order}
     })
 
 @app.route('/api/alquran/ayah', methods=['POST'])
@@ -947,8 +4686,11 @@ def api_alquran_ayah():
         "surah": 1,
         "ayah": 1,
         "reciter": "ar.alafasy",  // optionnel, défaut: ar.alafasy
+        "edition": "quran-uthmani",  // optionnel, édition du texte
         "background": "default",
-        "output_name": "surah_1_ayah_1"  // optionnel
+        "output_name": "surah_1_ayah_1",  // optionnel
+        "callback_url": "https://n8n.example.com/webhook/quran",  // optionnel, reçoit le job final en POST
+        "idempotency_key": "workflow-42-item-7"  // optionnel (ou en-tête Idempotency-Key)
     }
     """
     try:
@@ -963,25 +4705,21 @@ def api_alquran_ayah():
         
         if not surah or not ayah:
             return jsonify({'error': 'surah et ayah requis'}), 400
+        try:
+            callback_url = validate_callback_url(data.get('callback_url'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Récupérer le texte du verset depuis AlQuran Cloud
-        text_url = f"https://api.alquran.cloud/v1/ayah/{surah}:{ayah}"
-        print(f"📖 Récupération texte: {text_url}")
-        
+        # Texte du verset depuis le corpus local (AlQuran Cloud seulement si l'édition manque)
         try:
-            text_response = requests.get(text_url, timeout=10)
-            text_response.raise_for_status()
-            text_data = text_response.json()
-            
-            if text_data['code'] != 200:
-                return jsonify({'error': 'Erreur API AlQuran Cloud (texte)'}), 500
-            
-            verse_text = text_data['data']['text']
+            verse_text = quran_corpus.get(int(surah), int(ayah), data.get('edition'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': f'Erreur récupération texte: {str(e)}'}), 500
         
         # Construire l'URL audio
-        audio_url = f"https://cdn.islamic.network/quran/audio/128/{reciter}/{surah}_{ayah}.mp3"
+        audio_url = ayah_audio_url(reciter, surah, ayah)
         
         # Nom de sortie
         output_name = sanitize_filename(data.get('output_name', f"surah_{surah}_ayah_{ayah}"))
@@ -992,6 +4730,8 @@ def api_alquran_ayah():
             'audio_url': audio_url,
             'background': data.get('background', 'default'),
             'output_name': output_name,
+            'callback_url': callback_url,
+            'idempotency_key': request.headers.get('Idempotency-Key') or data.get('idempotency_key'),
             'config': data.get('config', {})
         }
         
@@ -1009,106 +4749,123 @@ def api_generate_internal(data):
     verse_text = data['verse_text']
     audio_url = data['audio_url']
     
-    job_id = str(uuid.uuid4())[:8]
-    job_folder = Path(app.config['UPLOAD_FOLDER']) / job_id
-    job_folder.mkdir(exist_ok=True)
+    config = build_internal_config(data.get('config', {}))
     
+    return submit_render_job(verse_text, audio_url, data.get('background', 'default'),
+                             config, data.get('output_name'), data.get('callback_url'),
+                             data.get('idempotency_key'))
+
+def build_internal_config(custom_config):
+    """Config des endpoints AlQuran: presets de qualité + font_size/words_per_segment"""
     config = DEFAULT_CONFIG.copy()
-    custom_config = data.get('config', {})
-    
-    if 'quality' in custom_config:
-        quality = custom_config['quality']
-        if quality == 'draft':
-            config['crf'] = 28
-            config['preset'] = 'ultrafast'
-        elif quality == 'fast':
-            config['crf'] = 23
-            config['preset'] = 'fast'
-        elif quality == 'standard':
-            config['crf'] = 21
-            config['preset'] = 'medium'
-        elif quality == 'hq':
-            config['crf'] = 18
-            config['preset'] = 'slow'
+    
+    if custom_config.get('quality') in QUALITY_PRESETS:
+        config.update(QUALITY_PRESETS[custom_config['quality']])
     
     if 'font_size' in custom_config:
         config['font_size'] = int(custom_config['font_size'])
     if 'words_per_segment' in custom_config:
         config['words_per_segment'] = int(custom_config['words_per_segment'])
+    if custom_config.get('streaming'):
+        config['streaming'] = True
     
-    print(f"📥 Téléchargement audio: {audio_url}")
-    audio_path = job_folder / "audio.mp3"
-    if not download_file(audio_url, str(audio_path)):
-        return jsonify({'error': 'Erreur téléchargement audio'}), 500
-    
-    background_input = data.get('background', 'default')
+    return config
+
+@app.route('/api/alquran/range', methods=['POST'])
+def api_alquran_range():
+    """
+    Génère UNE vidéo pour une plage d'ayahs (page, sourate entière...)
+    Audios concaténés sans blanc, sous-titres ancrés sur le début réel de chaque ayah
     
-    if background_input == 'default':
-        default_bg = Path(app.config['BACKGROUNDS_FOLDER']) / "default.mp4"
-        if not default_bg.exists():
-            return jsonify({'error': 'Fond par défaut introuvable'}), 500
-        background_path = str(default_bg)
-    elif background_input.startswith('http'):
-        print(f"📥 Téléchargement background: {background_input}")
-        background_path = job_folder / "background.mp4"
-        if not download_file(background_input, str(background_path)):
-            return jsonify({'error': 'Erreur téléchargement background'}), 500
-        background_path = str(background_path)
-    else:
-        local_bg = Path(app.config['BACKGROUNDS_FOLDER']) / background_input
+    Body JSON:
+    {
+        "surah": 2,
+        "from_ayah": 1,
+        "to_ayah": 5,
+        "reciter": "ar.alafasy",  // optionnel, défaut: ar.alafasy
+        "edition": "quran-uthmani",  // optionnel, édition du texte
+        "background": "default",
+        "output_name": "surah_2_ayah_1-5",  // optionnel
+        "callback_url": "https://n8n.example.com/webhook/quran",  // optionnel, comme /api/generate
+        "idempotency_key": "workflow-42-item-7",  // optionnel, comme /api/generate
+        "config": {}  // optionnel, comme /api/alquran/ayah
+    }
+    """
+    try:
+        data = request.get_json()
         
-        # 🎲 Si c'est un dossier, choisir une vidéo aléatoire dedans
-        if local_bg.is_dir():
-            # Chercher tous les fichiers vidéo dans le dossier
-            video_files = list(local_bg.glob('*.mp4')) + list(local_bg.glob('*.mov')) + \
-                         list(local_bg.glob('*.avi')) + list(local_bg.glob('*.mkv'))
-            
-            if not video_files:
-                return jsonify({'error': f'Aucune vidéo trouvée dans le dossier {background_input}'}), 404
-            
-            # Choisir aléatoirement
-            background_path = str(random.choice(video_files))
-            print(f"🎲 Vidéo choisie aléatoirement: {Path(background_path).name}")
+        if not data:
+            return jsonify({'error': 'Body JSON requis'}), 400
         
-        # Si c'est un fichier direct
-        elif local_bg.exists():
-            background_path = str(local_bg)
+        try:
+            surah = int(data.get('surah') or 0)
+            from_ayah = int(data.get('from_ayah') or 0)
+            to_ayah = int(data.get('to_ayah') or 0)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'surah, from_ayah et to_ayah doivent être des nombres'}), 400
+        reciter = data.get('reciter', 'ar.alafasy')
         
-        # Ni fichier ni dossier trouvé
-        else:
-            return jsonify({'error': f'Fond {background_input} introuvable (ni fichier ni dossier)'}), 404
-
-    
-    output_name = sanitize_filename(data.get('output_name', job_id))
-    
-    jobs[job_id] = {
-        'id': job_id,
-        'status': 'downloading',
-        'progress': 0,
-        'verse_text': verse_text[:50] + '...' if len(verse_text) > 50 else verse_text,
-        'started_at': datetime.now().isoformat(),
-        'finished_at': None,
-        'output_path': None,
-        'download_url': None,
-        'error': None
-    }
-    
-    thread = threading.Thread(
-        target=process_video_job,
-        args=(job_id, verse_text, str(audio_path), background_path, config, output_name)
-    )
-    thread.daemon = True
-    thread.start()
-    
-    print(f"🚀 Job {job_id} démarré")
+        if not surah or not from_ayah or not to_ayah:
+            return jsonify({'error': 'surah, from_ayah et to_ayah requis'}), 400
+        try:
+            callback_url = validate_callback_url(data.get('callback_url'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if from_ayah > to_ayah:
+            return jsonify({'error': 'from_ayah doit être <= to_ayah'}), 400
+        if to_ayah - from_ayah + 1 > app.config['RANGE_MAX_AYAHS']:
+            return jsonify({'error': f"Plage limitée à {app.config['RANGE_MAX_AYAHS']} ayahs"}), 400
+        
+        try:
+            config = normalize_resolutions(build_internal_config(data.get('config', {})))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        dedupe_key = request_dedupe_key(
+            request.headers.get('Idempotency-Key') or data.get('idempotency_key'),
+            surah=surah, from_ayah=from_ayah, to_ayah=to_ayah, reciter=reciter, edition=data.get('edition'),
+            background=data.get('background', 'default'), config=config, output_name=data.get('output_name')
+        )
+        existing = job_store.find_duplicate(dedupe_key)
+        if existing:
+            return attached_job_response(existing, dedupe_key, callback_url)
+        
+        if render_pool.is_full():
+            return queue_full_response(render_pool.retry_after())
+        if not storage_manager.has_room():
+            return insufficient_storage_response()
+        
+        background_source, error = resolve_background(data.get('background', 'default'))
+        if error:
+            return error
+        
+        try:
+            texts = fetch_ayah_range_texts(surah, from_ayah, to_ayah, data.get('edition'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': f'Erreur récupération texte: {str(e)}'}), 500
+        
+        ayahs = [
+            {'ayah': n, 'text': text, 'audio_url': ayah_audio_url(reciter, surah, n)}
+            for n, text in zip(range(from_ayah, to_ayah + 1), texts)
+        ]
+        
+        job_id = str(uuid.uuid4())[:8]
+        output_name = sanitize_filename(data.get('output_name') or f"surah_{surah}_ayah_{from_ayah}-{to_ayah}")
+        
+        return enqueue_job(
+            job_id, texts[0], process_range_job,
+            (ayahs, background_source, config, output_name),
+            throughput.estimate(config) * len(ayahs),
+            extra=dict({'surah': surah, 'from_ayah': from_ayah, 'to_ayah': to_ayah, 'dedupe_key': dedupe_key},
+                       **({'callback_url': callback_url} if callback_url else {}))
+        )
     
-    return jsonify({
-        'success': True,
-        'job_id': job_id,
-        'status': 'processing',
-        'status_url': f"/api/status/{job_id}",
-        'estimated_time': 120
-    }), 202
+    except Exception as e:
+        print(f"❌ Erreur API AlQuran range: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -1116,9 +4873,50 @@ def health():
     return jsonify({
         'status': 'healthy',
         'version': '1.0',
-        'jobs_count': len(jobs)
+        'jobs_count': job_store.count(),
+        'jobs_by_status': job_store.count_by_status(),
+        'render_cache': render_cache.stats(),
+        'media_cache': media_cache.stats(),
+        'audio_cache': audio_cache.stats(),
+        'loop_cache': loop_cache.stats(),
+        'render_pool': render_pool.stats(),
+        'encode_speed': throughput.stats(),
+        'encode_scheduler': encode_scheduler.stats(),
+        'probe_cache': probe_cache.stats(),
+        'quran_corpus': quran_corpus.stats(),
+        'storage': storage_manager.stats(),
+        'webhooks': webhooks.stats(),
+        'status_waiters': job_events.waiters
     })
 
+def cache_counters():
+    """Compteurs des caches du process (hits/misses), additionnés entre workers par /metrics"""
+    samples = []
+    for name, cache in (('render', render_cache), ('media', media_cache), ('probe', probe_cache),
+                        ('audio', audio_cache), ('loop', loop_cache)):
+        samples.append(['quran_video_cache_hits_total', {'cache': name}, cache.hits])
+        samples.append(['quran_video_cache_misses_total', {'cache': name}, cache.misses])
+    return samples
+
+metrics.collectors.append(cache_counters)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métriques au format Prometheus (tous les workers additionnés)"""
+    by_status = job_store.count_by_status()
+    gauges = [
+        ('quran_video_queue_depth', {}, by_status.get('queued', 0)),
+        ('quran_video_encodes_in_flight', {}, by_status.get('generating_video', 0))
+    ]
+    counters, _ = metrics.collect()
+    for name in ('render', 'media', 'probe', 'audio', 'loop'):
+        labels = (('cache', name),)
+        hits = counters.get(('quran_video_cache_hits_total', labels), 0)
+        misses = counters.get(('quran_video_cache_misses_total', labels), 0)
+        ratio = round(hits / (hits + misses), 4) if hits + misses else None
+        gauges.append(('quran_video_cache_hit_ratio', {'cache': name}, ratio))
+    return metrics.render(gauges), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/api/docs', methods=['GET'])
 def docs():
     """Documentation de l'API"""
@@ -1135,7 +4933,8 @@ def docs():
                     'config': {
                         'quality': 'draft|fast|standard|hq',
                         'font_size': 'number',
-                        'words_per_segment': 'number'
+                        'words_per_segment': 'number',
+                        'streaming': 'bool (MP4 fragmenté, téléchargeable pendant l\'encodage via /api/stream)'
                     }
                 }
             },
@@ -1150,6 +4949,18 @@ def docs():
                     'output_name': 'string (optionnel)'
                 }
             },
+            '/api/alquran/range': {
+                'method': 'POST',
+                'description': 'Génère une seule vidéo pour une plage d\'ayahs (audio sans blanc, un seul encodage)',
+                'body': {
+                    'surah': 'number (requis)',
+                    'from_ayah': 'number (requis)',
+                    'to_ayah': 'number (requis)',
+                    'reciter': 'string (optionnel, défaut: ar.alafasy)',
+                    'background': 'string (optionnel)',
+                    'output_name': 'string (optionnel)'
+                }
+            },
             '/api/status/:job_id': {
                 'method': 'GET',
                 'description': 'Vérifie le statut d\'un job'
@@ -1157,6 +4968,14 @@ def docs():
             '/api/download/:filename': {
                 'method': 'GET',
                 'description': 'Télécharge une vidéo générée'
+            },
+            '/api/stream/:job_id': {
+                'method': 'GET',
+                'description': 'Télécharge la vidéo pendant l\'encodage (transfert chunked, config.streaming)'
+            },
+            '/metrics': {
+                'method': 'GET',
+                'description': 'Métriques Prometheus (durées par étape, jobs, caches, file, débit)'
             }
         }
     })
@@ -0,0 +1,302 @@
+"""
+Benchmark reproductible du rendu de bout en bout
+- Entrées synthétiques générées en local (audio sine lavfi, fonds testsrc2, textes arabes)
+- generate_ass + generate_video pour chaque résolution et chaque preset de qualité
+- Mesures par cas: temps réel, temps CPU (ffmpeg inclus), pic RSS, facteur temps réel → JSON
+- Mode compare: signale les régressions entre deux runs
+
+Usage:
+    python benchmark_render.py run --output bench.json
+    python benchmark_render.py run --durations 10 --resolutions 720p --qualities draft,fast
+    python benchmark_render.py compare base.json bench.json --threshold 0.10
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+APP_FILE = Path(__file__).resolve().parent / 'api_n8n_with_reciter-4.py'
+
+AUDIO_DURATIONS = [10, 60, 600]
+BACKGROUND_SIZES = ['640x360', '1920x1080', '1080x1920']
+BACKGROUND_SECONDS = 8  # Plus court que l'audio: la boucle du fond est mesurée aussi
+
+# Textes de longueurs variées (Al-Fatiha, début d'Al-Baqarah), un par durée d'audio
+_FATIHA = ("بِسْمِ اللَّهِ الرَّحْمَٰنِ الرَّحِيمِ الْحَمْدُ لِلَّهِ رَبِّ الْعَالَمِينَ الرَّحْمَٰنِ الرَّحِيمِ "
+           "مَالِكِ يَوْمِ الدِّينِ إِيَّاكَ نَعْبُدُ وَإِيَّاكَ نَسْتَعِينُ اهْدِنَا الصِّرَاطَ الْمُسْتَقِيمَ "
+           "صِرَاطَ الَّذِينَ أَنْعَمْتَ عَلَيْهِمْ غَيْرِ الْمَغْضُوبِ عَلَيْهِمْ وَلَا الضَّالِّينَ")
+_BAQARAH = ("الم ذَٰلِكَ الْكِتَابُ لَا رَيْبَ فِيهِ هُدًى لِلْمُتَّقِينَ الَّذِينَ يُؤْمِنُونَ بِالْغَيْبِ "
+            "وَيُقِيمُونَ الصَّلَاةَ وَمِمَّا رَزَقْنَاهُمْ يُنْفِقُونَ")
+TEXTS = {
+    10: ' '.join(_FATIHA.split()[:8]),
+    60: _FATIHA,
+    600: ' '.join([_FATIHA, _BAQARAH] * 12)
+}
+
+def load_app():
+    """Charge le module de l'API (nom de fichier non importable directement)"""
+    spec = importlib.util.spec_from_file_location('render_app', APP_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_app_isolated():
+    """Charge l'API hors du dossier courant (ses dossiers de travail vont dans un dossier temporaire)"""
+    cwd = os.getcwd()
+    os.environ['JOB_STORE'] = 'memory'
+    os.chdir(tempfile.mkdtemp(prefix='bench_app_'))
+    try:
+        return load_app()
+    finally:
+        os.chdir(cwd)
+
+def ffmpeg_version():
+    try:
+        out = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True).stdout
+        return out.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_FILE.parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ============================================
+# ENTRÉES SYNTHÉTIQUES
+# ============================================
+def generate_inputs(inputs_dir, durations, sizes):
+    """Génère (une seule fois) les audios sine et les fonds testsrc2"""
+    inputs_dir.mkdir(parents=True, exist_ok=True)
+    for duration in durations:
+        path = inputs_dir / f"sine_{duration}s.mp3"
+        if not path.exists():
+            print(f"🎵 Audio synthétique {duration}s")
+            subprocess.run([
+                "ffmpeg", "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+                "-c:a", "libmp3lame", "-b:a", "128k", "-y", str(path)
+            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for size in sizes:
+        path = inputs_dir / f"testsrc_{size}.mp4"
+        if not path.exists():
+            print(f"🎞️  Fond synthétique {size}")
+            subprocess.run([
+                "ffmpeg", "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={BACKGROUND_SECONDS}",
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p",
+                "-y", str(path)
+            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# ============================================
+# EXÉCUTION D'UN CAS (PROCESS DÉDIÉ)
+# ============================================
+def run_case(case, work_dir):
+    """
+    Exécute un cas dans le process courant (lancé par run_suite dans un process neuf)
+    Caches de rendu/média désactivés, caches de fond et d'audio neufs: mesure à froid reproductible
+    """
+    os.environ.update({
+        'JOB_STORE': 'memory',
+        'CACHE_FOLDER': str(work_dir / 'cache'),
+        'RENDER_CACHE_MAX_BYTES': '0',
+        'MEDIA_CACHE_MAX_BYTES': '0'
+    })
+    os.chdir(work_dir)
+    app = load_app()
+
+    config = dict(app.DEFAULT_CONFIG, resolution=case['resolution'])
+    config.update(app.QUALITY_PRESETS[case['quality']])
+    audio = case['audio']
+    background = case['background']
+    ass_path = str(work_dir / 'bench.ass')
+    output = str(work_dir / 'bench.mp4')
+
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    ok = app.generate_ass(case['text'], audio, ass_path, config)
+    ass_seconds = time.perf_counter() - started
+    # Piste AAC préparée à part (cache neuf du cas): mesurée seule, puis réutilisée par le rendu
+    audio_started = time.perf_counter()
+    app.prepare_audio_track(audio, config['audio_bitrate'])
+    audio_prep_seconds = time.perf_counter() - audio_started
+    ok = ok and app.generate_video(background, audio, ass_path, output, config)
+    wall = time.perf_counter() - started
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (own.ru_utime - cpu_start.ru_utime + own.ru_stime - cpu_start.ru_stime
+           + children.ru_utime + children.ru_stime)
+    # ru_maxrss en Ko sous Linux
+    peak_rss_mb = max(own.ru_maxrss, children.ru_maxrss) / 1024
+
+    return {
+        'ok': bool(ok),
+        'ass_seconds': round(ass_seconds, 4),
+        'audio_prep_seconds': round(audio_prep_seconds, 4),
+        'wall_seconds': round(wall, 3),
+        'cpu_seconds': round(cpu, 3),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'realtime_factor': round(case['audio_seconds'] / wall, 3) if wall > 0 else None,
+        'output_bytes': os.path.getsize(output) if ok and os.path.exists(output) else None
+    }
+
+def case_main(case_file):
+    """Point d'entrée interne: un cas par process, résultat JSON sur stdout"""
+    case = json.loads(Path(case_file).read_text(encoding='utf-8'))
+    work_dir = Path(tempfile.mkdtemp(prefix='bench_case_'))
+    # Les logs de l'API vont sur stderr: stdout ne contient que le résultat
+    real_stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        result = run_case(case, work_dir)
+    finally:
+        sys.stdout = real_stdout
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(result))
+
+# ============================================
+# SUITE ET COMPARAISON
+# ============================================
+def build_cases(inputs_dir, durations, sizes, resolutions, qualities):
+    cases = []
+    for duration in durations:
+        for size in sizes:
+            for resolution in resolutions:
+                for quality in qualities:
+                    cases.append({
+                        'id': f"{duration}s/{size}/{resolution}/{quality}",
+                        'audio_seconds': duration,
+                        'audio': str((inputs_dir / f"sine_{duration}s.mp3").resolve()),
+                        'background_size': size,
+                        'background': str((inputs_dir / f"testsrc_{size}.mp4").resolve()),
+                        'resolution': resolution,
+                        'quality': quality,
+                        'text': TEXTS.get(duration, TEXTS[60])
+                    })
+    return cases
+
+def run_suite(args):
+    app = load_app_isolated()
+    resolutions = args.resolutions.split(',') if args.resolutions else list(app.RESOLUTIONS)
+    qualities = args.qualities.split(',') if args.qualities else list(app.QUALITY_PRESETS)
+    durations = [int(d) for d in args.durations.split(',')]
+    sizes = args.backgrounds.split(',')
+
+    inputs_dir = Path(args.inputs)
+    generate_inputs(inputs_dir, durations, sizes)
+    cases = build_cases(inputs_dir, durations, sizes, resolutions, qualities)
+    print(f"🏁 {len(cases)} cas x {args.repeat} répétition(s)")
+
+    results = []
+    for index, case in enumerate(cases, 1):
+        runs = []
+        for _ in range(args.repeat):
+            with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8') as f:
+                json.dump(case, f)
+            try:
+                proc = subprocess.run([sys.executable, __file__, '_case', f.name],
+                                      capture_output=True, text=True)
+            finally:
+                os.unlink(f.name)
+            if proc.returncode != 0:
+                runs.append({'ok': False, 'error': proc.stderr.strip().splitlines()[-1:]})
+                continue
+            runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+        # Meilleur run (temps réel minimal): le moins bruité par la machine
+        ok_runs = [r for r in runs if r.get('ok')]
+        best = min(ok_runs, key=lambda r: r['wall_seconds']) if ok_runs else runs[-1]
+        entry = {k: v for k, v in case.items() if k not in ('audio', 'background', 'text')}
+        entry.update(best, runs=len(runs), text_chars=len(case['text']))
+        results.append(entry)
+        status = f"{best['wall_seconds']:.2f}s ({best['realtime_factor']}x)" if best.get('ok') else "ÉCHEC"
+        print(f"  [{index}/{len(cases)}] {case['id']}: {status}")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'commit': git_commit(),
+            'host': platform.node(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'ffmpeg': ffmpeg_version(),
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+    print(f"💾 Résultats: {args.output}")
+    return 0 if all(r.get('ok') for r in results) else 1
+
+COMPARED_METRICS = ['wall_seconds', 'cpu_seconds', 'peak_rss_mb']
+
+def compare(args):
+    """Compare deux runs cas par cas, code retour 1 si une régression dépasse le seuil"""
+    base = {r['id']: r for r in json.loads(Path(args.baseline).read_text(encoding='utf-8'))['results']}
+    new = {r['id']: r for r in json.loads(Path(args.candidate).read_text(encoding='utf-8'))['results']}
+
+    regressions = 0
+    for case_id in sorted(base.keys() & new.keys()):
+        old_case, new_case = base[case_id], new[case_id]
+        if old_case.get('ok') and not new_case.get('ok'):
+            print(f"❌ {case_id}: échoue désormais")
+            regressions += 1
+            continue
+        if not (old_case.get('ok') and new_case.get('ok')):
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = old_case.get(metric), new_case.get(metric)
+            if not before or after is None:
+                continue
+            delta = (after - before) / before
+            if delta > args.threshold:
+                print(f"🔺 {case_id} {metric}: {before} → {after} (+{delta:.0%})")
+                regressions += 1
+            elif delta < -args.threshold:
+                print(f"🟢 {case_id} {metric}: {before} → {after} ({delta:.0%})")
+
+    for case_id in sorted(base.keys() - new.keys()):
+        print(f"⚠️ {case_id}: absent du nouveau run")
+    print(f"{'❌' if regressions else '✅'} {regressions} régression(s) (seuil {args.threshold:.0%})")
+    return 1 if regressions else 0
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '_case':
+        case_main(sys.argv[2])
+        return 0
+
+    parser = argparse.ArgumentParser(description='Benchmark du rendu vidéo')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='Exécute la suite et écrit les résultats JSON')
+    run.add_argument('--output', default='bench.json')
+    run.add_argument('--inputs', default='bench_inputs', help='Dossier des entrées synthétiques')
+    run.add_argument('--durations', default=','.join(str(d) for d in AUDIO_DURATIONS))
+    run.add_argument('--backgrounds', default=','.join(BACKGROUND_SIZES))
+    run.add_argument('--resolutions', default=None, help='Défaut: toutes')
+    run.add_argument('--qualities', default=None, help='Défaut: tous les presets')
+    run.add_argument('--repeat', type=int, default=1, help='Runs par cas (le meilleur est gardé)')
+
+    cmp_parser = sub.add_parser('compare', help='Compare deux runs')
+    cmp_parser.add_argument('baseline')
+    cmp_parser.add_argument('candidate')
+    cmp_parser.add_argument('--threshold', type=float, default=0.10, help='Écart relatif toléré')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        return run_suite(args)
+    return compare(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Fixtures communes: l'API chargée hors du dépôt et un serveur HTTP local
+Lancement: python -m pytest -q (depuis la racine du dépôt)
+"""
+import http.server
+import importlib.util
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+APP_FILE = Path(__file__).resolve().parent.parent / 'api_n8n_with_reciter-4.py'
+
+
+@pytest.fixture(scope='session')
+def api():
+    """
+    Module de l'API, jobs en mémoire
+    Le dossier courant reste un dossier temporaire pendant toute la session:
+    ses dossiers de travail (outputs/, cache/, temp/...) sont relatifs
+    """
+    cwd = os.getcwd()
+    os.environ['JOB_STORE'] = 'memory'
+    os.environ['STORAGE_SWEEP_INTERVAL'] = '0'
+    os.chdir(tempfile.mkdtemp(prefix='tests_app_'))
+    try:
+        spec = importlib.util.spec_from_file_location('render_app', APP_FILE)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def http_server():
+    """
+    Démarre un serveur HTTP local pour une classe de handler, retourne son URL de base
+    Les serveurs sont arrêtés à la fin du test (ou avant, via server.stop())
+    """
+    servers = []
+
+    def start(handler):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            if server in servers:
+                servers.remove(server)
+                server.shutdown()
+                server.server_close()
+
+        server.stop = stop
+        server.url = f"http://127.0.0.1:{server.server_port}"
+        servers.append(server)
+        return server
+
+    yield start
+    for server in list(servers):
+        server.stop()
+
+
+@pytest.fixture
+def job_store(api, monkeypatch):
+    """Store de jobs en mémoire neuf, à la place de celui du module"""
+    store = api.MemoryJobStore()
+    monkeypatch.setattr(api, 'job_store', store)
+    return store
+
+
+@pytest.fixture
+def sent_webhooks(api, monkeypatch):
+    """Notifications soumises au dispatcher [(url, corps)], sans envoi réseau"""
+    sent = []
+    monkeypatch.setattr(api.webhooks, 'submit', lambda url, payload: sent.append((url, payload)) or True)
+    return sent
+
+
+@pytest.fixture
+def output_folder(api, tmp_path, monkeypatch):
+    """outputs/ temporaire avec son propre catalogue (en mémoire)"""
+    folder = tmp_path / 'outputs'
+    folder.mkdir()
+    monkeypatch.setitem(api.app.config, 'OUTPUT_FOLDER', str(folder))
+    monkeypatch.setattr(api, 'output_catalog', api.OutputCatalog(folder, ':memory:'))
+    return folder
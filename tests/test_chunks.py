@@ -0,0 +1,93 @@
+"""Découpage en morceaux parallèles: plan_chunks + write_ass_slice"""
+import pytest
+
+HEADER = """[Script Info]
+ScriptType: v4.00+
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def write_ass(api, path, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for n, (start, end) in enumerate(events):
+            f.write(f"Dialogue: 0,{api.ass_time(start)},{api.ass_time(end)},Default,,0,0,0,,ayah {n}\n")
+    return path
+
+
+def recitation(duration, length=15.03, first=0.5):
+    """Événements contigus hors grille d'images (les coupes tombent entre deux images)"""
+    events, start = [], first
+    while start + length <= duration:
+        events.append((round(start, 2), round(start + length, 2)))
+        start += length
+    return events
+
+
+def slices(api, tmp_path, ass_file, chunks, fps):
+    """Par morceau: [(début, fin) absolus des événements écrits, limités à l'image du morceau]"""
+    header, events = api.read_ass_events(ass_file)
+    result = []
+    for index, (first_frame, end_frame) in enumerate(chunks):
+        start = first_frame / fps
+        chunk_ass = tmp_path / f"part{index}.ass"
+        api.write_ass_slice(header, events, start, end_frame / fps, chunk_ass)
+        _, written = api.read_ass_events(chunk_ass)
+        end = end_frame / fps
+        result.append([(max(start + s, start), min(start + e, end)) for s, e, _ in written])
+    return result
+
+
+@pytest.mark.parametrize('duration, fps, workers', [(700, 30, 4), (700, 25, 3), (300, 29.97, 8)])
+def test_every_event_is_fully_covered_across_chunks(api, tmp_path, duration, fps, workers):
+    events = recitation(duration)
+    ass_file = write_ass(api, tmp_path / 'full.ass', events)
+    chunks = api.plan_chunks(ass_file, duration, fps, workers)
+    assert len(chunks) > 1
+
+    pieces = [piece for written in slices(api, tmp_path, ass_file, chunks, fps) for piece in written]
+    for start, end in events:
+        covering = sorted((s, e) for s, e in pieces if s < end and e > start)
+        assert covering, f"événement {start}→{end} perdu"
+        assert covering[0][0] <= start + 0.01
+        assert covering[-1][1] >= end - 0.01
+        for (_, previous_end), (next_start, _) in zip(covering, covering[1:]):
+            assert next_start <= previous_end + 0.01
+
+
+def test_cuts_fall_on_frames_at_or_before_an_event_start(api, tmp_path):
+    events = recitation(700)
+    ass_file = write_ass(api, tmp_path / 'full.ass', events)
+    chunks = api.plan_chunks(ass_file, 700, 30, 4)
+
+    assert chunks[0][0] == 0 and chunks[-1][1] == 700 * 30
+    starts = [start for start, _ in events]
+    for (_, end_frame), (first_frame, _) in zip(chunks, chunks[1:]):
+        assert end_frame == first_frame
+        cut = first_frame / 30
+        assert any(0 <= start - cut < 1 / 30 for start in starts)
+
+
+def test_short_recitation_is_not_chunked(api, tmp_path):
+    ass_file = write_ass(api, tmp_path / 'full.ass', recitation(15))
+    assert api.plan_chunks(ass_file, 15, 30, 4) == []
+
+
+def test_slice_shifts_and_clamps_events(api, tmp_path):
+    ass_file = write_ass(api, tmp_path / 'full.ass', [(1.0, 4.0), (4.0, 12.5), (12.5, 20.0)])
+    header, events = api.read_ass_events(ass_file)
+    api.write_ass_slice(header, events, 10.0, 20.0, tmp_path / 'part.ass')
+
+    sliced_header, sliced = api.read_ass_events(tmp_path / 'part.ass')
+    assert sliced_header == header
+    assert [(s, e, fields[9]) for s, e, fields in sliced] == [(0.0, 2.5, 'ayah 1'), (2.5, 10.0, 'ayah 2')]
+
+
+def test_cuts_avoid_overlapping_events(api, tmp_path):
+    # Deux événements superposés entre 295 et 305 s: aucune coupe dans cet intervalle
+    events = recitation(600, length=20.0) + [(295.0, 305.0)]
+    ass_file = write_ass(api, tmp_path / 'full.ass', sorted(events))
+    for first_frame, _ in api.plan_chunks(ass_file, 600, 30, 2)[1:]:
+        assert not 295.0 < first_frame / 30 < 305.0
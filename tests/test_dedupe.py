@@ -0,0 +1,81 @@
+"""Déduplication des demandes de rendu: clé d'idempotence, single-flight, rattachement"""
+import threading
+
+import pytest
+
+VERSE = 'بِسْمِ اللَّهِ الرَّحْمَٰنِ الرَّحِيمِ'
+
+
+def test_idempotency_key_wins_over_inputs(api):
+    assert api.request_dedupe_key('wf-42', verse_text=VERSE) == 'idem:wf-42'
+    assert api.request_dedupe_key('k' * 500, verse_text=VERSE) == 'idem:' + 'k' * 200
+
+
+def test_input_fingerprint(api):
+    key = api.request_dedupe_key(None, verse_text=VERSE, audio_url='http://a/1.mp3', config={'fps': 30})
+
+    assert key.startswith('req:')
+    # Espaces et caractères invisibles ne changent pas le rendu
+    assert api.request_dedupe_key(None, verse_text=f"  {VERSE.replace(' ', '  ')}​\n",
+                                  audio_url='http://a/1.mp3', config={'fps': 30}) == key
+    assert api.request_dedupe_key(None, verse_text=VERSE, audio_url='http://a/2.mp3', config={'fps': 30}) != key
+    assert api.request_dedupe_key(None, verse_text=VERSE, audio_url='http://a/1.mp3', config={'fps': 60}) != key
+
+
+@pytest.fixture
+def generate(api, job_store, monkeypatch):
+    """POST /api/generate avec un pool dont les rendus attendent release.set()"""
+    release = threading.Event()
+    monkeypatch.setattr(api, 'process_video_job', lambda job_id, *args: release.wait(5))
+    monkeypatch.setattr(api, 'render_pool', api.RenderPool(2, 4))
+    client = api.app.test_client()
+
+    def post(callback_url=None, idempotency_key=None, **body):
+        body = dict({'verse_text': VERSE, 'audio_url': 'http://127.0.0.1:9/1.mp3',
+                     'background': 'http://127.0.0.1:9/bg.mp4'}, **body)
+        if callback_url:
+            body['callback_url'] = callback_url
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+        return client.post('/api/generate', json=body, headers=headers)
+
+    yield post
+    release.set()
+
+
+def test_identical_request_attaches_to_the_running_job(api, job_store, generate, sent_webhooks):
+    first = generate(callback_url='http://a.example/hook')
+    second = generate(callback_url='http://b.example/hook')
+
+    assert first.status_code == second.status_code == 202
+    assert second.json['job_id'] == first.json['job_id']
+    assert second.json['deduplicated'] is True
+    assert job_store.count() == 1
+    job = job_store.get(first.json['job_id'])
+    assert api.job_callback_urls(job) == ['http://a.example/hook', 'http://b.example/hook']
+
+    # Entrées différentes: nouveau job
+    assert generate(audio_url='http://127.0.0.1:9/2.mp3').json['job_id'] != first.json['job_id']
+
+
+def test_finished_job_only_captures_its_idempotency_key(api, job_store, generate):
+    first = generate(idempotency_key='wf-1')
+    job_store.update(first.json['job_id'], status='completed', progress=100,
+                     output_path='outputs/video.mp4')
+
+    replay = generate(idempotency_key='wf-1', verse_text='autre texte')
+    assert replay.status_code == 200
+    assert (replay.json['job_id'], replay.json['status']) == (first.json['job_id'], 'completed')
+    assert replay.json['download_url'] == '/api/download/video.mp4'
+
+    # Sans clé: le job terminé ne capte plus les requêtes identiques
+    assert generate(idempotency_key=None).json['job_id'] != first.json['job_id']
+
+
+def test_failed_job_is_retried_with_the_same_key(api, job_store, generate):
+    first = generate(idempotency_key='wf-2')
+    job_store.update(first.json['job_id'], status='error', error='Erreur génération de la vidéo')
+
+    retry = generate(idempotency_key='wf-2')
+    assert retry.status_code == 202
+    assert retry.json['job_id'] != first.json['job_id']
+    assert 'deduplicated' not in retry.json
@@ -0,0 +1,58 @@
+"""EncodeScheduler: partage du budget CPU entre encodages (dossier d'allocations temporaire)"""
+import subprocess
+import sys
+
+
+def test_lone_encode_gets_the_whole_budget(api, tmp_path):
+    scheduler = api.EncodeScheduler(8, tmp_path, concurrency=4, demand=lambda: 1)
+    assert scheduler.acquire('1080p')['threads'] == 8
+
+
+def test_burst_shares_budget_by_expected_concurrency(api, tmp_path):
+    demand = {'jobs': 2}
+    scheduler = api.EncodeScheduler(8, tmp_path, concurrency=4, demand=lambda: demand['jobs'])
+
+    first = scheduler.acquire('1080p')
+    second = scheduler.acquire('1080p')
+    assert (first['threads'], second['threads']) == (4, 4)
+    assert scheduler.stats() == {'cpu_budget': 8, 'running_encodes': 2, 'threads_allocated': 8}
+
+    scheduler.release(first)
+    demand['jobs'] = 1
+    assert scheduler.acquire('1080p')['threads'] == 4  # Jamais plus que les cœurs restants
+
+
+def test_expected_concurrency_is_capped(api, tmp_path):
+    # 20 jobs en attente mais 2 encodages simultanés au plus: moitié du budget chacun
+    scheduler = api.EncodeScheduler(8, tmp_path, concurrency=2, demand=lambda: 20)
+    assert [scheduler.acquire('1080p')['threads'] for _ in range(2)] == [4, 4]
+
+
+def test_share_is_weighted_by_pixels(api, tmp_path):
+    scheduler = api.EncodeScheduler(10, tmp_path, concurrency=2, demand=lambda: 2)
+    uhd = scheduler.acquire('4k')
+    hd = scheduler.acquire('1080p')
+    assert uhd['threads'] > hd['threads'] >= 1
+    assert uhd['threads'] + hd['threads'] <= 10
+
+
+def test_failing_demand_falls_back_to_running_encodes(api, tmp_path):
+    def demand():
+        raise RuntimeError('store indisponible')
+    scheduler = api.EncodeScheduler(6, tmp_path, concurrency=4, demand=demand)
+    assert scheduler.acquire('1080p')['threads'] == 6
+
+
+def test_allocations_are_shared_between_processes(api, tmp_path):
+    other = api.EncodeScheduler(8, tmp_path, concurrency=2, demand=lambda: 2)
+    held = other.acquire('1080p')
+    scheduler = api.EncodeScheduler(8, tmp_path, concurrency=2, demand=lambda: 2)
+    assert scheduler.stats()['threads_allocated'] == held['threads']
+
+    # Allocation d'un process mort: ignorée et supprimée
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                          capture_output=True, text=True, check=True).stdout.strip()
+    orphan = tmp_path / f"{api.socket.gethostname()}_{dead}_deadbeef.json"
+    orphan.write_text('{"threads": 8, "weight": 1.0}', encoding='utf-8')
+    assert scheduler.stats()['threads_allocated'] == held['threads']
+    assert not orphan.exists()
@@ -0,0 +1,56 @@
+"""Champs internes des jobs absents de /api/status et des webhooks; réponse des requêtes rattachées"""
+import pytest
+
+INTERNAL = {'dedupe_key', 'callback_url', 'extra_callback_urls'}
+
+
+def make_job(job_store, job_id='job1', status='generating_video', **fields):
+    job = {'id': job_id, 'status': status, 'progress': 40, 'started_at': '2026-10-01T10:00:00',
+           'dedupe_key': 'idem:secret', 'callback_url': 'http://a.example/hook', **fields}
+    job_store.create(job)
+    job_store.add_callback(job_id, 'http://b.example/hook')
+    return job
+
+
+def test_status_hides_internal_fields(api, job_store):
+    make_job(job_store)
+    response = api.app.test_client().get('/api/status/job1')
+
+    assert response.status_code == 200
+    assert response.json['status'] == 'generating_video'
+    assert not INTERNAL & set(response.json)
+    # Le store garde les champs: ils servent à la déduplication et aux notifications
+    assert job_store.get('job1')['dedupe_key'] == 'idem:secret'
+
+
+def test_webhooks_do_not_leak_other_clients_urls(api, job_store, sent_webhooks):
+    make_job(job_store)
+    job_store.update('job1', status='completed', progress=100)
+    api.notify_job_finished('job1')
+
+    assert sorted(url for url, _ in sent_webhooks) == ['http://a.example/hook', 'http://b.example/hook']
+    for _, payload in sent_webhooks:
+        assert payload['status'] == 'completed'
+        assert not INTERNAL & set(payload)
+
+
+@pytest.mark.parametrize('status, code', [('generating_video', 202), ('completed', 200), ('error', 200)])
+def test_attached_request_reports_real_status(api, job_store, sent_webhooks, status, code):
+    job = make_job(job_store, status=status, error='Erreur génération de la vidéo' if status == 'error' else None)
+    with api.app.test_request_context():
+        response, http_code = api.attached_job_response(job_store.get('job1'), 'idem:secret',
+                                                        'http://c.example/hook')
+
+    assert http_code == code
+    assert response.json['status'] == status
+    assert response.json['deduplicated'] is True
+    if status == 'error':
+        assert response.json['success'] is False
+        assert response.json['error'] == job['error']
+    # Job terminé: le nouveau client est notifié tout de suite, sans les champs internes
+    if status in api.FINISHED_STATUSES:
+        (url, payload), = sent_webhooks
+        assert url == 'http://c.example/hook' and not INTERNAL & set(payload)
+    else:
+        assert not sent_webhooks
+        assert 'http://c.example/hook' in api.job_callback_urls(job_store.get('job1'))
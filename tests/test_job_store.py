@@ -0,0 +1,54 @@
+"""Filtres de liste des stores de jobs et de /api/jobs"""
+from datetime import datetime
+
+import pytest
+
+DAYS = ['2026-10-01', '2026-10-02', '2026-10-03']
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(api, request, tmp_path):
+    if request.param == 'memory':
+        store = api.MemoryJobStore()
+    else:
+        store = api.SQLiteJobStore(str(tmp_path / 'jobs.db'))
+    for day in DAYS:
+        for n, status in enumerate(['completed', 'error', 'completed']):
+            store.create({'id': f"{day}-{n}", 'status': status, 'progress': 100,
+                          'started_at': f"{day}T10:0{n}:00", 'finished_at': f"{day}T10:0{n}:30"})
+    return store
+
+
+def ts(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'status': 'completed'},
+    {'since': ts('2026-10-02T00:00:00')},
+    {'until': ts('2026-10-02T00:00:00')},
+    {'status': 'error', 'since': ts('2026-10-02T00:00:00'), 'until': ts('2026-10-03T00:00:00')},
+])
+def test_count_uses_the_same_filters_as_list(store, filters):
+    assert store.count(**filters) == len(store.list(**filters, limit=1000))
+
+
+def test_since_until_bounds(store):
+    since, until = ts('2026-10-02T00:00:00'), ts('2026-10-03T00:00:00')
+    assert store.count(since=since, until=until) == 3
+    assert store.count('completed', since, until) == 2
+    assert store.count(since=ts('2026-10-03T10:02:00')) == 1
+
+
+def test_api_jobs_total_follows_date_filters(api, store, monkeypatch):
+    monkeypatch.setattr(api, 'job_store', store)
+    client = api.app.test_client()
+
+    response = client.get('/api/jobs?since=2026-10-02T00:00:00&limit=2')
+    assert response.status_code == 200
+    assert response.json['total_jobs'] == 6
+    assert len(response.json['jobs']) == 2
+
+    response = client.get('/api/jobs?status=error&until=2026-10-02T00:00:00')
+    assert response.json['total_jobs'] == 1
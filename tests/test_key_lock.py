@@ -0,0 +1,31 @@
+"""Verrous de production des entrées de cache (key_lock)"""
+import threading
+import time
+
+
+def test_lock_files_are_bounded(api, tmp_path):
+    for n in range(500):
+        with api.key_lock(tmp_path, f"key{n}"):
+            pass
+
+    files = list(tmp_path.iterdir())
+    assert 0 < len(files) <= api.KEY_LOCK_STRIPES
+    assert all(f.name.startswith('.lock-') for f in files)
+
+
+def test_same_key_is_exclusive(api, tmp_path):
+    events = []
+
+    def worker(name):
+        with api.key_lock(tmp_path, 'same-key'):
+            events.append(f"{name}-in")
+            time.sleep(0.1)
+            events.append(f"{name}-out")
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert events[0][0] == events[1][0] and events[2][0] == events[3][0]
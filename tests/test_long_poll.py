@@ -0,0 +1,92 @@
+"""Long-poll /api/status?wait= et flux SSE: délai max, réveil, slots d'attente"""
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def job_events(api, monkeypatch):
+    # poll_interval long: un réveil rapide prouve la notification du store, pas le polling
+    events = api.JobEvents(2, poll_interval=5)
+    monkeypatch.setattr(api, 'job_events', events)
+    return events
+
+
+@pytest.fixture
+def client(api, job_store, job_events):
+    job_store.create({'id': 'job1', 'status': 'generating_video', 'progress': 10,
+                      'started_at': '2026-10-01T10:00:00'})
+    return api.app.test_client()
+
+
+def update_later(job_store, delay, **fields):
+    timer = threading.Timer(delay, job_store.update, ('job1',), fields)
+    timer.start()
+    return timer
+
+
+def test_wait_times_out_without_change(client, job_events):
+    started = time.monotonic()
+    response = client.get('/api/status/job1?wait=0.3')
+    elapsed = time.monotonic() - started
+
+    assert 0.3 <= elapsed < 2
+    assert response.json['state'] == 'generating_video:10'
+    assert job_events.waiters == 0
+
+
+def test_wait_is_capped(api, client, monkeypatch):
+    monkeypatch.setitem(api.app.config, 'STATUS_MAX_WAIT', 0.2)
+    started = time.monotonic()
+    client.get('/api/status/job1?wait=60')
+    assert time.monotonic() - started < 2
+
+
+def test_update_wakes_the_waiter(client, job_store, job_events):
+    update_later(job_store, 0.2, progress=40)
+    started = time.monotonic()
+    response = client.get('/api/status/job1?wait=10')
+
+    assert time.monotonic() - started < 2
+    assert response.json['progress'] == 40
+    assert response.json['state'] == 'generating_video:40'
+    assert job_events.waiters == 0
+
+
+def test_stale_state_returns_immediately(client, job_store):
+    job_store.update('job1', progress=60)
+    started = time.monotonic()
+    response = client.get('/api/status/job1?wait=10&state=generating_video:10')
+
+    assert time.monotonic() - started < 1
+    assert response.json['progress'] == 60
+
+
+def test_no_free_slot_answers_immediately(api, client, monkeypatch):
+    monkeypatch.setattr(api, 'job_events', api.JobEvents(0))
+    started = time.monotonic()
+    response = client.get('/api/status/job1?wait=10')
+
+    assert time.monotonic() - started < 1
+    assert response.status_code == 200 and response.json['progress'] == 10
+
+
+def test_invalid_wait(client):
+    assert client.get('/api/status/job1?wait=soon').status_code == 400
+
+
+def test_sse_stream_ends_with_done(client, job_store, job_events):
+    update_later(job_store, 0.2, progress=50)
+    update_later(job_store, 0.4, status='completed', progress=100)
+
+    response = client.get('/api/status/job1?stream=1', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    assert job_events.waiters == 1
+    body = b''.join(response.response).decode()
+    response.close()
+
+    events = [block.split('\n')[0] for block in body.split('\n\n') if block.startswith('event:')]
+    assert events[0] == 'event: status' and events[-1] == 'event: done'
+    assert '"state": "completed:100"' in body.split('event: done')[1]
+    assert job_events.waiters == 0
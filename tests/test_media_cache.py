@@ -0,0 +1,144 @@
+"""MediaCache.fetch contre un serveur HTTP local"""
+import hashlib
+import http.server
+import os
+import time
+
+import pytest
+
+
+def media_handler(files):
+    """Handler servant files {chemin: corps} avec ETag + Last-Modified, 304 si la copie est à jour"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        requests = []
+
+        @staticmethod
+        def etag_for(body):
+            return f'"{len(body)}-{hashlib.md5(body).hexdigest()[:8]}"'
+
+        def do_GET(self):
+            Handler.requests.append((self.path, dict(self.headers)))
+            if self.path not in files:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = files[self.path]
+            etag = Handler.etag_for(body)
+            last_modified = 'Mon, 05 Oct 2026 10:00:00 GMT'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def make_cache(api, tmp_path):
+    def make(max_bytes=1 << 20, ttl=3600):
+        return api.MediaCache(tmp_path / 'media', max_bytes, ttl)
+    return make
+
+
+def test_fresh_entry_is_served_without_network(api, make_cache, http_server, tmp_path):
+    handler = media_handler({'/a.mp3': b'recitation'})
+    server = http_server(handler)
+    cache = make_cache()
+
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'job1.mp3')
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'job2.mp3')
+
+    assert len(handler.requests) == 1
+    assert (tmp_path / 'job2.mp3').read_bytes() == b'recitation'
+    stats = cache.stats()
+    assert (stats['misses'], stats['hits'], stats['bytes_downloaded']) == (1, 1, len(b'recitation'))
+    # Le sha256 noté au téléchargement est celui du contenu livré
+    entry = cache.path_for(cache.key_for(f"{server.url}/a.mp3"))
+    assert cache.digest(entry) == api.file_sha256(tmp_path / 'job2.mp3')
+
+
+def test_expired_entry_is_revalidated_with_304(make_cache, http_server, tmp_path):
+    handler = media_handler({'/a.mp3': b'recitation'})
+    server = http_server(handler)
+    cache = make_cache(ttl=0)
+
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'job1.mp3')
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'job2.mp3')
+
+    _, headers = handler.requests[1]
+    assert headers.get('If-None-Match') == handler.etag_for(b'recitation')
+    assert headers.get('If-Modified-Since') == 'Mon, 05 Oct 2026 10:00:00 GMT'
+    assert (tmp_path / 'job2.mp3').read_bytes() == b'recitation'
+    stats = cache.stats()
+    assert (stats['misses'], stats['revalidations'], stats['bytes_downloaded']) == (1, 1, len(b'recitation'))
+
+
+def test_changed_content_is_downloaded_again(make_cache, http_server, tmp_path):
+    files = {'/a.mp3': b'first take'}
+    server = http_server(media_handler(files))
+    cache = make_cache(ttl=0)
+
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'job1.mp3')
+    files['/a.mp3'] = b'second take, longer'
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'job2.mp3')
+
+    assert (tmp_path / 'job1.mp3').read_bytes() == b'first take'
+    assert (tmp_path / 'job2.mp3').read_bytes() == b'second take, longer'
+    assert cache.stats()['misses'] == 2
+
+
+def test_stale_copy_is_served_when_network_fails(make_cache, http_server, tmp_path):
+    server = http_server(media_handler({'/a.mp3': b'recitation'}))
+    cache = make_cache(ttl=0)
+    url = f"{server.url}/a.mp3"
+
+    assert cache.fetch(url, tmp_path / 'job1.mp3')
+    server.stop()
+    assert cache.fetch(url, tmp_path / 'job2.mp3')
+    assert (tmp_path / 'job2.mp3').read_bytes() == b'recitation'
+
+    # Sans copie en cache, l'échec réseau reste un échec
+    assert not cache.fetch(f"{server.url}/other.mp3", tmp_path / 'job3.mp3')
+    assert not (tmp_path / 'job3.mp3').exists()
+
+
+def test_missing_url_is_not_cached(make_cache, http_server, tmp_path):
+    server = http_server(media_handler({}))
+    cache = make_cache()
+
+    assert not cache.fetch(f"{server.url}/absent.mp3", tmp_path / 'job1.mp3')
+    assert not list(cache.folder.iterdir())
+
+
+def test_least_recently_used_entry_is_evicted(make_cache, http_server, tmp_path):
+    files = {f"/{name}.mp3": name.encode() * 10 for name in 'abc'}  # 10 octets chacun
+    server = http_server(media_handler(files))
+    cache = make_cache(max_bytes=25)
+    entry = {name: cache.path_for(cache.key_for(f"{server.url}/{name}.mp3")) for name in 'abc'}
+
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'a1.mp3')
+    assert cache.fetch(f"{server.url}/b.mp3", tmp_path / 'b1.mp3')
+    # a relu après b: b devient l'entrée la moins récemment utilisée
+    past = time.time() - 60
+    os.utime(entry['a'], (past, past))
+    os.utime(entry['b'], (past - 10, past - 10))
+    assert cache.fetch(f"{server.url}/a.mp3", tmp_path / 'a2.mp3')
+    assert cache.fetch(f"{server.url}/c.mp3", tmp_path / 'c1.mp3')
+
+    assert entry['a'].exists() and entry['c'].exists()
+    assert not entry['b'].exists()
+    assert not entry['b'].with_suffix('.json').exists()
+    stats = cache.stats()
+    assert (stats['evictions'], stats['bytes']) == (1, 20)
+    # Le fichier déjà livré au job survit à l'éviction de l'entrée
+    assert (tmp_path / 'b1.mp3').read_bytes() == b'b' * 10
@@ -0,0 +1,74 @@
+"""Metrics: agrégation des instantanés des workers (hôte, workers vivants, cumul des workers morts)"""
+import json
+import socket
+import subprocess
+
+import pytest
+
+HOST = socket.gethostname()
+
+
+@pytest.fixture
+def live_pid():
+    process = subprocess.Popen(['sleep', '30'])
+    yield process.pid
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(folder, name, jobs, seconds=()):
+    hist = {'buckets': [1, 10], 'counts': [sum(s <= 1 for s in seconds), sum(1 < s <= 10 for s in seconds)],
+            'sum': float(sum(seconds)), 'count': len(seconds)}
+    (folder / f"{name}.json").write_text(json.dumps({
+        'pid': 0, 'counters': [['jobs_total', {'status': 'completed'}, jobs]],
+        'histograms': [['encode_seconds', {}, hist]] if seconds else []}), encoding='utf-8')
+
+
+def totals(metrics):
+    counters, histograms = metrics.collect()
+    hist = histograms.get(('encode_seconds', ()))
+    return counters.get(('jobs_total', (('status', 'completed'),)), 0), hist['count'] if hist else 0
+
+
+def test_only_live_workers_of_this_host_are_added(api, tmp_path, live_pid):
+    metrics = api.Metrics(tmp_path, flush_interval=0)
+    metrics.inc('jobs_total', status='completed')
+    write_snapshot(tmp_path, f"{HOST}_{live_pid}", 2)
+    write_snapshot(tmp_path, f"other-host_{live_pid}", 100)  # DATA_FOLDER partagé: scrapé sur son hôte
+    write_snapshot(tmp_path, f"{HOST}_stray", 100)
+
+    assert totals(metrics) == (3, 0)
+
+
+def test_dead_workers_counters_are_kept(api, tmp_path, live_pid, dead_pid):
+    metrics = api.Metrics(tmp_path, flush_interval=0)
+    write_snapshot(tmp_path, f"{HOST}_{live_pid}", 2, [0.5])
+    write_snapshot(tmp_path, f"{HOST}_{dead_pid}", 5, [3, 4])
+
+    assert totals(metrics) == (7, 3)
+    assert not (tmp_path / f"{HOST}_{dead_pid}.json").exists()
+    assert totals(metrics) == (7, 3)  # Replié une seule fois
+
+    # Un autre worker meurt plus tard: son cumul s'ajoute au précédent
+    write_snapshot(tmp_path, f"{HOST}_{dead_pid}", 1, [20])
+    assert totals(metrics) == (8, 4)
+    _, histograms = metrics.collect()
+    assert histograms[('encode_seconds', ())]['counts'] == [1, 2]
+
+
+def test_retired_totals_are_shared_between_workers(api, tmp_path, dead_pid):
+    first = api.Metrics(tmp_path, flush_interval=0)
+    write_snapshot(tmp_path, f"{HOST}_{dead_pid}", 5)
+    assert totals(first) == (5, 0)
+
+    second = api.Metrics(tmp_path, flush_interval=0)
+    second.inc('jobs_total', status='completed')
+    assert totals(second) == (6, 0)
+    assert 'jobs_total{status="completed"} 6' in second.render()
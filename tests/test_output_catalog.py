@@ -0,0 +1,101 @@
+"""OutputCatalog: comptabilité de outputs/ sans scanner le dossier"""
+import os
+import time
+
+
+def write(folder, name, size, mtime=None):
+    path = folder / name
+    path.write_bytes(b'v' * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_add_touch_remove(api, output_folder):
+    catalog = api.output_catalog
+    path = write(output_folder, 'a.mp4', 100)
+    catalog.add(path, 'job1', {'resolution': '720p'})
+
+    entry = catalog.get('a.mp4')
+    assert (entry['size'], entry['job_id'], entry['config']) == (100, 'job1', {'resolution': '720p'})
+    catalog.touch('a.mp4', 12345.0)
+    assert catalog.get('a.mp4')['last_access'] == 12345.0
+
+    # Re-publication sous le même nom: taille mise à jour, une seule entrée
+    write(output_folder, 'a.mp4', 250)
+    catalog.add(path, 'job2')
+    assert catalog.totals() == (1, 250)
+    assert catalog.get('a.mp4')['job_id'] == 'job2'
+
+    catalog.remove('a.mp4')
+    assert catalog.get('a.mp4') is None
+    assert catalog.totals() == (0, 0)
+    catalog.add(output_folder / 'missing.mp4')  # Fichier absent: ignoré
+    assert catalog.totals() == (0, 0)
+
+
+def test_page_sort_and_selection(api, output_folder):
+    catalog = api.output_catalog
+    now = time.time()
+    for name, size, age in [('a.mp4', 300, 3000), ('b.mp4', 100, 2000), ('c.mp4', 200, 1000)]:
+        catalog.add(write(output_folder, name, size, now - age))
+    catalog.touch('a.mp4', now)
+
+    assert [e['name'] for e in catalog.page('age', 'asc')] == ['a.mp4', 'b.mp4', 'c.mp4']
+    assert [e['name'] for e in catalog.page('size', 'desc', limit=2)] == ['a.mp4', 'c.mp4']
+    assert [e['name'] for e in catalog.page('name', 'asc', limit=2, offset=1)] == ['b.mp4', 'c.mp4']
+    assert [e['name'] for e in catalog.page('bogus')] == ['c.mp4', 'b.mp4', 'a.mp4']  # Repli sur l'âge
+    assert [name for name, _, _ in catalog.least_recently_used()] == ['b.mp4', 'c.mp4', 'a.mp4']
+    assert sorted(catalog.older_than(now - 1500)) == ['a.mp4', 'b.mp4']
+
+
+def test_reconcile_catches_changes_made_outside_the_api(api, output_folder):
+    catalog = api.output_catalog
+    kept = write(output_folder, 'kept.mp4', 100)
+    gone = write(output_folder, 'gone.mp4', 100)
+    catalog.add(kept, 'job1')
+    catalog.add(gone, 'job2')
+    gone.unlink()
+    write(output_folder, 'copied.mp4', 50)
+    write(output_folder, 'notes.txt', 10)
+
+    catalog.reconcile()
+
+    assert sorted(catalog.names()) == ['copied.mp4', 'kept.mp4']
+    assert catalog.get('kept.mp4')['job_id'] == 'job1'  # Inchangée: métadonnées gardées
+    assert catalog.totals() == (2, 150)
+
+
+def test_catalog_file_is_shared_between_workers(api, output_folder, tmp_path):
+    first = api.OutputCatalog(output_folder, str(tmp_path / 'outputs.db'))
+    second = api.OutputCatalog(output_folder, str(tmp_path / 'outputs.db'))
+    first.add(write(output_folder, 'a.mp4', 100), 'job1')
+
+    assert second.totals() == (1, 100)
+    second.remove('a.mp4')
+    assert first.names() == []
+
+
+def test_api_accounting(api, output_folder):
+    client = api.app.test_client()
+    for name, size in [('a.mp4', 100), ('b.mp4', 200), ('c.mp4', 300)]:
+        api.output_catalog.add(write(output_folder, name, size, time.time() - 3600))
+        api.output_catalog.touch(name, time.time() - 3600)
+
+    response = client.get('/api/download/b.mp4')
+    assert response.status_code == 200
+    response.close()
+    assert time.time() - api.output_catalog.get('b.mp4')['last_access'] < 60
+
+    assert client.delete('/api/delete/a.mp4').status_code == 200
+    storage = client.get('/api/storage?sort=size').json
+    assert (storage['total_files'], [f['name'] for f in storage['files']]) == (2, ['c.mp4', 'b.mp4'])
+
+    response = client.get('/api/download/c.mp4?delete=true', buffered=True)
+    assert response.data == b'v' * 300
+    assert not (output_folder / 'c.mp4').exists()
+    assert api.output_catalog.names() == ['b.mp4']
+
+    assert client.post('/api/cleanup', json={'delete_all': True}).status_code == 200
+    assert api.output_catalog.totals() == (0, 0)
+    assert not list(output_folder.iterdir())
@@ -0,0 +1,106 @@
+"""QuranCorpus: import d'éditions et lecture locale (sourate manquante récupérée une fois)"""
+import http.server
+import json
+
+import pytest
+
+FATIHA = ['بِسْمِ اللَّهِ الرَّحْمَٰنِ الرَّحِيمِ', 'الْحَمْدُ لِلَّهِ رَبِّ الْعَالَمِينَ', 'الرَّحْمَٰنِ الرَّحِيمِ']
+
+
+@pytest.fixture
+def corpus(api, tmp_path):
+    return api.QuranCorpus(str(tmp_path / 'quran.db'))
+
+
+def alquran_handler(surahs):
+    """Faux AlQuran Cloud: /surah/<n>/<édition>, 404 pour une sourate inconnue"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        requests = []
+
+        def do_GET(self):
+            Handler.requests.append(self.path)
+            _, _, number, _ = self.path.split('/')
+            if int(number) not in surahs:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = json.dumps({'code': 200, 'data': {'ayahs': [
+                {'numberInSurah': n, 'text': text} for n, text in enumerate(surahs[int(number)], 1)]}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def test_import_tanzil_text(corpus, tmp_path):
+    source = tmp_path / 'quran.txt'
+    source.write_text('# Tanzil\n' + ''.join(f"1|{n}|{text}\n" for n, text in enumerate(FATIHA, 1))
+                      + '112|1|قُلْ هُوَ اللَّهُ أَحَدٌ\n', encoding='utf-8')
+
+    assert corpus.import_edition('quran-test', str(source)) == 4
+    assert corpus.get(1, 2, 'quran-test') == FATIHA[1]
+    assert corpus.range(1, 1, 3, 'quran-test') == FATIHA
+    assert corpus.ayah_count('quran-test', 112) == 1
+    assert corpus.stats() == {'editions': {'quran-test': {'surahs': 2, 'ayahs': 4, 'complete': False}},
+                              'remote_fetches': 0}
+
+
+def test_import_alquran_json(corpus, tmp_path):
+    source = tmp_path / 'quran.json'
+    source.write_text(json.dumps({'data': {'surahs': [{'number': 1, 'ayahs': [
+        {'numberInSurah': n, 'text': text} for n, text in enumerate(FATIHA, 1)]}]}}), encoding='utf-8')
+
+    assert corpus.import_edition('en.test', str(source)) == 3
+    assert corpus.range(1, 2, 3, 'en.test') == FATIHA[1:]
+
+
+def test_reimport_replaces_texts(corpus, tmp_path):
+    source = tmp_path / 'quran.txt'
+    source.write_text('1|1|old\n', encoding='utf-8')
+    corpus.import_edition('quran-test', str(source))
+    source.write_text('1|1|new\n', encoding='utf-8')
+    corpus.import_edition('quran-test', str(source))
+
+    assert corpus.get(1, 1, 'quran-test') == 'new'
+    assert corpus.stats()['editions']['quran-test']['ayahs'] == 1
+
+
+def test_missing_surah_is_fetched_once(corpus, http_server):
+    handler = alquran_handler({1: FATIHA})
+    corpus.API_URL = http_server(handler).url
+
+    assert corpus.get(1, 1, 'quran-remote') == FATIHA[0]
+    assert corpus.range(1, 1, 3, 'quran-remote') == FATIHA
+    assert handler.requests == ['/surah/1/quran-remote']
+    assert corpus.stats()['remote_fetches'] == 1
+
+
+def test_invalid_lookups(corpus, http_server):
+    handler = alquran_handler({1: FATIHA})
+    corpus.API_URL = http_server(handler).url
+
+    with pytest.raises(ValueError, match='Sourate invalide'):
+        corpus.get(115, 1, 'quran-remote')
+    with pytest.raises(ValueError, match='Plage invalide'):
+        corpus.range(1, 2, 8, 'quran-remote')
+    with pytest.raises(ValueError, match='introuvable'):
+        corpus.get(2, 1, 'quran-remote')
+    assert corpus.ayah_count('quran-remote', 2) is None
+
+
+def test_import_quran_cli(api, corpus, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, 'quran_corpus', corpus)
+    source = tmp_path / 'quran.txt'
+    source.write_text(''.join(f"1|{n}|{text}\n" for n, text in enumerate(FATIHA, 1)), encoding='utf-8')
+
+    result = api.app.test_cli_runner().invoke(args=['import-quran', 'quran-cli', '--file', str(source)])
+
+    assert result.exit_code == 0, result.output
+    assert '3 ayahs' in result.output
+    assert corpus.range(1, 1, 3, 'quran-cli') == FATIHA
@@ -0,0 +1,60 @@
+"""Jobs servis depuis le cache de rendu (complete_from_cache)"""
+from pathlib import Path
+
+import pytest
+
+CONFIG = {'resolution': '1080p', 'crf': 23}
+
+
+@pytest.fixture
+def cached_render(api):
+    path = api.render_cache.path_for('k' * 64)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'cached render')
+    yield path
+    path.unlink(missing_ok=True)
+
+
+def output(api, name):
+    return Path(api.app.config['OUTPUT_FOLDER']) / f"{name}.mp4"
+
+
+def complete(api, job_id, cached_path, name, dedupe_key='dedupe:1'):
+    with api.app.test_request_context():
+        return api.complete_from_cache(job_id, cached_path, 'bismillah', name, CONFIG, None, dedupe_key)
+
+
+def test_new_job_is_published_from_cache(api, job_store, sent_webhooks, cached_render):
+    response, code = complete(api, 'job1', cached_render, 'cache-new')
+
+    assert code == 200 and response.json['cached'] is True
+    job = job_store.get('job1')
+    assert job['status'] == 'completed'
+    assert job['download_url'] == '/api/download/cache-new.mp4'
+    assert output(api, 'cache-new').stat().st_ino == cached_render.stat().st_ino
+    entry = api.output_catalog.get('cache-new.mp4')
+    assert (entry['job_id'], entry['config']) == ('job1', CONFIG)
+
+
+def test_attached_request_does_not_publish(api, job_store, sent_webhooks, cached_render):
+    job_store.create({'id': 'first', 'status': 'generating_video', 'progress': 50,
+                      'started_at': '2026-10-01T10:00:00', 'dedupe_key': 'dedupe:1'})
+    output(api, 'cache-attached').write_bytes(b'other job output')
+
+    response, code = complete(api, 'job2', cached_render, 'cache-attached')
+
+    assert code == 202
+    assert response.json['job_id'] == 'first' and response.json['deduplicated'] is True
+    assert job_store.get('job2') is None
+    assert output(api, 'cache-attached').read_bytes() == b'other job output'
+
+
+def test_evicted_entry_falls_back_to_render(api, job_store, sent_webhooks, cached_render):
+    output(api, 'cache-evicted').write_bytes(b'previous output')
+    cached_render.unlink()
+
+    assert complete(api, 'job3', cached_render, 'cache-evicted') is None
+    assert job_store.get('job3') is None
+    assert not sent_webhooks
+    # Le fichier déjà publié sous ce nom n'a pas été supprimé par la liaison ratée
+    assert output(api, 'cache-evicted').read_bytes() == b'previous output'
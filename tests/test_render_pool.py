@@ -0,0 +1,72 @@
+"""RenderPool: admission control (429 + Retry-After)"""
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def blocked_pool(api):
+    """Pool dont les jobs attendent release.set() avant de se terminer"""
+    release = threading.Event()
+    started = []
+
+    def job(job_id):
+        started.append(job_id)
+        release.wait(5)
+
+    def make(workers, queue):
+        return api.RenderPool(workers, queue), job, started
+
+    yield make
+    release.set()
+
+
+def wait_running(pool, count):
+    for _ in range(200):
+        if pool.stats()['running'] == count:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_idle_workers_absorb_jobs_beyond_the_queue(api, blocked_pool):
+    pool, job, _ = blocked_pool(2, 1)
+
+    assert pool.submit('a', job) == 1
+    assert pool.submit('b', job) >= 1
+    assert wait_running(pool, 2)
+    assert pool.submit('c', job) == 1  # Dans la file
+    assert pool.position('c') == 1
+    assert pool.is_full()
+
+    with pytest.raises(api.QueueFullError) as error:
+        pool.submit('d', job)
+    assert error.value.retry_after >= 1
+    assert pool.stats() == {'max_workers': 2, 'max_queue': 1, 'running': 2, 'queued': 1}
+
+
+def test_retry_after_grows_with_queue_waves(api, blocked_pool):
+    pool, job, _ = blocked_pool(1, 4)
+    pool.submit('a', job)
+    assert wait_running(pool, 1)
+    for job_id in 'bcde':
+        pool.submit(job_id, job)
+
+    # 4 jobs en file pour 1 worker: 5 vagues de la durée moyenne d'un job
+    assert pool.retry_after() == int(5 * pool._avg_job_seconds)
+    assert pool.position('e') == 4 and pool.position('a') is None
+
+
+def test_generate_answers_429_when_the_pool_is_full(api, job_store, blocked_pool, monkeypatch):
+    pool, job, _ = blocked_pool(1, 0)
+    pool.submit('busy', job)
+    assert wait_running(pool, 1)
+    monkeypatch.setattr(api, 'render_pool', pool)
+
+    response = api.app.test_client().post('/api/generate', json={
+        'verse_text': 'بِسْمِ اللَّهِ', 'audio_url': 'http://127.0.0.1:9/a.mp3'})
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == response.json['retry_after'] >= 1
+    assert job_store.count() == 0  # Aucun job créé pour une requête refusée
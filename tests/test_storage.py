@@ -0,0 +1,100 @@
+"""StorageManager: âge max, quota, espace libre avant admission"""
+import os
+import time
+
+import pytest
+
+
+def publish(api, folder, name, size, last_access):
+    path = folder / name
+    path.write_bytes(b'v' * size)
+    api.output_catalog.add(path)
+    api.output_catalog.touch(name, last_access)
+    return path
+
+
+@pytest.fixture
+def disk(api, output_folder, monkeypatch):
+    """Disque simulé: espace libre de base + octets des fichiers supprimés qui n'avaient qu'un lien"""
+    state = {'base': 0, 'sole': {}}
+
+    def free_bytes():
+        return state['base'] + sum(size for path, size in state['sole'].items() if not path.exists())
+
+    def make(max_bytes=0, max_age=0, min_free_bytes=0):
+        manager = api.StorageManager(output_folder, max_bytes, max_age, min_free_bytes, 0)
+        monkeypatch.setattr(manager, 'free_bytes', free_bytes)
+        return manager
+
+    def track(path):
+        if path.stat().st_nlink == 1:
+            state['sole'][path] = path.stat().st_size
+        return path
+
+    state['make'] = make
+    state['track'] = track
+    return state
+
+
+def test_old_videos_are_removed(api, output_folder, disk):
+    now = time.time()
+    old = publish(api, output_folder, 'old.mp4', 100, now - 7200)
+    recent = publish(api, output_folder, 'recent.mp4', 100, now - 60)
+    manager = disk['make'](max_age=3600)
+
+    assert manager.sweep() == 100
+    assert not old.exists() and recent.exists()
+    assert api.output_catalog.names() == ['recent.mp4']
+    assert (manager.evicted_files, manager.reclaimed_bytes) == (1, 100)
+
+
+def test_quota_evicts_least_recently_downloaded_first(api, output_folder, disk):
+    now = time.time()
+    for n, name in enumerate(['a.mp4', 'b.mp4', 'c.mp4']):
+        publish(api, output_folder, name, 100, now - 300 + n * 100)
+    api.output_catalog.touch('a.mp4', now)  # a téléchargée en dernier
+    manager = disk['make'](max_bytes=250)
+
+    manager.sweep()
+    assert sorted(api.output_catalog.names()) == ['a.mp4', 'c.mp4']
+    assert api.output_catalog.totals() == (2, 200)
+
+
+def test_has_room_evicts_only_videos_that_free_the_disk(api, output_folder, disk, tmp_path):
+    now = time.time()
+    linked = publish(api, output_folder, 'linked.mp4', 500, now - 300)
+    os.link(linked, tmp_path / 'render-cache-entry.mp4')  # Même inode que le cache de rendu
+    sole = disk['track'](publish(api, output_folder, 'sole.mp4', 300, now - 200))
+    disk['base'] = 100
+    manager = disk['make'](min_free_bytes=50)
+
+    assert manager.has_room(300)  # 350 nécessaires: seule sole.mp4 libère le disque
+    assert linked.exists() and not sole.exists()
+
+
+def test_has_room_refuses_without_evicting_when_eviction_cannot_help(api, output_folder, disk):
+    sole = disk['track'](publish(api, output_folder, 'sole.mp4', 300, time.time()))
+    disk['base'] = 100
+    manager = disk['make'](min_free_bytes=50)
+
+    assert not manager.has_room(1000)
+    assert sole.exists()
+    assert manager.evicted_files == 0
+
+
+def test_has_room_without_pressure(api, output_folder, disk):
+    disk['base'] = 10 ** 9
+    assert disk['make'](min_free_bytes=2 ** 20).has_room(10 ** 6)
+
+
+@pytest.mark.parametrize('value, kbps', [('192k', 192), ('192K', 192), ('1M', 1000), ('1.5M', 1500),
+                                         (128000, 128), ('bogus', 128)])
+def test_bitrate_kbps(api, value, kbps):
+    assert api.bitrate_kbps(value, default='128k') == kbps
+
+
+def test_estimate_output_bytes(api):
+    config = {'resolution': '1080p', 'audio_bitrate': '192k'}
+    # 4000k vidéo (maxrate 1080p) + 192k audio, 60 s, +10%
+    assert api.estimate_output_bytes(config, 60) == int(4192 * 1000 / 8 * 60 * 1.1)
+    assert api.estimate_output_bytes(config, None) == 0
@@ -0,0 +1,40 @@
+"""/api/stream: slots d'attente partagés avec long-poll et SSE"""
+import pytest
+
+
+@pytest.fixture
+def job_events(api, monkeypatch):
+    events = api.JobEvents(1, poll_interval=0.05)
+    monkeypatch.setattr(api, 'job_events', events)
+    return events
+
+
+def test_stream_takes_a_waiter_slot(api, job_store, job_events, tmp_path):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'\x00' * 1024)
+    job_store.create({'id': 'job1', 'status': 'completed', 'progress': 100,
+                      'started_at': '2026-10-01T10:00:00', 'output_path': str(video)})
+    client = api.app.test_client()
+
+    first = client.get('/api/stream/job1', buffered=False)
+    assert first.status_code == 200 and job_events.waiters == 1
+
+    second = client.get('/api/stream/job1')
+    assert second.status_code == 503
+    assert second.headers['Retry-After'] == '5'
+    # SSE et flux vidéo puisent dans les mêmes slots
+    assert client.get('/api/status/job1?stream=1').status_code == 503
+
+    assert b''.join(first.response) == b'\x00' * 1024
+    first.close()
+    assert job_events.waiters == 0
+
+
+def test_unknown_or_failed_job_takes_no_slot(api, job_store, job_events):
+    job_store.create({'id': 'failed', 'status': 'error', 'progress': 0,
+                      'started_at': '2026-10-01T10:00:00', 'error': 'Audio illisible (ffprobe)'})
+    client = api.app.test_client()
+
+    assert client.get('/api/stream/missing').status_code == 404
+    assert client.get('/api/stream/failed').status_code == 409
+    assert job_events.waiters == 0
@@ -0,0 +1,147 @@
+"""WebhookDispatcher contre un récepteur HTTP local"""
+import http.server
+import json
+import time
+
+import pytest
+
+
+def receiver(responses):
+    """
+    Handler qui répond aux POST avec les statuts de responses (liste de (statut, en-têtes)),
+    puis 204 une fois la liste épuisée; chaque essai est noté (chemin, X-Job-Id, corps, instant)
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        attempts = []
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            Handler.attempts.append((self.path, self.headers.get('X-Job-Id'), body, time.monotonic()))
+            status, headers = responses.pop(0) if responses else (204, {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def make_dispatcher(api):
+    def make(workers=2, max_pending=10, retries=3, max_backoff=300):
+        return api.WebhookDispatcher(workers, max_pending, retries, timeout=5, backoff=0.05,
+                                     max_backoff=max_backoff)
+    return make
+
+
+def test_payload_is_posted_with_job_id(make_dispatcher, http_server):
+    handler = receiver([])
+    server = http_server(handler)
+    dispatcher = make_dispatcher()
+
+    assert dispatcher.submit(f"{server.url}/done", {'id': 'job1', 'status': 'completed'})
+    assert wait_for(lambda: dispatcher.stats()['delivered'] == 1)
+
+    (path, job_id, body, _), = handler.attempts
+    assert (path, job_id, body) == ('/done', 'job1', {'id': 'job1', 'status': 'completed'})
+
+
+@pytest.mark.parametrize('status', [503, 429])
+def test_retryable_status_is_retried_after_retry_after(make_dispatcher, http_server, status):
+    handler = receiver([(status, {'Retry-After': '1'})])
+    server = http_server(handler)
+    dispatcher = make_dispatcher()
+
+    dispatcher.submit(f"{server.url}/done", {'id': 'job1'})
+    assert wait_for(lambda: dispatcher.stats()['delivered'] == 1)
+
+    assert len(handler.attempts) == 2
+    # Retry-After (1s) l'emporte sur le backoff (0.05s)
+    assert handler.attempts[1][3] - handler.attempts[0][3] >= 0.9
+    assert dispatcher.stats() == {'pending': 0, 'delivered': 1, 'failed': 0, 'dropped': 0}
+
+
+def test_retry_after_is_capped(make_dispatcher, http_server):
+    handler = receiver([(503, {'Retry-After': '3600'})])
+    server = http_server(handler)
+    dispatcher = make_dispatcher(max_backoff=0.2)
+
+    dispatcher.submit(f"{server.url}/done", {'id': 'job1'})
+    assert wait_for(lambda: dispatcher.stats()['delivered'] == 1, timeout=3)
+    assert len(handler.attempts) == 2
+
+
+def test_retries_are_bounded(make_dispatcher, http_server):
+    handler = receiver([(500, {})] * 10)
+    server = http_server(handler)
+    dispatcher = make_dispatcher(retries=2)
+
+    dispatcher.submit(f"{server.url}/done", {'id': 'job1'})
+    assert wait_for(lambda: dispatcher.stats()['failed'] == 1)
+
+    assert len(handler.attempts) == 3
+    assert dispatcher.stats()['delivered'] == 0
+
+
+def test_client_error_is_final(make_dispatcher, http_server):
+    handler = receiver([(400, {}), (404, {})])
+    server = http_server(handler)
+    dispatcher = make_dispatcher()
+
+    dispatcher.submit(f"{server.url}/bad", {'id': 'job1'})
+    dispatcher.submit(f"{server.url}/gone", {'id': 'job2'})
+    assert wait_for(lambda: dispatcher.stats()['failed'] == 2)
+    time.sleep(0.3)  # Laisse le temps à un éventuel retry (backoff 0.05s)
+
+    assert len(handler.attempts) == 2
+    assert dispatcher.stats()['delivered'] == 0
+
+
+def test_pending_retry_does_not_block_other_deliveries(make_dispatcher, http_server):
+    handler = receiver([(503, {'Retry-After': '2'})])
+    server = http_server(handler)
+    dispatcher = make_dispatcher(workers=1)
+
+    dispatcher.submit(f"{server.url}/slow", {'id': 'job1'})
+    assert wait_for(lambda: len(handler.attempts) == 1)
+    dispatcher.submit(f"{server.url}/fast", {'id': 'job2'})
+    assert wait_for(lambda: dispatcher.stats()['delivered'] == 1, timeout=1.5)
+
+    assert [attempt[1] for attempt in handler.attempts] == ['job1', 'job2']
+    assert wait_for(lambda: dispatcher.stats()['delivered'] == 2)
+
+
+def test_full_queue_drops_notification(make_dispatcher):
+    # Aucun worker: les livraisons restent en file
+    dispatcher = make_dispatcher(workers=0, max_pending=2)
+
+    assert dispatcher.submit('http://127.0.0.1:9/a', {'id': 'job1'})
+    assert dispatcher.submit('http://127.0.0.1:9/b', {'id': 'job2'})
+    assert not dispatcher.submit('http://127.0.0.1:9/c', {'id': 'job3'})
+
+    assert dispatcher.stats() == {'pending': 2, 'delivered': 0, 'failed': 0, 'dropped': 1}
+
+
+def test_threads_start_on_first_submit(api, make_dispatcher, http_server):
+    server = http_server(receiver([]))
+    dispatcher = make_dispatcher(workers=2)
+    assert dispatcher._threads == []
+
+    dispatcher.submit(f"{server.url}/done", {'id': 'job1'})
+    dispatcher.submit(f"{server.url}/done", {'id': 'job2'})
+    assert len(dispatcher._threads) == 2
+    assert wait_for(lambda: dispatcher.stats()['delivered'] == 2)
+
@@ -0,0 +1,90 @@
+"""JobWorkspace: nettoyage à la sortie, balayage des espaces orphelins"""
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def folders(api, tmp_path, monkeypatch):
+    paths = {name: tmp_path / name for name in ('uploads', 'temp', 'tmpfs', 'outputs')}
+    for path in paths.values():
+        path.mkdir()
+    monkeypatch.setitem(api.app.config, 'UPLOAD_FOLDER', str(paths['uploads']))
+    monkeypatch.setitem(api.app.config, 'TEMP_FOLDER', str(paths['temp']))
+    monkeypatch.setitem(api.app.config, 'WORKSPACE_TMPFS', str(paths['tmpfs']))
+    monkeypatch.setitem(api.app.config, 'OUTPUT_FOLDER', str(paths['outputs']))
+    return paths
+
+
+def test_workspace_is_removed_on_exit(api, folders):
+    with pytest.raises(RuntimeError):
+        with api.JobWorkspace('job1') as workspace:
+            open(workspace.path('background.mp4'), 'w').close()
+            open(workspace.small_path('subs.ass'), 'w').close()
+            assert workspace.small_path('subs.ass').startswith(str(folders['tmpfs']))
+            raise RuntimeError('échec du rendu')
+
+    for folder in folders.values():
+        assert not list(folder.iterdir())
+
+
+def test_sweep_removes_only_orphans(api, folders):
+    for name in ('dead', 'alive'):
+        (folders['uploads'] / name).mkdir()
+        (folders['temp'] / f"{name}.ass").write_text('')
+        (folders['outputs'] / f"video.mp4.{name}.part").write_bytes(b'')
+    (folders['uploads'] / '.crashed.lock').write_text('')  # Verrou d'un process tué
+    (folders['outputs'] / 'video.mp4').write_bytes(b'final')
+
+    with api.JobWorkspace('alive'):
+        api.sweep_orphan_workspaces()
+        assert sorted(p.name for p in folders['uploads'].iterdir()) == ['.alive.lock', 'alive']
+        assert [p.name for p in folders['temp'].iterdir()] == ['alive.ass']
+        assert sorted(p.name for p in folders['outputs'].iterdir()) == ['video.mp4', 'video.mp4.alive.part']
+
+
+def test_fresh_workspace_survives_a_concurrent_sweep(api, folders):
+    entered = threading.Event()
+    leave = threading.Event()
+    intact = []
+
+    def job():
+        with api.JobWorkspace('fresh'):
+            entered.set()
+            leave.wait(5)
+            intact.append((folders['uploads'] / 'fresh').is_dir() and (folders['tmpfs'] / 'fresh').is_dir())
+
+    # Le balayage tient le verrou du job: le job attend la fin de la suppression pour créer ses dossiers
+    (folders['tmpfs'] / 'fresh').mkdir()
+    with api.JobWorkspace.claim_orphan('fresh') as orphan:
+        assert orphan
+        thread = threading.Thread(target=job)
+        thread.start()
+        time.sleep(0.2)
+        assert not entered.is_set()
+        (folders['tmpfs'] / 'fresh').rmdir()
+    assert entered.wait(5)
+
+    # Job démarré: un balayage ne touche plus à son espace
+    api.sweep_orphan_workspaces()
+    leave.set()
+    thread.join()
+    assert intact == [True]
+    for folder in folders.values():
+        assert not list(folder.iterdir())
+
+
+def test_claim_fails_while_the_job_runs(api, folders):
+    with api.JobWorkspace('job1'):
+        with api.JobWorkspace.claim_orphan('job1') as orphan:
+            assert not orphan
+    with api.JobWorkspace.claim_orphan('job1') as orphan:
+        assert orphan
+    assert not list(folders['uploads'].iterdir())
+
+
+@pytest.mark.parametrize('name, job_id', [('abc123', 'abc123'), ('abc123.part000.mp4', 'abc123'),
+                                          ('.abc123.lock', 'abc123'), ('.hidden', '')])
+def test_workspace_job_id(api, name, job_id):
+    assert api.workspace_job_id(name) == job_id